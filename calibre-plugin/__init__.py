@@ -65,6 +65,14 @@ class ActionLibby(InterfaceActionBase):
 
     actual_plugin = f"calibre_plugins.{PLUGIN_NAME}.action:OverdriveLibbyAction"
 
+    def load_actual_plugin(self, gui):
+        # set before the plugin modules are imported, so that
+        # enforce_types knows that it is running inside calibre
+        from .tools.guiMode import GuiMode
+
+        GuiMode.IsAvailable = True
+        return super().load_actual_plugin(gui)
+
     def is_customizable(self):
         """
         This method must return True to enable customization via
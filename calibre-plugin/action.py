@@ -36,12 +36,17 @@ from .dialog import (
     SearchDialogMixin,
     AdvancedSearchDialogMixin,
 )
+from .download_queue import DownloadQueue
+from .overdrive import SHARED_SEARCH_CACHE
 from .utils import (
+    ASSET_STORE,
     CARD_ICON,
+    COVER_CACHE,
     COVER_PLACEHOLDER,
     ICON_MAP,
     PluginImages,
-    SimpleCache,
+    SqliteCache,
+    SyncSnapshot,
     svg_to_qicon,
 )
 from .tools.guiMode import GuiMode
@@ -183,13 +188,22 @@ class OverdriveLibbyAction(InterfaceAction):
                 "https://www.mobileread.com/forums/showthread.php?t=354816"
             ),
         )
-        self.libraries_cache = SimpleCache(
-            persist_to_path=PLUGIN_DIR.joinpath(f"{PLUGIN_NAME}.libraries.json"),
+        self.libraries_cache = SqliteCache(
+            persist_to_path=PLUGIN_DIR.joinpath(f"{PLUGIN_NAME}.libraries.sqlite"),
             cache_age_days=PREFS[PreferenceKeys.CACHE_AGE_DAYS],
+            migrate_from_path=PLUGIN_DIR.joinpath(f"{PLUGIN_NAME}.libraries.json"),
         )
-        self.media_cache = SimpleCache(
-            persist_to_path=PLUGIN_DIR.joinpath(f"{PLUGIN_NAME}.media.json"),
+        self.media_cache = SqliteCache(
+            persist_to_path=PLUGIN_DIR.joinpath(f"{PLUGIN_NAME}.media.sqlite"),
             cache_age_days=PREFS[PreferenceKeys.CACHE_AGE_DAYS],
+            migrate_from_path=PLUGIN_DIR.joinpath(f"{PLUGIN_NAME}.media.json"),
+        )
+        self.sync_snapshot = SyncSnapshot(
+            PLUGIN_DIR.joinpath(f"{PLUGIN_NAME}.sync.json.gz")
+        )
+        # outlives the dialog, so that downloads continue after it is closed
+        self.download_queue = DownloadQueue(
+            PLUGIN_DIR.joinpath(f"{PLUGIN_NAME}.downloads.json")
         )
 
     def main_dialog_finished(self):
@@ -197,9 +211,11 @@ class OverdriveLibbyAction(InterfaceAction):
 
     def clear_cache(self):
         self.libraries_cache.clear()
-        self.libraries_cache.save()
         self.media_cache.clear()
-        self.media_cache.save()
+        self.sync_snapshot.clear()
+        COVER_CACHE.clear()
+        ASSET_STORE.clear()
+        SHARED_SEARCH_CACHE.clear()
 
     def show_dialog(self):
         base_plugin_object = self.interface_action_base_plugin
@@ -222,6 +238,8 @@ class OverdriveLibbyAction(InterfaceAction):
                 self.resources,
                 self.libraries_cache,
                 self.media_cache,
+                self.sync_snapshot,
+                self.download_queue,
             )
             self.main_dialog.finished.connect(self.main_dialog_finished)
             window_title = _("OverDrive Libby v{version}{dev}").format(
@@ -256,8 +274,27 @@ class OverdriveLibbyDialog(
     LoansDialogMixin,
     BaseDialogMixin,
 ):
-    def __init__(self, gui, icon, do_user_config, icons, libraries_cache, media_cache):
-        super().__init__(gui, icon, do_user_config, icons, libraries_cache, media_cache)
+    def __init__(
+        self,
+        gui,
+        icon,
+        do_user_config,
+        icons,
+        libraries_cache,
+        media_cache,
+        sync_snapshot,
+        download_queue,
+    ):
+        super().__init__(
+            gui,
+            icon,
+            do_user_config,
+            icons,
+            libraries_cache,
+            media_cache,
+            sync_snapshot,
+            download_queue,
+        )
 
         # this non-intuitive code is because Windows
         size_hint = self.sizeHint()
@@ -0,0 +1,225 @@
+#
+# Copyright (C) 2023 github.com/ping
+#
+# This file is part of the OverDrive Libby Plugin by ping
+# OverDrive Libby Plugin for calibre / libby-calibre-plugin
+#
+# See https://github.com/ping/libby-calibre-plugin for more
+# information
+#
+# Now being maintained at https://github.com/sgmoore/libby-calibre-plugin
+#
+
+import hashlib
+import os
+import tempfile
+import time
+from pathlib import Path
+from threading import Lock
+from typing import Callable, List, Optional, Tuple
+
+from .tools.CustomLogger import CustomLogger
+
+
+class AssetStore(object):
+    """
+    An on-disk, content-addressed store for the template assets of magazines,
+    e.g. the css and fonts that most issues of a magazine share.
+
+    Assets are saved once by their content hash, with an index from the roster url path
+    to the hash for each magazine, so that later issues and re-downloads can use them
+    without fetching them again. Patched versions of assets are saved by the hash of the
+    original content and the patch, so that the patching is also only done once.
+
+    Least recently used files are removed when the store exceeds max_bytes.
+    """
+
+    # issue-specific assets, e.g. pages and images, are not stored
+    SHARED_MEDIA_TYPES = (
+        "text/css",
+        "font/",
+        "application/font",
+        "application/x-font",
+        "application/vnd.ms-fontobject",
+        "application/vnd.ms-opentype",
+    )
+
+    def __init__(
+        self, folder: Path, max_bytes: int = 50 * 1024 * 1024, max_age_days: int = 30
+    ):
+        """
+
+        :param folder:
+        :param max_bytes:
+        :param max_age_days: Age after which an indexed path is fetched again, in case
+                             the magazine's template has changed
+        """
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.max_age_days = max_age_days
+        self.lock = Lock()
+        self._total_bytes: Optional[int] = None  # calculated on first write
+
+    @staticmethod
+    def content_hash(data: bytes) -> str:
+        return hashlib.sha256(data).hexdigest()
+
+    @classmethod
+    def is_shared(cls, media_type: Optional[str]) -> bool:
+        return bool(media_type) and media_type.startswith(cls.SHARED_MEDIA_TYPES)  # type: ignore[union-attr]
+
+    def _path(self, kind: str, key: str) -> Path:
+        return self.folder.joinpath(kind, key[:2], key)
+
+    @staticmethod
+    def _index_key(scope: str, path: str) -> str:
+        return hashlib.sha1(f"{scope}|{path}".encode("utf-8")).hexdigest()
+
+    def _read(self, kind: str, key: str) -> Optional[bytes]:
+        path = self._path(kind, key)
+        try:
+            data = path.read_bytes()
+            os.utime(path)  # mark as recently used
+            return data
+        except OSError:
+            return None
+
+    def _write(self, kind: str, key: str, data: bytes) -> None:
+        path = self._path(kind, key)
+        temp_name = None
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            # unique per write, the fetch threads can store the same asset at the same time
+            fd, temp_name = tempfile.mkstemp(suffix=".tmp", dir=path.parent)
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            previous_size = path.stat().st_size if path.exists() else 0
+            Path(temp_name).replace(path)
+        except OSError as err:
+            CustomLogger.logger.warning("Unable to store asset: %s", err)
+            if temp_name:
+                Path(temp_name).unlink(missing_ok=True)
+            return
+        with self.lock:
+            if self._total_bytes is None:
+                self._total_bytes = sum(f.stat().st_size for f, _ in self._files())
+            else:
+                self._total_bytes += len(data) - previous_size
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+
+    def get_asset(self, scope: str, path: str) -> Optional[bytes]:
+        """
+        Get a stored asset.
+
+        :param scope: Shared by the titles that can use the same assets, e.g. the parent magazine ID
+        :param path: Roster url path
+        :return: None if the asset is not stored, or has expired
+        """
+        index = self._read("index", self._index_key(scope, path))
+        if not index:
+            return None
+        try:
+            content_hash, stored_at = index.decode("ascii").split()
+            if time.time() - float(stored_at) > self.max_age_days * 24 * 60 * 60:
+                return None
+        except ValueError:
+            return None
+        data = self._read("blobs", content_hash)
+        if data is None or self.content_hash(data) != content_hash:
+            return None
+        return data
+
+    def put_asset(self, scope: str, path: str, data: bytes) -> str:
+        """
+        Store an asset.
+
+        :param scope:
+        :param path:
+        :param data:
+        :return: The content hash
+        """
+        content_hash = self.content_hash(data)
+        if not self._path("blobs", content_hash).exists():
+            self._write("blobs", content_hash, data)
+        self._write(
+            "index",
+            self._index_key(scope, path),
+            f"{content_hash} {time.time()}".encode("ascii"),
+        )
+        return content_hash
+
+    def get_or_fetch(
+        self,
+        scope: str,
+        path: str,
+        media_type: Optional[str],
+        fetch: Callable[[], bytes],
+    ) -> bytes:
+        """
+        Get a shared asset from the store, or fetch it and store it.
+        Other assets are always fetched.
+
+        :param scope:
+        :param path:
+        :param media_type:
+        :param fetch:
+        :return:
+        """
+        if not self.is_shared(media_type):
+            return fetch()
+        data = self.get_asset(scope, path)
+        if data is not None:
+            return data
+        data = fetch()
+        if data:
+            self.put_asset(scope, path, data)
+        return data
+
+    def patched(self, data: bytes, patch_id: str, patch: Callable[[bytes], bytes]) -> bytes:
+        """
+        Get the stored result of a patch, or patch the data and store the result.
+
+        :param data:
+        :param patch_id: Identifies the patch. Change it when the patch changes.
+        :param patch: Must only depend on the data
+        :return:
+        """
+        key = self.content_hash(f"{patch_id}|{self.content_hash(data)}".encode("utf-8"))
+        result = self._read("patched", key)
+        if result is None:
+            result = patch(data)
+            self._write("patched", key, result)
+        return result
+
+    def _files(self) -> List[Tuple[Path, float]]:
+        files = []
+        for f in self.folder.glob("*/*/*"):
+            if f.suffix == ".tmp":
+                continue
+            try:
+                files.append((f, f.stat().st_mtime))
+            except OSError:
+                pass
+        return files
+
+    def _evict(self) -> None:
+        # oldest first
+        for f, _ in sorted(self._files(), key=lambda x: x[1]):
+            if self._total_bytes is None or self._total_bytes <= self.max_bytes * 0.9:
+                break
+            try:
+                file_size = f.stat().st_size
+                f.unlink()
+                self._total_bytes -= file_size
+            except OSError:
+                pass
+
+    def clear(self) -> None:
+        with self.lock:
+            for f, _ in self._files():
+                try:
+                    f.unlink()
+                except OSError:
+                    pass
+            self._total_bytes = 0
@@ -0,0 +1,180 @@
+#
+# Copyright (C) 2023 github.com/ping
+#
+# This file is part of the OverDrive Libby Plugin by ping
+# OverDrive Libby Plugin for calibre / libby-calibre-plugin
+#
+# See https://github.com/ping/libby-calibre-plugin for more
+# information
+#
+# Now being maintained at https://github.com/sgmoore/libby-calibre-plugin
+#
+
+from os.path import expanduser
+from pathlib import Path
+from threading import Event, Lock
+from typing import Callable, Dict, List, Optional
+
+from polyglot.builtins import as_unicode
+
+from .config import PREFS, PreferenceKeys
+from .download import LibbyDownload
+from .download_queue import DownloadQueue, PermanentDownloadError
+from .libby import LibbyClient
+from .magazine_download import CustomMagazineDownload
+from .models import get_media_title
+from .overdrive import OverDriveClient
+from .tools.CustomLogger import CustomLogger
+from .tools.WatchForFile import wait_for_file
+
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from .tools.lint_helper import load_translations
+    from calibre.utils.localization import _
+
+load_translations()
+
+# Browser-assisted downloads are found by their extension in the downloads folder,
+# so only one download for each extension can be watched for at a time
+_watch_locks: Dict[str, Lock] = {}
+_watch_locks_lock = Lock()
+
+
+def _watch_lock(extension: str) -> Lock:
+    with _watch_locks_lock:
+        return _watch_locks.setdefault(extension, Lock())
+
+
+class BatchLoanDownload(LibbyDownload):
+    """
+    Downloads the loans in a DownloadQueue as a single job.
+
+    Magazines are downloaded directly. Ebooks are downloaded by the browser
+    and picked up from the downloads folder, as with a single download,
+    so open_url has to be a Dispatcher created in the GUI thread.
+    """
+
+    KIND_EBOOK = "ebook"
+    KIND_MAGAZINE = "magazine"
+
+    def __call__(
+        self,
+        gui,
+        libby_client: LibbyClient,
+        overdrive_client: OverDriveClient,
+        download_queue: DownloadQueue,
+        open_url: Callable[[str], None],
+        log=None,
+        abort=None,
+        notifications=None,
+    ) -> List[Dict]:
+
+        def format_progress(finished: int, total: int, message: str) -> str:
+            text = _("Downloaded {finished} of {total} loans").format(
+                finished=finished, total=total
+            )
+            return f"{text}: {message}" if message else text
+
+        def download(entry: Dict, entry_notifications, entry_abort: Optional[Event]):
+            if entry["details"]["kind"] == self.KIND_MAGAZINE:
+                self._download_magazine(
+                    gui, libby_client, overdrive_client, entry, entry_abort, entry_notifications
+                )
+            else:
+                self._download_ebook(
+                    gui, open_url, entry, entry_abort, entry_notifications
+                )
+
+        return download_queue.run(
+            download,
+            notifications=notifications,
+            abort=abort,
+            format_progress=format_progress,
+        )
+
+    @staticmethod
+    def _get_metadata(gui, book_id: int):
+        if not book_id:
+            return None
+        return gui.current_db.new_api.get_metadata(book_id)
+
+    def _download_magazine(
+        self,
+        gui,
+        libby_client: LibbyClient,
+        overdrive_client: OverDriveClient,
+        entry: Dict,
+        abort: Optional[Event],
+        notifications,
+    ) -> None:
+        loan = entry["loan"]
+        details = entry["details"]
+        CustomMagazineDownload()(
+            gui,
+            libby_client,
+            overdrive_client,
+            loan,
+            details["card"],
+            details["library"],
+            details["format_id"],
+            details.get("book_id", 0),
+            self._get_metadata(gui, details.get("book_id", 0)),
+            f'{loan["id"]}.{LibbyClient.get_file_extension(details["format_id"])}',
+            details.get("tags", []),
+            abort=abort,
+            notifications=notifications,
+        )
+
+    def _download_ebook(
+        self,
+        gui,
+        open_url: Callable[[str], None],
+        entry: Dict,
+        abort: Optional[Event],
+        notifications,
+    ) -> None:
+        loan = entry["loan"]
+        details = entry["details"]
+        format_id = details["format_id"]
+        folder = expanduser(PREFS[PreferenceKeys.DOWNLOADS_FOLDER])
+        extension = "." + LibbyClient.get_file_extension(format_id)
+        title = as_unicode(get_media_title(loan), errors="replace")
+
+        downloaded_filepath: Optional[Path] = None
+        try:
+            with _watch_lock(extension):
+                notifications.put((0.1, _("Waiting for {book} in browser").format(book=title)))
+                CustomLogger.log_simple_string(
+                    f'Opening {details["url"]} and watching {folder} for {extension}'
+                )
+                open_url(details["url"])
+                downloaded_filepath = wait_for_file(
+                    folder,
+                    extension,
+                    cancel_callback=lambda: bool(abort and abort.is_set()),
+                )
+            if not downloaded_filepath:
+                raise PermanentDownloadError(
+                    f"Download of {title} timed out or was cancelled"
+                )
+            notifications.put((0.9, _("Adding {book}").format(book=title)))
+            self.add(
+                gui,
+                loan,
+                details["card"],
+                details["library"],
+                format_id,
+                downloaded_filepath,
+                details.get("book_id", 0),
+                details.get("tags", []),
+                self._get_metadata(gui, details.get("book_id", 0)),
+            )
+        finally:
+            try:
+                if downloaded_filepath:
+                    downloaded_filepath.unlink(missing_ok=True)
+            except Exception as e:
+                CustomLogger.logger.warning(
+                    f"Could not remove temp file {downloaded_filepath} : {e} "
+                )
@@ -90,8 +90,12 @@ class PreferenceKeys:
     AUTOMATICALLY_CREATE_ENTRY_IN_CALIBRE_AFTER_BORROWING = "automatically_create_entry_in_calibre_after_borrowing"
     NETWORK_TIMEOUT = "network_timeout"
     NETWORK_RETRY = "network_retry"
+    NETWORK_CONCURRENCY = "network_concurrency"
+    DOWNLOAD_CONCURRENCY = "download_concurrency"
+    DOWNLOAD_HOST_CONCURRENCY = "download_host_concurrency"
     SEARCH_RESULTS_MAX = "search_results_max"
     SEARCH_LIBRARIES = "search_libraries"
+    SEARCH_CACHE_MINUTES = "search_cache_minutes"
     CUSTCOL_BORROWED_DATE = "custcol_borrowed_dt"
     CUSTCOL_DUE_DATE = "custcol_due_dt"
     CUSTCOL_LOAN_TYPE = "custcol_loan_type"
@@ -140,10 +144,14 @@ class PreferenceTexts:
     AUTOMATICALLY_CREATE_ENTRY_IN_CALIBRE_AFTER_BORROWING = _("Automatically Create Entry in calibre after borrowing")
     NETWORK_TIMEOUT = _("Connection timeout")
     NETWORK_RETRY = _c("Retry attempts")
+    NETWORK_CONCURRENCY = _("Concurrent requests")
+    DOWNLOAD_CONCURRENCY = _("Concurrent downloads")
+    DOWNLOAD_HOST_CONCURRENCY = _("Concurrent downloads per site")
     SEARCH_RESULTS_MAX = _("Maximum search results")
     SEARCH_LIBRARIES = _("Library Keys (comma-separated, max: {n})").format(
         n=MAX_SEARCH_LIBRARIES
     )
+    SEARCH_CACHE_MINUTES = _("Reuse search results for")
     CUSTCOL_BORROWED_DATE = _("Custom column for Borrowed Date")
     CUSTCOL_DUE_DATE = _("Custom column for Due Date")
     CUSTCOL_LOAN_TYPE = _("Custom column for Loan Type")
@@ -176,8 +184,12 @@ PREFS.defaults[PreferenceKeys.ALWAYS_DOWNLOAD_AS_NEW] = False
 PREFS.defaults[PreferenceKeys.AUTOMATICALLY_CREATE_ENTRY_IN_CALIBRE_AFTER_BORROWING] = False
 PREFS.defaults[PreferenceKeys.NETWORK_TIMEOUT] = 30
 PREFS.defaults[PreferenceKeys.NETWORK_RETRY] = 1
+PREFS.defaults[PreferenceKeys.NETWORK_CONCURRENCY] = 4
+PREFS.defaults[PreferenceKeys.DOWNLOAD_CONCURRENCY] = 2
+PREFS.defaults[PreferenceKeys.DOWNLOAD_HOST_CONCURRENCY] = 1
 PREFS.defaults[PreferenceKeys.SEARCH_RESULTS_MAX] = 20
 PREFS.defaults[PreferenceKeys.SEARCH_LIBRARIES] = []
+PREFS.defaults[PreferenceKeys.SEARCH_CACHE_MINUTES] = 5
 PREFS.defaults[PreferenceKeys.CUSTCOL_BORROWED_DATE] = ""
 PREFS.defaults[PreferenceKeys.CUSTCOL_DUE_DATE] = ""
 PREFS.defaults[PreferenceKeys.CUSTCOL_LOAN_TYPE] = ""
@@ -676,6 +688,19 @@ class ConfigWidget(QWidget):
         search_layout.addRow(
             PreferenceTexts.SEARCH_RESULTS_MAX, self.search_results_max_txt
         )
+        self.search_cache_minutes_txt = QSpinBox(self)
+        self.search_cache_minutes_txt.setToolTip(
+            _(
+                "Repeating a library search within this time does not search the library again, "
+                "only the availability of the titles is updated. Set to 0 to always search again."
+            )
+        )
+        self.search_cache_minutes_txt.setSuffix(_(" minute(s)"))
+        self.search_cache_minutes_txt.setRange(0, 60)
+        self.search_cache_minutes_txt.setValue(PREFS[PreferenceKeys.SEARCH_CACHE_MINUTES])
+        search_layout.addRow(
+            PreferenceTexts.SEARCH_CACHE_MINUTES, self.search_cache_minutes_txt
+        )
         self.search_libraries_txt = QTextEdit(self)
         self.search_libraries_txt.setToolTip(
             _("This determines the libraries that will be used for search.")
@@ -782,6 +807,40 @@ class ConfigWidget(QWidget):
         self.network_retry_txt.setValue(PREFS[PreferenceKeys.NETWORK_RETRY])
         network_layout.addRow(PreferenceTexts.NETWORK_RETRY, self.network_retry_txt)
 
+        self.network_concurrency_txt = QSpinBox(self)
+        self.network_concurrency_txt.setToolTip(
+            _(
+                "The maximum number of requests made at the same time, e.g. when syncing or downloading magazines"
+            )
+        )
+        self.network_concurrency_txt.setRange(1, 8)
+        self.network_concurrency_txt.setValue(PREFS[PreferenceKeys.NETWORK_CONCURRENCY])
+        network_layout.addRow(
+            PreferenceTexts.NETWORK_CONCURRENCY, self.network_concurrency_txt
+        )
+
+        self.download_concurrency_txt = QSpinBox(self)
+        self.download_concurrency_txt.setToolTip(
+            _("The maximum number of loans downloaded at the same time when downloading new loans")
+        )
+        self.download_concurrency_txt.setRange(1, 4)
+        self.download_concurrency_txt.setValue(PREFS[PreferenceKeys.DOWNLOAD_CONCURRENCY])
+        network_layout.addRow(
+            PreferenceTexts.DOWNLOAD_CONCURRENCY, self.download_concurrency_txt
+        )
+
+        self.download_host_concurrency_txt = QSpinBox(self)
+        self.download_host_concurrency_txt.setToolTip(
+            _("The maximum number of loans downloaded from the same site at the same time")
+        )
+        self.download_host_concurrency_txt.setRange(1, 4)
+        self.download_host_concurrency_txt.setValue(
+            PREFS[PreferenceKeys.DOWNLOAD_HOST_CONCURRENCY]
+        )
+        network_layout.addRow(
+            PreferenceTexts.DOWNLOAD_HOST_CONCURRENCY, self.download_host_concurrency_txt
+        )
+
         self.resize(self.sizeHint())
 
     def generate_code_btn_clicked(self):
@@ -1032,9 +1091,21 @@ class ConfigWidget(QWidget):
         PREFS[PreferenceKeys.NETWORK_RETRY] = int(
             self.network_retry_txt.cleanText().strip()
         )
+        PREFS[PreferenceKeys.NETWORK_CONCURRENCY] = int(
+            self.network_concurrency_txt.cleanText().strip()
+        )
+        PREFS[PreferenceKeys.DOWNLOAD_CONCURRENCY] = int(
+            self.download_concurrency_txt.cleanText().strip()
+        )
+        PREFS[PreferenceKeys.DOWNLOAD_HOST_CONCURRENCY] = int(
+            self.download_host_concurrency_txt.cleanText().strip()
+        )
         PREFS[PreferenceKeys.SEARCH_RESULTS_MAX] = int(
             self.search_results_max_txt.cleanText().strip()
         )
+        PREFS[PreferenceKeys.SEARCH_CACHE_MINUTES] = int(
+            self.search_cache_minutes_txt.cleanText().strip()
+        )
         PREFS[PreferenceKeys.SEARCH_LIBRARIES] = list(
             set(
                 [
@@ -9,8 +9,9 @@
 #
 # Now being maintained at https://github.com/sgmoore/libby-calibre-plugin
 #
+from dataclasses import replace
 from threading import Lock
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Tuple
 from datetime import datetime
 
 from calibre.constants import DEBUG, config_dir 
@@ -24,7 +25,6 @@ from qt.core import (
     QHBoxLayout,
     QLineEdit,
     QRadioButton,
-    QThread,
     QWidget,
     Qt,
     QHeaderView,
@@ -49,10 +49,20 @@ from ..libby import LibbyFormats
 from ..models import (
     LibbySearchModel,
     LibbySearchSortFilterModel,
+    SearchResultsMerger,
+)
+from ..overdrive import (
+    LibraryMediaSearchParams,
+    LibrarySearchPlanner,
+    SearchPagePrefetches,
 )
-from ..overdrive import LibraryMediaSearchParams
 from ..utils import PluginImages
-from ..workers import OverDriveLibraryMediaSearchWorker
+from ..workers import (
+    SHARED_EXECUTOR,
+    OverDriveLibraryMediaSearchWorker,
+    WorkerPriority,
+    WorkerTask,
+)
 
 from .. import PLUGIN_NAME, PLUGINS_FOLDER_NAME
 from ..tools.CustomLogger import CustomLogger, Redactor
@@ -66,6 +76,10 @@ if TYPE_CHECKING:
 
 load_translations()
 
+# Budget for fetching the next page in the background while the current one is shown
+ADV_SEARCH_PREFETCH_MAX_REQUESTS = 12  # libraries prefetched per page
+ADV_SEARCH_PREFETCH_MAX_ITEMS = 600  # prefetched items kept in memory
+
 def getSearchResultsFolder() :
     from pathlib import Path
     PLUGIN_DIR = Path(config_dir, PLUGINS_FOLDER_NAME)
@@ -82,8 +96,24 @@ class AdvancedSearchDialogMixin(SearchBaseDialog):
         self.maximum_number_of_pages = 0 
         self.current_page_no = 1
 
-        self._lib_search_threads: List[QThread] = []
+        self._lib_search_threads: List[WorkerTask] = []
         self._lib_search_result_sets: Dict[str, List[Dict]] = {}
+        # number of matches by library, None if the search did not say
+        self._lib_search_totals: Dict[str, Optional[int]] = {}
+        self._adv_search_merger = SearchResultsMerger()
+        # identifies the worker tasks of the current search
+        self._adv_search_group = object()
+        self.finished.connect(self.cancel_adv_search)
+        # rows from the previous pages of the search
+        self._adv_search_previous_rows: List[Dict] = []
+        self._adv_search_query: Optional[LibraryMediaSearchParams] = None
+        self._adv_search_library_keys: List[str] = []
+        # last page number of each library, from the results of the current search
+        self._adv_search_last_pages: Dict[str, int] = {}
+        # next page of the search, fetched in the background
+        self._adv_prefetches: SearchPagePrefetches[WorkerTask] = SearchPagePrefetches(
+            ADV_SEARCH_PREFETCH_MAX_ITEMS
+        )
         self.lock = Lock()
 
         adv_search_widget = QWidget()
@@ -308,6 +338,11 @@ class AdvancedSearchDialogMixin(SearchBaseDialog):
         self.loan_removed.connect(self.loan_removed_advsearch)
         self.hold_added.connect(self.hold_added_advsearch)
         self.hold_removed.connect(self.hold_removed_advsearch)
+        self.tabs.currentChanged.connect(self.tab_current_changed_advsearch)
+
+    def tab_current_changed_advsearch(self, index: int):
+        if index == self.adv_search_tab_index and not self._has_running_search():
+            self.refresh_availability(self.adv_search_model)
 
 
     # Normally the columns on the search results are re-sized automatically, but occasionally I have seen this fail, 
@@ -337,19 +372,27 @@ class AdvancedSearchDialogMixin(SearchBaseDialog):
         self.adv_search_model.sync(value)
 
    
+    def _expire_cached_availability(self, media: Dict):
+        if self.overdrive_client.search_cache and media.get("id"):
+            self.overdrive_client.search_cache.expire_availability([media["id"]])
+
     def loan_added_advsearch(self, loan: Dict):
+        self._expire_cached_availability(loan)
         self.adv_search_model.add_loan(loan)
         self.adv_search_results_view.selectionModel().clearSelection()
 
     def loan_removed_advsearch(self, loan: Dict):
+        self._expire_cached_availability(loan)
         self.adv_search_model.remove_loan(loan)
         self.adv_search_results_view.selectionModel().clearSelection()
 
     def hold_added_advsearch(self, hold: Dict):
+        self._expire_cached_availability(hold)
         self.adv_search_model.add_hold(hold)
         self.adv_search_results_view.selectionModel().clearSelection()
 
     def hold_removed_advsearch(self, hold: Dict):
+        self._expire_cached_availability(hold)
         self.adv_search_model.remove_hold(hold)
         self.adv_search_results_view.selectionModel().clearSelection()
 
@@ -383,6 +426,41 @@ class AdvancedSearchDialogMixin(SearchBaseDialog):
                 return True
         return False
     
+    def cancel_adv_search(self):
+        cancelled = SHARED_EXECUTOR.cancel_group(self._adv_search_group)
+        CustomLogger.logger.debug("Cancelled %d library searches", cancelled)
+        self._adv_search_group = object()
+        self._discard_prefetched_pages()
+
+    def _discard_prefetched_pages(self):
+        self._adv_prefetches.discard()
+
+    def _prefetch_next_page(self):
+        """
+        Fetch the next page of the current search in the background,
+        so that "More" can show it without waiting.
+        """
+        self._discard_prefetched_pages()
+        if not self._adv_search_query:
+            return
+        query = replace(self._adv_search_query, page=self.current_page_no)
+        library_keys = [
+            k
+            for k in self._adv_search_library_keys
+            if self._adv_search_last_pages.get(k, 0) >= self.current_page_no
+        ][:ADV_SEARCH_PREFETCH_MAX_REQUESTS]
+        planner = LibrarySearchPlanner(self.overdrive_client, library_keys, query)
+        threads = {
+            library_key: self._get_adv_search_thread(
+                self.overdrive_client, library_key, query, planner
+            )
+            for library_key in library_keys
+        }
+        # tracked before starting, so that results are not processed as a normal search
+        self._adv_prefetches.start(query, threads)
+        for thread in threads.values():
+            thread.start()
+
     def re_enable_search(self) :
         self.adv_search_btn.setText(_c("Search"))
         self.adv_search_btn.setEnabled(True)
@@ -404,13 +482,16 @@ class AdvancedSearchDialogMixin(SearchBaseDialog):
     def adv_search_btn_clicked(self):
         if self.current_page_no <= 1 :
             self.adv_search_model.sync({"search_results": []}, True)
+            self._discard_prefetched_pages()
+            self._adv_search_last_pages = {}
 
         self.maximum_number_of_pages = 0
         
         self.adv_search_results_view.sortByColumn(-1, Qt.AscendingOrder)
         self._reset_borrow_hold_buttons()
         if self._has_running_search():
-            return
+            # a new search replaces the one still running
+            self.cancel_adv_search()
 
         if not PREFS[PreferenceKeys.INCL_NONDOWNLOADABLE_TITLES]:
             formats = [
@@ -477,15 +558,47 @@ class AdvancedSearchDialogMixin(SearchBaseDialog):
         )
         self._lib_search_threads = []
         self._lib_search_result_sets = {}
-
-      
-
+        self._lib_search_totals = {}
+        self._adv_search_merger = SearchResultsMerger()
+        self._adv_search_previous_rows = list(self.adv_search_model._rows)
+        self._adv_search_query = query
+        self._adv_search_library_keys = list(library_keys)
+        self.mark_availability_refreshed(self.adv_search_model)
+
+        # results still to come from the claimed prefetches are processed as a normal search
+        prefetched, prefetched_results = self._adv_prefetches.claim(query)
+        ready_results: List[Tuple[str, Optional[Dict]]] = []
+        # the libraries that will be searched, the others are already answered
+        planned_library_keys = [
+            k
+            for k in library_keys
+            if k not in prefetched
+            and k not in prefetched_results
+            and self.current_page_no
+            <= self._adv_search_last_pages.get(k, self.current_page_no)
+        ]
+        planner = LibrarySearchPlanner(
+            self.overdrive_client, planned_library_keys, query
+        )
         for library_key in library_keys:
-            search_thread = self._get_adv_search_thread(
-                self.overdrive_client, library_key, query
-            )
+            last_page = self._adv_search_last_pages.get(library_key)
+            if last_page is not None and self.current_page_no > last_page:
+                # the library has no more results for this search
+                ready_results.append((library_key, None))
+                continue
+            if library_key in prefetched_results:
+                ready_results.append((library_key, prefetched_results[library_key]))
+                continue
+            search_thread = prefetched.get(library_key)
+            if search_thread is None:
+                search_thread = self._get_adv_search_thread(
+                    self.overdrive_client, library_key, query, planner
+                )
+                search_thread.start()
             self._lib_search_threads.append(search_thread)
-            search_thread.start()
+
+        for library_key, results in ready_results:
+            self._process_search_results(library_key, results)
 
     def adv_search_for(self, title: str, author: str):
         self.tabs.setCurrentIndex(self.adv_search_tab_index)
@@ -499,6 +612,7 @@ class AdvancedSearchDialogMixin(SearchBaseDialog):
     def _process_search_results(self, library_key, results : Optional[Dict] ):
         with self.lock:
             CustomLogger.logger.debug(f"Type of results = {type(results)}")
+            totalItems: Optional[int]
             if results is None :
                 search_items = []
                 totalItems = 0
@@ -511,25 +625,30 @@ class AdvancedSearchDialogMixin(SearchBaseDialog):
                 CustomLogger.log_simple_string (f'{library_key} returned {len(search_items)} items (noPerPage = {noPerPage})')
                
 
-                try :
-                    totalItems = results["facets"]["availability"]["items"][0]["totalItems"]
-                except Exception : 
+                if "facets" not in results :
+                    # results from a multi-library search have no facets, and no total
+                    totalItems = results.get("totalItems")
+                else :
                     try :
-                        totalItems = results["facets"]["availability"]["items"][1]["totalItems"]
-                    except Exception as e2:
-                        CustomLogger.logger.debug("")
-                        CustomLogger.logger.exception(e2)
+                        totalItems = results["facets"]["availability"]["items"][0]["totalItems"]
+                    except Exception : 
                         try :
-                            CustomLogger.log_simple_string(f'item[0] = {results["facets"]["availability"]["items"]}')
-                        except Exception as e3:
-                            CustomLogger.logger.exception(e3)
-                        totalItems = 0
+                            totalItems = results["facets"]["availability"]["items"][1]["totalItems"]
+                        except Exception as e2:
+                            CustomLogger.logger.debug("")
+                            CustomLogger.logger.exception(e2)
+                            try :
+                                CustomLogger.log_simple_string(f'item[0] = {results["facets"]["availability"]["items"]}')
+                            except Exception as e3:
+                                CustomLogger.logger.exception(e3)
+                            totalItems = 0
                                  
                 try :
                     totalItems2 = results["totalItems"]
                     CustomLogger.logger.debug(f'item[3] = {totalItems2}')
                     lastPageNo = results["links"]["last"]["page"]
                     CustomLogger.logger.debug(f'lastPageNo = {lastPageNo}')
+                    self._adv_search_last_pages[library_key] = lastPageNo
 
                     if (lastPageNo > self.maximum_number_of_pages) :
                         self.maximum_number_of_pages = lastPageNo
@@ -539,12 +658,27 @@ class AdvancedSearchDialogMixin(SearchBaseDialog):
 
 
             self._lib_search_result_sets[library_key] = search_items
+            if results is not None :
+                self._lib_search_totals[library_key] = totalItems
+            CustomLogger.log_simple_string(library_key + " " + str(len(search_items)))
+
+            # show the results merged so far without waiting for the other libraries
+            changed = self._adv_search_merger.add_library_results(
+                library_key, search_items
+            )
+            self.adv_search_model.merge_search_results(
+                self._adv_search_previous_rows,
+                self._adv_search_merger.ordered_items(),
+                changed,
+            )
+            self.unsetCursor()
+
             found_library_keys = self._lib_search_result_sets.keys()
-            if len(found_library_keys) != len(self._lib_search_threads):
+            if len(found_library_keys) != len(self._adv_search_library_keys):
                 pending_libraries = [
-                    t.library_key
-                    for t in self._lib_search_threads
-                    if t.library_key not in found_library_keys
+                    k
+                    for k in self._adv_search_library_keys
+                    if k not in found_library_keys
                 ]
                 self.status_bar.showMessage(
                     _("Waiting for {libraries}...").format(
@@ -553,69 +687,7 @@ class AdvancedSearchDialogMixin(SearchBaseDialog):
                 )
                 return
 
-        
             self.status_bar.clearMessage()
-            combined_search_results: Dict[str, Dict] = {}
-            
-            for lib_key, result_items in self._lib_search_result_sets.items():
-                CustomLogger.log_simple_string(lib_key + " " + str(len(result_items)))
-
-                for item_rank, item in enumerate(result_items, start=1):
-                    site_availability = {}
-                    for k in (
-                        "advantageKey",
-                        "availabilityType",
-                        "availableCopies",
-                        "estimatedWaitDays",
-                        "formats",
-                        "holdsCount",
-                        "holdsRatio",
-                        "isAdvantageFiltered",
-                        "isAvailable",
-                        "isOwned",
-                        "isRecommendableToLibrary",
-                        "isFastlane",
-                        "isHoldable",
-                        "juvenileEligible",
-                        "luckyDayAvailableCopies",
-                        "luckyDayOwnedCopies",
-                        "ownedCopies",
-                        "visitorEligible",
-                        "youngAdultEligible",
-                    ):
-                        if k in item:
-                            site_availability[k] = item.pop(k)
-                    site_availability["advantageKey"] = library_key
-                    item.setdefault("siteAvailabilities", {})
-                    item.setdefault("__item_ranks", [])
-                    item.setdefault("formats", [])
-                    title_id = item["id"]
-                    CustomLogger.logger.debug (str(item_rank) + " " + title_id)
-                    combined_search_results.setdefault(title_id, item)
-                    # merge site availabilities
-                    combined_search_results[title_id]["siteAvailabilities"][
-                        lib_key
-                    ] = site_availability
-                    # merge item ranks
-                    combined_search_results[title_id]["__item_ranks"].append(item_rank)
-                    # merge formats
-                    existing_format_ids = [
-                        f["id"]
-                        for f in combined_search_results[title_id].get("formats", [])
-                    ]
-                    for f in site_availability.get("formats", []):
-                        if f["id"] not in existing_format_ids:
-                            combined_search_results[title_id]["formats"].append(f)
-
-            ordered_search_result_items = sorted(
-                combined_search_results.values(),
-                key=lambda r: (
-                    sum(r["__item_ranks"]) / len(r["__item_ranks"]),  # average rank
-                    1 / len(r["__item_ranks"]),
-                ),
-            )
-
-            noOfResults = len(ordered_search_result_items)
             # per_page=PREFS[PreferenceKeys.SEARCH_RESULTS_MAX]
 
             if (self.maximum_number_of_pages > 1 ) : 
@@ -624,6 +696,7 @@ class AdvancedSearchDialogMixin(SearchBaseDialog):
                     self.adv_search_btn.setText(_c("More")) 
                     self.adv_search_btn.setEnabled(True)
                     self.adv_search_btn.setToolTip(_c("Get Page") + f" {self.current_page_no} " + _c("of") + f" {self.maximum_number_of_pages}")
+                    self._prefetch_next_page()
                 else :
                     self.adv_search_btn.setText(_c("No more"))
                     self.adv_search_btn.setToolTip("")
@@ -634,20 +707,17 @@ class AdvancedSearchDialogMixin(SearchBaseDialog):
                 self.adv_search_btn.setToolTip("")                
                 self.adv_search_btn.setEnabled(True)
 
-            self.adv_search_model.sync({"search_results": ordered_search_result_items}, False)
             CustomLogger.logger.debug(f"Synced : {self.adv_search_model.rowCount()} of {totalItems}")
 
             noOfResults = self.adv_search_model.rowCount()
 
-            self.unsetCursor()
-
-            if totalItems == 1 and noOfResults == 1 :
-                message = _c("1 result found")
+            # results merged from several libraries cannot be compared with their totals,
+            # and a multi-library search does not return the total at all
+            totals = list(self._lib_search_totals.values())
+            if len(totals) == 1 and totals[0] is not None and totals[0] != noOfResults :
+                message = _c("{n} of {totalItems} results found").format(n=noOfResults, totalItems=totals[0])
             else :
-                message =  _c("{n} of {totalItems} results found {totalItems2} {lastPageNo}").format(n=noOfResults, totalItems=totalItems , totalItems2=totalItems2, lastPageNo = lastPageNo )
-
-            message = ngettext("{n} result found", "{n} results found", noOfResults, ).format(n=noOfResults)
-          
+                message = ngettext("{n} result found", "{n} results found", noOfResults, ).format(n=noOfResults)
 
             self.status_bar.showMessage(message)
                
@@ -655,22 +725,39 @@ class AdvancedSearchDialogMixin(SearchBaseDialog):
 
 
     def _get_adv_search_thread(
-        self, overdrive_client, library_key: str, query: LibraryMediaSearchParams
-    ):
-        thread = QThread()
+        self,
+        overdrive_client,
+        library_key: str,
+        query: LibraryMediaSearchParams,
+        planner: Optional[LibrarySearchPlanner] = None,
+    ) -> WorkerTask:
         worker = OverDriveLibraryMediaSearchWorker()
-        worker.setup(overdrive_client, library_key, query)
-        worker.moveToThread(thread)
+        worker.setup(overdrive_client, library_key, query, planner)
+        thread = WorkerTask(
+            worker.run, priority=WorkerPriority.Bulk, group=self._adv_search_group
+        )
         thread.library_key = library_key
         thread.worker = worker
-        thread.started.connect(worker.run)
 
         def done(lib_key: str, results: Dict):
             thread.quit()
+            if thread.cancelled:
+                # superseded by a new search
+                return
+            if self._adv_prefetches.is_prefetch(lib_key, thread):
+                # only shown once the user asks for the page
+                self._adv_prefetches.store(lib_key, thread, results)
+                return
             self._process_search_results(lib_key, results) # results.get("items", []))
 
         def errored_out(lib_key: str, err: Exception):
             thread.quit()
+            if thread.cancelled:
+                return
+            if self._adv_prefetches.is_prefetch(lib_key, thread):
+                # the page is fetched again if the user asks for it
+                self._adv_prefetches.drop(lib_key, thread)
+                return
             CustomLogger.logger.warning(
                 "Error encountered during search (%s): %s", lib_key, err
             )
@@ -10,7 +10,9 @@
 # Now being maintained at https://github.com/sgmoore/libby-calibre-plugin
 #
 import json
+import time
 from collections import OrderedDict
+from datetime import datetime, timezone
 from functools import cmp_to_key, partial
 from typing import Dict, List, Optional
 
@@ -43,7 +45,6 @@ from qt.core import (
     QSizePolicy,
     QStatusBar,
     QTabWidget,
-    QThread,
     QVBoxLayout,
     QWidget,
     Qt,
@@ -54,6 +55,7 @@ from .widgets import ClickableQLabel, CustomLoadingOverlay, DefaultQPushButton
 from .. import DEMO_MODE
 from ..compat import _c, ngettext_c
 from ..config import PREFS, PreferenceKeys, BorrowActions, SearchMode
+from ..download_queue import DownloadQueue
 from ..empty_download import EmptyBookDownload
 from ..hold_actions import LibbyHoldCreate
 from ..libby import LibbyClient, LibbyMediaTypes
@@ -66,20 +68,28 @@ from ..models import (
     CREATOR_ROLE_TRANSLATION,
     LOAN_TYPE_TRANSLATION,
     LibbyModel,
+    LibraryMatchIndex,
     get_media_title,
     truncate_for_display,
 )
-from ..overdrive import OverDriveClient
+from ..overdrive import OverDriveClient, SHARED_SEARCH_CACHE
 from ..overdrive.errors import ClientConnectionError as OverDriveConnectionError
 from ..utils import (
     OD_IDENTIFIER,
     PluginImages,
-    SimpleCache,
+    SqliteCache,
+    SyncSnapshot,
     generate_od_identifier,
     rating_to_stars,
     svg_to_pixmap,    
 )
-from ..workers import OverDriveMediaWorker, SyncDataWorker
+from ..workers import (
+    AvailabilityRefreshWorker,
+    OverDriveMediaWorker,
+    SyncDataWorker,
+    WorkerPriority,
+    WorkerTask,
+)
 from ..tools.CustomLogger import CustomLogger
 from ..tools.decorators import enforce_types
 from ..tools.error import Error
@@ -93,6 +103,9 @@ if TYPE_CHECKING:
 
 load_translations()
 
+# Shown availability is refreshed when its tab is shown again after this many seconds
+AVAILABILITY_REFRESH_SECONDS = 120
+
 guid_empty_download = EmptyBookDownload()
 
 
@@ -127,6 +140,8 @@ class BaseDialogMixin(QDialog):
 
     search_mode_changed = pyqtSignal(str)
     hide_title_already_in_lib_pref_changed = pyqtSignal(bool)
+    library_db_event = pyqtSignal(object, object)
+    library_books_changed = pyqtSignal()
     sync_starting = pyqtSignal()
     sync_ended = pyqtSignal(dict)
     loan_added = pyqtSignal(dict)
@@ -140,8 +155,10 @@ class BaseDialogMixin(QDialog):
         icon,
         do_user_config,
         resources: Dict,
-        libraries_cache: SimpleCache,
-        media_cache: SimpleCache,
+        libraries_cache: SqliteCache,
+        media_cache: SqliteCache,
+        sync_snapshot: SyncSnapshot,
+        download_queue: DownloadQueue,
     ):
         super().__init__(gui)
         self.setAttribute(Qt.WA_DeleteOnClose)
@@ -149,10 +166,28 @@ class BaseDialogMixin(QDialog):
         self.do_user_config = do_user_config
         self.resources = resources
         self.db = gui.current_db.new_api
+        self.library_index = LibraryMatchIndex(self.db)
+        # calibre calls db listeners from its own thread, so queue the
+        # event to update the index in the UI thread
+        self.library_db_event.connect(
+            self.library_db_event_received, type=Qt.QueuedConnection
+        )
+        # db listeners are not available in older calibre versions
+        self.db_listener_supported = hasattr(self.db, "add_listener")
+        if self.db_listener_supported:
+            self.db.add_listener(self.db_listener)
         self.client = None
-        self._sync_thread = QThread()  # main sync thread
+        self._sync_thread: Optional[WorkerTask] = None  # main sync thread
         self.libraries_cache = libraries_cache
         self.media_cache = media_cache
+        self.sync_snapshot = sync_snapshot
+        self.download_queue = download_queue
+        # state from the last session, shown while the first sync is running
+        self._stale_sync_state: Dict = {}
+        self._snapshot_checked = False
+        # id(model) -> when its availability was last fetched
+        self._availability_refreshed_at: Dict[int, float] = {}
+        self._availability_threads: Dict[int, WorkerTask] = {}
         self.setWindowIcon(icon)
         self.view_vspan = 1
         self.view_hspan = 7
@@ -168,9 +203,11 @@ class BaseDialogMixin(QDialog):
                 max_retries=PREFS[PreferenceKeys.NETWORK_RETRY],
                 timeout=PREFS[PreferenceKeys.NETWORK_TIMEOUT],
             )
+        SHARED_SEARCH_CACHE.ttl = PREFS[PreferenceKeys.SEARCH_CACHE_MINUTES] * 60
         self.overdrive_client = OverDriveClient(
             max_retries=PREFS[PreferenceKeys.NETWORK_RETRY],
             timeout=PREFS[PreferenceKeys.NETWORK_TIMEOUT],
+            search_cache=SHARED_SEARCH_CACHE,
         )
 
         layout = QGridLayout()
@@ -218,6 +255,19 @@ class BaseDialogMixin(QDialog):
             CustomLogger.logger.debug("Saved new UI height preference: %d", new_height)
         self.libraries_cache.save()
         self.media_cache.save()
+        if self.db_listener_supported:
+            self.db.remove_listener(self.db_listener)
+
+    def db_listener(self, db, event_type, event_data):
+        try:
+            self.library_db_event.emit(event_type, event_data)
+        except RuntimeError:
+            # dialog has been closed
+            pass
+
+    def library_db_event_received(self, event_type, event_data):
+        if self.library_index.handle_db_event(event_type, event_data):
+            self.library_books_changed.emit()
 
     def add_tab(self, widget, label) -> int:
         """
@@ -420,22 +470,111 @@ class BaseDialogMixin(QDialog):
         if not self.client:
             self.status_bar.showMessage(_("Libby is not configured yet."))
             return
-        if not self._sync_thread.isRunning():
+        if not (self._sync_thread and self._sync_thread.isRunning()):
+            if not self.db_listener_supported:
+                # no change events, so refresh the index on each sync instead
+                self.library_index.rebuild()
+            if self.show_sync_snapshot():
+                # keep the stale state visible and usable while refreshing
+                self._sync_thread = self._get_sync_thread()
+                self._sync_thread.start()
+                return
             self.status_bar.showMessage(_("Synchronizing..."))
             self.loading_overlay(_("Synchronizing..."))
             self.sync_starting.emit()
             self._sync_thread = self._get_sync_thread()
             self._sync_thread.start()
 
+    def show_sync_snapshot(self) -> bool:
+        """
+        Show the sync state saved from the last session. Only done once, when the dialog is opened.
+
+        :return: True if a saved state was shown
+        """
+        if self._snapshot_checked:
+            return False
+        self._snapshot_checked = True
+        synced_state, synced_at = self.sync_snapshot.load(
+            PREFS[PreferenceKeys.LIBBY_TOKEN]
+        )
+        if not synced_state:
+            return False
+        self._stale_sync_state = synced_state
+        self.sync_ended.emit(synced_state)
+        synced_at_text = (
+            format_date(
+                dt_as_local(datetime.fromtimestamp(synced_at, tz=timezone.utc)),
+                tweaks["gui_timestamp_display_format"],
+            )
+            if synced_at
+            else ""
+        )
+        self.status_bar.showMessage(
+            _("Showing data last synced {synced_at}. Synchronizing...").format(
+                synced_at=synced_at_text
+            )
+        )
+        return True
+
+    def mark_availability_refreshed(self, model):
+        """
+        Record that the availability in the model is up to date, e.g. after a sync or search.
+
+        :param model: A model with availability_title_ids() and refresh_availability()
+        :return:
+        """
+        self._availability_refreshed_at[id(model)] = time.monotonic()
+
+    def refresh_availability(self, model, force: bool = False):
+        """
+        Refresh the availability shown in a holds or search model in the background,
+        with bulk availability requests grouped by library.
+
+        :param model: A model with availability_title_ids() and refresh_availability()
+        :param force: Refresh even if the availability was refreshed recently
+        :return:
+        """
+        thread = self._availability_threads.get(id(model))
+        if thread is not None and thread.isRunning():
+            return
+        refreshed_at = self._availability_refreshed_at.get(id(model))
+        if (
+            not force
+            and refreshed_at is not None
+            and time.monotonic() - refreshed_at < AVAILABILITY_REFRESH_SECONDS
+        ):
+            return
+        title_ids_by_library = model.availability_title_ids()
+        if not title_ids_by_library:
+            return
+        self.mark_availability_refreshed(model)
+
+        worker = AvailabilityRefreshWorker()
+        worker.setup(self.overdrive_client, title_ids_by_library)
+        thread = WorkerTask(worker.run, priority=WorkerPriority.Normal)
+        thread.worker = worker
+
+        def done(availabilities: Dict):
+            thread.quit()
+            model.refresh_availability(availabilities)
+
+        def errored_out(err: Exception):
+            thread.quit()
+            CustomLogger.logger.warning("Unable to refresh availability: %s", err)
+
+        worker.finished.connect(lambda availabilities: done(availabilities))
+        worker.errored.connect(lambda err: errored_out(err))
+        self._availability_threads[id(model)] = thread
+        thread.start()
+
     def _get_sync_thread(self):
-        thread = QThread()
         worker = SyncDataWorker()
-        worker.setup(self.libraries_cache, self.media_cache)
-        worker.moveToThread(thread)
+        worker.setup(self.libraries_cache, self.media_cache, self.sync_snapshot)
+        thread = WorkerTask(worker.run, priority=WorkerPriority.Normal)
         thread.worker = worker
-        thread.started.connect(worker.run)
 
         def loaded(value: Dict):
+            self._stale_sync_state = {}
             new_identity_token = value.get("identity", "")
             if (
                 new_identity_token
@@ -477,7 +616,8 @@ class BaseDialogMixin(QDialog):
                 thread.quit()
 
         def errored_out(err: Exception):
-            self.sync_ended.emit({})
+            # if a stale state is showing, keep it rather than clearing everything
+            self.sync_ended.emit(self._stale_sync_state)
             try:
                 thread.quit()
                 self.loading_overlay.hide()
@@ -867,7 +1007,7 @@ class BookPreviewDialog(QDialog):
         self.setAttribute(Qt.WA_DeleteOnClose)
         self.setWindowTitle(_c("Book details"))
 
-        self._media_info_thread = QThread()
+        self._media_info_thread: Optional[WorkerTask] = None
 
         layout = QGridLayout()
         self.layout = layout
@@ -904,7 +1044,7 @@ class BookPreviewDialog(QDialog):
             self.close_btn, self.widget_row_pos + 2, 0, 1, 2, alignment=Qt.AlignCenter
         )
 
-        if not self._media_info_thread.isRunning():
+        if not (self._media_info_thread and self._media_info_thread.isRunning()):
             self._media_info_thread = self._get_media_info_thread(
                 self.client, self.media["id"], self.parent().media_cache
             )
@@ -912,12 +1052,10 @@ class BookPreviewDialog(QDialog):
             self._media_info_thread.start()
 
     def _get_media_info_thread(self, overdrive_client, title_id, media_cache):
-        thread = QThread()
         worker = OverDriveMediaWorker()
         worker.setup(overdrive_client, title_id, media_cache)
-        worker.moveToThread(thread)
+        thread = WorkerTask(worker.run, priority=WorkerPriority.Interactive)
         thread.worker = worker
-        thread.started.connect(worker.run)
 
         def loaded(media):
             try:
@@ -30,7 +30,6 @@ from qt.core import (
     QProgressBar,
     QScrollArea,
     QSizePolicy,
-    QThread,
     QVBoxLayout,
     QWidget,
     Qt,
@@ -48,7 +47,13 @@ from ..utils import (
     obfuscate_int,
     obfuscate_name,
 )
-from ..workers import LibbyAuthFormWorker, LibbyRenameCardWorker, LibbyVerifyCardWorker
+from ..workers import (
+    LibbyAuthFormWorker,
+    LibbyRenameCardWorker,
+    LibbyVerifyCardWorker,
+    WorkerPriority,
+    WorkerTask,
+)
 
 from typing import TYPE_CHECKING
 
@@ -63,7 +68,7 @@ load_translations()
 class CardsDialogMixin(BaseDialogMixin):
     def __init__(self, *args):
         super().__init__(*args)
-        self._fetch_auth_form_thread = QThread()
+        self._fetch_auth_form_thread: Optional[WorkerTask] = None
 
         self.dpr = QApplication.instance().devicePixelRatio()
         self.card_widgets = []
@@ -153,7 +158,7 @@ class CardsDialogMixin(BaseDialogMixin):
                 break
 
     def verify_card_btn_clicked(self, card, library, widget):
-        if not self._fetch_auth_form_thread.isRunning():
+        if not (self._fetch_auth_form_thread and self._fetch_auth_form_thread.isRunning()):
             self._fetch_auth_form_thread = self._get_fetch_auth_form_thread(
                 self.client, card, library, widget
             )
@@ -163,17 +168,15 @@ class CardsDialogMixin(BaseDialogMixin):
 
     def _get_fetch_auth_form_thread(
         self, client: LibbyClient, card: Dict, library: Dict, widget
-    ) -> QThread:
+    ) -> WorkerTask:
         self.widget = widget
         self.button = widget.verify_card_btn
         self.card = card
         self.library = library
-        thread = QThread()
         worker = LibbyAuthFormWorker()
         worker.setup(client, card)
-        worker.moveToThread(thread)
+        thread = WorkerTask(worker.run, priority=WorkerPriority.Interactive)
         thread.worker = worker
-        thread.started.connect(worker.run)
 
         def loaded(form: Dict):
             thread.quit()
@@ -497,7 +500,7 @@ class CardVerificationDialog(QDialog):
         layout.setFieldGrowthPolicy(QFormLayout.ExpandingFieldsGrow)
         self.setLayout(layout)
         self.setWindowTitle(_("Verify Card"))
-        self._verify_card_thread = QThread()
+        self._verify_card_thread: Optional[WorkerTask] = None
 
         username_field = form.get("local", {}).get("username", {})
         password_field = form.get("local", {}).get("password", {})
@@ -545,7 +548,7 @@ class CardVerificationDialog(QDialog):
         if hasattr(self, "password_txt") and not self.password_txt.text():
             return
 
-        if not self._verify_card_thread.isRunning():
+        if not (self._verify_card_thread and self._verify_card_thread.isRunning()):
             self._verify_card_thread = self._get_verify_card_thread(
                 self.client,
                 self.card,
@@ -558,13 +561,11 @@ class CardVerificationDialog(QDialog):
 
     def _get_verify_card_thread(
         self, client: LibbyClient, card: Dict, username: str, password: str
-    ) -> QThread:
-        thread = QThread()
+    ) -> WorkerTask:
         worker = LibbyVerifyCardWorker()
         worker.setup(client, card, username, password)
-        worker.moveToThread(thread)
+        thread = WorkerTask(worker.run, priority=WorkerPriority.Interactive)
         thread.worker = worker
-        thread.started.connect(worker.run)
 
         def loaded(updated_card: Dict):
             thread.quit()
@@ -618,7 +619,7 @@ class CardRenameDialog(QDialog):
         layout.setFieldGrowthPolicy(QFormLayout.ExpandingFieldsGrow)
         self.setLayout(layout)
         self.setWindowTitle(_("Rename Card"))
-        self._rename_card_thread = QThread()
+        self._rename_card_thread: Optional[WorkerTask] = None
 
         name_lbl = QLabel(library["name"])
         name_lbl.setAlignment(Qt.AlignCenter)
@@ -651,7 +652,7 @@ class CardRenameDialog(QDialog):
         if not self.card_name_txt.text().strip():
             return
 
-        if not self._rename_card_thread.isRunning():
+        if not (self._rename_card_thread and self._rename_card_thread.isRunning()):
             self._rename_card_thread = self._get_rename_card_thread(
                 self.client, self.card, self.card_name_txt.text().strip()
             )
@@ -661,13 +662,11 @@ class CardRenameDialog(QDialog):
 
     def _get_rename_card_thread(
         self, client: LibbyClient, card: Dict, new_name: str
-    ) -> QThread:
-        thread = QThread()
+    ) -> WorkerTask:
         worker = LibbyRenameCardWorker()
         worker.setup(client, card, new_name)
-        worker.moveToThread(thread)
+        thread = WorkerTask(worker.run, priority=WorkerPriority.Interactive)
         thread.worker = worker
-        thread.started.connect(worker.run)
 
         def loaded(updated_card: Dict):
             thread.quit()
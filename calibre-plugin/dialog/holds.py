@@ -187,6 +187,11 @@ class HoldsDialogMixin(BaseDialogMixin):
         self.sync_ended.connect(self.base_sync_ended_holds)
         self.hold_added.connect(self.hold_added_holds)
         self.hold_removed.connect(self.hold_removed_holds)
+        self.tabs.currentChanged.connect(self.tab_current_changed_holds)
+
+    def tab_current_changed_holds(self, index: int):
+        if index == self.holds_tab_index:
+            self.refresh_availability(self.holds_model)
 
     def hold_added_holds(self, hold: Dict):
         self.holds_model.add_hold(hold)
@@ -203,6 +208,7 @@ class HoldsDialogMixin(BaseDialogMixin):
         self.holds_refresh_btn.setEnabled(True)
         self.holds_borrow_btn.setEnabled(True)
         self.holds_model.sync(value)
+        self.mark_availability_refreshed(self.holds_model)
 
     def can_hold_be_borrowed(self, hold):
         if hold.get("isAvailable", False) :
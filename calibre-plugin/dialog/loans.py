@@ -9,8 +9,9 @@
 #
 # Now being maintained at https://github.com/sgmoore/libby-calibre-plugin
 #
-from typing import Dict, Optional
+from typing import Dict, List, Optional, Tuple
 from os.path import expanduser, isdir
+from urllib.parse import urlparse
 from calibre.constants import DEBUG
 from calibre.gui2 import Dispatcher, open_url , error_dialog
 from calibre.gui2.dialogs.confirm_delete import confirm
@@ -26,12 +27,12 @@ from qt.core import (
     QLabel,
     QLineEdit,
     QMenu,
-    QThread,
     QWidget,
     Qt,
 )
 
 from .base import BaseDialogMixin
+from ..batch_download import BatchLoanDownload
 from .widgets import DefaultQPushButton, DefaultQTableView
 from ..compat import (
     QHeaderView_ResizeMode_ResizeToContents,
@@ -39,6 +40,7 @@ from ..compat import (
     _c,
 )
 from ..config import PREFS, PreferenceKeys, PreferenceTexts, BorrowActions
+from ..download_queue import DownloadQueue
 from ..ebook_download import CustomEbookDownload
 from ..libby import LibbyClient, LibbyFormats
 from ..overdrive import OverDriveClient
@@ -52,7 +54,7 @@ from ..models import (
 )
 
 from ..utils import PluginImages
-from ..workers import LibbyFulfillLoanWorker
+from ..workers import LibbyFulfillLoanWorker, WorkerPriority, WorkerTask
 from ..tools.CustomLogger import CustomLogger
 from ..tools.decorators import enforce_types
 from ..tools.error import Error
@@ -68,6 +70,7 @@ load_translations()
 
 gui_ebook_download = CustomEbookDownload()
 gui_magazine_download = CustomMagazineDownload()
+gui_batch_download = BatchLoanDownload()
 
 gui_libby_return = LibbyLoanReturn()
 gui_renew_loan = LibbyLoanRenew()
@@ -76,7 +79,7 @@ gui_renew_loan = LibbyLoanRenew()
 class LoansDialogMixin(BaseDialogMixin):
     def __init__(self, *args):
         super().__init__(*args)
-        self._readwithkindle_thread = QThread()
+        self._readwithkindle_thread: Optional[WorkerTask] = None
 
         widget = QWidget()
         widget.layout = QGridLayout()
@@ -112,7 +115,7 @@ class LoansDialogMixin(BaseDialogMixin):
 
         self.loans_model = LibbyLoansModel(None, [], self.db, self.resources)
         self.loans_search_proxy_model = LibbyLoansSortFilterModel(
-            self, model=self.loans_model, db=self.db
+            self, model=self.loans_model, db=self.db, library_index=self.library_index
         )
 
         # The main loan list
@@ -164,6 +167,21 @@ class LoansDialogMixin(BaseDialogMixin):
             self.hide_book_already_in_lib_checkbox, widget_row_pos, 0, 1, 2
         )
 
+        # Download new loans button
+        self.download_new_btn = DefaultQPushButton(
+            _("Download new loans"), self.resources[PluginImages.Download], self
+        )
+        self.download_new_btn.setToolTip(
+            _("Download every loan that is not already in the calibre library")
+        )
+        self.download_new_btn.clicked.connect(self.download_new_btn_clicked)
+        widget.layout.addWidget(
+            self.download_new_btn,
+            widget_row_pos,
+            self.view_hspan - 3,
+        )
+        self.update_download_new_btn_text()
+
         # Create empty calibre book 
         self.empty_book_btn = DefaultQPushButton(
             ("Create empty entry in calibre"), None, self
@@ -202,6 +220,7 @@ class LoansDialogMixin(BaseDialogMixin):
         self.hide_title_already_in_lib_pref_changed.connect(
             self.hide_title_already_in_lib_pref_changed_loans
         )
+        self.library_books_changed.connect(self.library_books_changed_loans)
 
     def loan_added_loans(self, loan: Dict):
         self.loans_model.add_loan(loan)
@@ -218,12 +237,24 @@ class LoansDialogMixin(BaseDialogMixin):
     def base_sync_starting_loans(self):
         self.loans_refresh_btn.setEnabled(False)
         self.download_btn.setEnabled(False)
+        self.download_new_btn.setEnabled(False)
         self.loans_model.sync({})
 
     def base_sync_ended_loans(self, value):
         self.loans_refresh_btn.setEnabled(True)
         self.download_btn.setEnabled(True)
+        self.download_new_btn.setEnabled(True)
         self.loans_model.sync(value)
+        if value:
+            # forget queued downloads for loans that have been returned
+            self.download_queue.retain(
+                [DownloadQueue.entry_key(loan) for loan in value.get("loans", [])]
+            )
+        self.update_download_new_btn_text()
+
+    def library_books_changed_loans(self):
+        if self.loans_search_proxy_model.filter_hide_books_already_in_library:
+            self.loans_search_proxy_model.invalidateFilter()
 
     def hide_title_already_in_lib_pref_changed_loans(self, checked):
         if self.hide_book_already_in_lib_checkbox.isChecked() != checked:
@@ -413,6 +444,150 @@ class LoansDialogMixin(BaseDialogMixin):
                 loan = row.data(Qt.UserRole)
                 self.download_or_read_or_play_or_open(loan)
 
+    def update_download_new_btn_text(self):
+        unfinished = self.download_queue.unfinished_count()
+        if unfinished and not self.download_queue.is_running:
+            # left over from a previous session
+            text = _("Resume downloads ({n})").format(n=unfinished)
+        else:
+            text = _("Download new loans")
+        self.download_new_btn.setText(text)
+
+    def get_new_loan_downloads(self) -> List[Tuple[Dict, str]]:
+        """
+        Find the loans that can be downloaded and are not already in the library.
+
+        :return: List of loans and the format to download
+        """
+        downloads = []
+        for loan in self.loans_model._rows:
+            format_id = self.get_preferred_format(loan)
+            if not format_id:
+                continue
+            if not (
+                LibbyClient.is_downloadable_magazine_loan(loan)
+                or (
+                    LibbyClient.is_downloadable_ebook_loan(loan)
+                    and LibbyClient.is_format_downloadable(format_id)
+                )
+            ):
+                continue
+            if self.loans_search_proxy_model.is_temporarily_hidden(
+                loan
+            ) or self.loans_search_proxy_model.is_in_library(loan, format_id):
+                continue
+            downloads.append((loan, format_id))
+        return downloads
+
+    def download_new_btn_clicked(self):
+        downloads = self.get_new_loan_downloads()
+        if [
+            loan
+            for loan, _format_id in downloads
+            if not LibbyClient.is_downloadable_magazine_loan(loan)
+        ]:
+            downloads_folder_error = self.get_downloads_folder_error()
+            if downloads_folder_error:
+                error_dialog(self, *downloads_folder_error, show=True)
+                return
+
+        added = 0
+        for loan, format_id in downloads:
+            card = self.loans_model.get_card(loan["cardId"])
+            library = self.loans_model.get_library(self.loans_model.get_website_id(card))
+            book_id, __ = self.match_existing_book(loan, library, format_id)
+            details = {
+                "card": card,
+                "library": library,
+                "format_id": format_id,
+                "tags": self.get_calibre_tags(loan),
+                "book_id": book_id or 0,
+            }
+            if LibbyClient.is_downloadable_magazine_loan(loan):
+                details["kind"] = BatchLoanDownload.KIND_MAGAZINE
+                host = urlparse(self.client.api_base).netloc
+            else:
+                details["kind"] = BatchLoanDownload.KIND_EBOOK
+                details["url"] = self.get_loan_fulfilment_url(loan, format_id)
+                host = urlparse(details["url"]).netloc
+            # download the loans that expire first, first
+            expire_date = LibbyClient.parse_datetime(loan["expireDate"]) if loan.get("expireDate") else None
+            priority = int(expire_date.timestamp()) if expire_date else 0
+            if self.download_queue.add(loan, host, priority, **details):
+                added += 1
+
+        if not self.download_queue.unfinished_count():
+            self.status_bar.showMessage(_("There are no new loans to download"), 3000)
+            return
+        if self.download_queue.is_running:
+            # the running job picks up the new downloads
+            self.status_bar.showMessage(
+                ngettext(
+                    "Added {n} loan to the downloads",
+                    "Added {n} loans to the downloads",
+                    added,
+                ).format(n=added),
+                3000,
+            )
+            return
+        self.start_download_queue()
+
+    def start_download_queue(self):
+        self.download_queue.max_concurrent = PREFS[PreferenceKeys.DOWNLOAD_CONCURRENCY]
+        self.download_queue.max_per_host = PREFS[PreferenceKeys.DOWNLOAD_HOST_CONCURRENCY]
+        count = self.download_queue.unfinished_count()
+        description = ngettext(
+            "Downloading {n} loan", "Downloading {n} loans", count
+        ).format(n=count)
+        callback = Dispatcher(self.downloaded_new_loans)
+        job = ThreadedJob(
+            "overdrive_libby_download_queue",
+            description,
+            gui_batch_download,
+            (
+                self.gui,
+                self.client,
+                self.overdrive_client,
+                self.download_queue,
+                # open_url has to be called in the GUI thread
+                Dispatcher(open_url),
+            ),
+            {},
+            callback,
+            max_concurrent_count=1,
+            killable=True,
+        )
+        self.gui.job_manager.run_threaded_job(job)
+        self.gui.status_bar.show_message(description, 3000)
+        self.download_new_btn.setText(_("Download new loans"))
+
+    def downloaded_new_loans(self, job):
+        if job.failed:
+            try :
+                CustomLogger.logger.exception(job.exception)
+            except :  # noqa: E722
+                pass
+            self.unhandled_exception(job.exception, msg=_c("Failed to download e-book"))
+
+        failed = [
+            e for e in (job.result or []) if e["state"] == DownloadQueue.STATE_FAILED
+        ]
+        if failed:
+            error_dialog(
+                self.gui,
+                _("Some loans could not be downloaded"),
+                "\n".join(
+                    f'{get_media_title(e["loan"])}: {e["error"]}' for e in failed
+                ),
+                show=True,
+            )
+        try:
+            self.update_download_new_btn_text()
+        except RuntimeError as runtime_err:
+            # most likely because the plugin UI was closed before the downloads were completed
+            CustomLogger.logger.warning("Error updating download button: %s", runtime_err)
+        self.gui.status_bar.show_message(job.description + " " + _c("finished"), 5000)
+
     def download_or_read_or_play_or_open(self, loan : Dict) :
         borrow_action   = self.getBorrowAction(loan)       
         format_id       = self.get_preferred_format(loan)
@@ -581,6 +756,25 @@ class LoansDialogMixin(BaseDialogMixin):
             
 
 
+    def get_downloads_folder_error(self) -> Optional[Tuple[str, str]]:
+        """
+        Check that the downloads folder for browser-assisted downloading is usable.
+
+        :return: Tuple of the error message and details, or None if there is no error
+        """
+        downloads_folder = PREFS.get(PreferenceKeys.DOWNLOADS_FOLDER, "")
+        if not downloads_folder:
+            return (
+                _("Downloads Folder Not Set"),
+                _("Please configure your Downloads folder in the plugin settings (Loans tab) to use browser-assisted downloading."),
+            )
+        if not isdir(expanduser(downloads_folder)) :
+            return (
+                _("Specified Downloads Folder does not exist"),
+                _("Please correct your Downloads folder in the plugin settings (Loans tab) to use browser-assisted downloading."),
+            )
+        return None
+
     def browser_assisted_download(self, loan , format_id: str,):
         # do actual downloading of the loan
 
@@ -588,26 +782,13 @@ class LoansDialogMixin(BaseDialogMixin):
 
         CustomLogger.log_and_format(loan, "Attempted download")
 
-        downloads_folder = PREFS.get(PreferenceKeys.DOWNLOADS_FOLDER, "")
-        error_message = None
-        details = None
-        if not downloads_folder:
-            error_message = _("Downloads Folder Not Set")
-            details = _("Please configure your Downloads folder in the plugin settings (Loans tab) to use browser-assisted downloading.")
-        else :        
-            downloads_folder = expanduser(downloads_folder)
-    
-            if not isdir(downloads_folder) :
-               error_message = _("Specified Downloads Folder does not exist")
-               details = _("Please correct your Downloads folder in the plugin settings (Loans tab) to use browser-assisted downloading.")
-        
-        if error_message :
-            error_dialog(self, error_message, details, show=True )
+        downloads_folder_error = self.get_downloads_folder_error()
+        if downloads_folder_error :
+            error_dialog(self, *downloads_folder_error, show=True )
             self.open_fulfilment_website(loan, format_id)
             return
-        
-
 
+        downloads_folder = expanduser(PREFS.get(PreferenceKeys.DOWNLOADS_FOLDER, ""))
         Error.RaiseIfNot(downloads_folder , "downloads_folder must not be blank or None")
 
         from ..tools.WatchForFile import wait_for_file_qt
@@ -811,7 +992,7 @@ class LoansDialogMixin(BaseDialogMixin):
             title=_("Read with Kindle"),
             config_set=PREFS,
         ):
-            if not self._readwithkindle_thread.isRunning():
+            if not (self._readwithkindle_thread and self._readwithkindle_thread.isRunning()):
                 self._readwithkindle_thread = self._get_readwithkindle_thread(
                     self.client, loan, format_id
                 )
@@ -819,12 +1000,10 @@ class LoansDialogMixin(BaseDialogMixin):
                 self._readwithkindle_thread.start()
 
     def _get_readwithkindle_thread(self, libby_client, loan: Dict, format_id: str):
-        thread = QThread()
         worker = LibbyFulfillLoanWorker()
         worker.setup(libby_client, loan, format_id)
-        worker.moveToThread(thread)
+        thread = WorkerTask(worker.run, priority=WorkerPriority.Interactive)
         thread.worker = worker
-        thread.started.connect(worker.run)
 
         def loaded(fulfilment_details):
             fulfilment_link = fulfilment_details.get("fulfill", {}).get("href")
@@ -11,7 +11,7 @@
 #
 import json
 import re
-from typing import Dict
+from typing import Dict, Optional
 
 from calibre.constants import DEBUG
 from calibre.gui2 import Dispatcher, error_dialog, info_dialog
@@ -27,7 +27,6 @@ from qt.core import (
     QLabel,
     QLineEdit,
     QMenu,
-    QThread,
     QWidget,
     Qt,
 )
@@ -51,7 +50,7 @@ from ..models import (
 )
 from ..overdrive import OverDriveClient
 from ..utils import PluginImages
-from ..workers import OverDriveLibraryMediaWorker
+from ..workers import OverDriveLibraryMediaWorker, WorkerPriority, WorkerTask
 
 from typing import TYPE_CHECKING
 
@@ -80,7 +79,7 @@ gui_libby_borrow_hold = LibbyBorrowMedia()
 class MagazinesDialogMixin(BaseDialogMixin):
     def __init__(self, *args):
         super().__init__(*args)
-        self._fetch_library_media_thread = QThread()
+        self._fetch_library_media_thread: Optional[WorkerTask] = None
 
         magazines_widget = QWidget()
         magazines_widget.layout = QGridLayout()
@@ -159,7 +158,10 @@ class MagazinesDialogMixin(BaseDialogMixin):
 
         self.magazines_model = LibbyMagazinesModel(None, [], self.db)
         self.magazines_search_proxy_model = LibbyMagazinesSortFilterModel(
-            self, model=self.magazines_model, db=self.db
+            self,
+            model=self.magazines_model,
+            db=self.db,
+            library_index=self.library_index,
         )
 
         # The main magazines list
@@ -227,6 +229,7 @@ class MagazinesDialogMixin(BaseDialogMixin):
         self.hide_title_already_in_lib_pref_changed.connect(
             self.hide_title_already_in_lib_pref_changed_magazines
         )
+        self.library_books_changed.connect(self.library_books_changed_magazines)
 
     def loan_added_magazines(self, loan: Dict):
         self.magazines_model.add_loan(loan)
@@ -254,6 +257,10 @@ class MagazinesDialogMixin(BaseDialogMixin):
             sub = index.data(Qt.UserRole)
             self.borrow_magazine(sub)
 
+    def library_books_changed_magazines(self):
+        if self.magazines_search_proxy_model.filter_hide_magazines_already_in_library:
+            self.magazines_search_proxy_model.invalidateFilter()
+
     def hide_title_already_in_lib_pref_changed_magazines(self, checked):
         if self.hide_mag_already_in_lib_checkbox.isChecked() != checked:
             self.hide_mag_already_in_lib_checkbox.setChecked(checked)
@@ -384,7 +391,7 @@ class MagazinesDialogMixin(BaseDialogMixin):
             self.cards_model.index(self.cards_cbbox.currentIndex(), 0), Qt.UserRole
         )
         title_id = mobj.group("title_id")
-        if not self._fetch_library_media_thread.isRunning():
+        if not (self._fetch_library_media_thread and self._fetch_library_media_thread.isRunning()):
             self._fetch_library_media_thread = self._get_fetch_library_media_thread(
                 self.overdrive_client, card, title_id
             )
@@ -460,12 +467,10 @@ class MagazinesDialogMixin(BaseDialogMixin):
     def _get_fetch_library_media_thread(
         self, overdrive_client: OverDriveClient, card: Dict, title_id: str
     ):
-        thread = QThread()
         worker = OverDriveLibraryMediaWorker()
         worker.setup(overdrive_client, card, title_id)
-        worker.moveToThread(thread)
+        thread = WorkerTask(worker.run, priority=WorkerPriority.Interactive)
         thread.worker = worker
-        thread.started.connect(worker.run)
 
         def loaded(media):
             self.found_media(media, card)
@@ -9,14 +9,13 @@
 #
 # Now being maintained at https://github.com/sgmoore/libby-calibre-plugin
 #
-from typing import Dict, List
+from typing import Dict, List, Optional
 
 from calibre.constants import DEBUG
 from qt.core import (
     QAbstractItemView,
     QGridLayout,
     QLineEdit,
-    QThread,
     QWidget,
     Qt,
 )
@@ -40,7 +39,7 @@ from ..models import (
     LibbySearchSortFilterModel,
 )
 from ..utils import PluginImages
-from ..workers import OverDriveMediaSearchWorker
+from ..workers import OverDriveMediaSearchWorker, WorkerPriority, WorkerTask
 from ..tools.CustomLogger import CustomLogger
 
 from typing import TYPE_CHECKING
@@ -56,7 +55,8 @@ load_translations()
 class SearchDialogMixin(SearchBaseDialog):
     def __init__(self, *args):
         super().__init__(*args)
-        self._search_thread = QThread()
+        self._search_thread: Optional[WorkerTask] = None
+        self.finished.connect(self.cancel_search)
 
         search_widget = QWidget()
         search_widget.layout = QGridLayout()
@@ -162,6 +162,7 @@ class SearchDialogMixin(SearchBaseDialog):
         self.search_tab_index = self.add_tab(search_widget, _c("Search"))
         self.sync_starting.connect(self.base_sync_starting_search)
         self.sync_ended.connect(self.base_sync_ended_search)
+        self.tabs.currentChanged.connect(self.tab_current_changed_search)
         self.loan_added.connect(self.loan_added_search)
         self.loan_removed.connect(self.loan_removed_search)
         self.hold_added.connect(self.hold_added_search)
@@ -189,6 +190,10 @@ class SearchDialogMixin(SearchBaseDialog):
         self.search_model.remove_hold(hold)
         self.search_results_view.selectionModel().clearSelection()
 
+    def tab_current_changed_search(self, index: int):
+        if index == self.search_tab_index and not (self._search_thread and self._search_thread.isRunning()):
+            self.refresh_availability(self.search_model)
+
     def base_sync_starting_search(self):
         self.search_borrow_btn.setEnabled(False)
         self.search_model.sync({})
@@ -233,22 +238,27 @@ class SearchDialogMixin(SearchBaseDialog):
         search_query = self.query_txt.text().strip()
         if not search_query:
             return
-        if not self._search_thread.isRunning():
-            self.search_btn.setText(_c("Searching..."))
-            self.search_btn.setEnabled(False)
-            self.setCursor(Qt.WaitCursor)
-            self._search_thread = self._get_search_thread(
-                self.overdrive_client,
-                search_query,
-                self.search_model.limited_library_keys(),
-                PREFS[PreferenceKeys.SEARCH_RESULTS_MAX],
-            )
-            self._search_thread.start()
+        # a new search replaces the one still running
+        self.cancel_search()
+        self.mark_availability_refreshed(self.search_model)
+        self.search_btn.setText(_c("Searching..."))
+        self.search_btn.setEnabled(False)
+        self.setCursor(Qt.WaitCursor)
+        self._search_thread = self._get_search_thread(
+            self.overdrive_client,
+            search_query,
+            self.search_model.limited_library_keys(),
+            PREFS[PreferenceKeys.SEARCH_RESULTS_MAX],
+        )
+        self._search_thread.start()
+
+    def cancel_search(self):
+        if self._search_thread and self._search_thread.isRunning():
+            self._search_thread.cancel()
 
     def _get_search_thread(
         self, overdrive_client, query: str, library_keys: List[str], max_items: int
     ):
-        thread = QThread()
         worker = OverDriveMediaSearchWorker()
         formats = []
         if not PREFS[PreferenceKeys.INCL_NONDOWNLOADABLE_TITLES]:
@@ -262,12 +272,13 @@ class SearchDialogMixin(SearchBaseDialog):
         worker.setup(
             overdrive_client, query, library_keys, formats, max_items=max_items
         )
-        worker.moveToThread(thread)
+        thread = WorkerTask(worker.run, priority=WorkerPriority.Normal)
         thread.worker = worker
-        thread.started.connect(worker.run)
 
         def done(results):
             thread.quit()
+            if thread.cancelled:
+                return
             self.search_btn.setText(_c("Search"))
             self.search_btn.setEnabled(True)
             self.unsetCursor()
@@ -281,6 +292,8 @@ class SearchDialogMixin(SearchBaseDialog):
 
         def errored_out(err: Exception):
             thread.quit()
+            if thread.cancelled:
+                return
             self.search_btn.setText(_c("Search"))
             self.search_btn.setEnabled(True)
             self.unsetCursor()
@@ -13,13 +13,14 @@
 import time
 import os
 from pathlib import Path
-from typing import Dict, List, Optional
+from typing import Callable, Dict, List, Optional
 
 from calibre.ebooks.metadata.meta import get_metadata
 from calibre.ebooks.metadata.worker import run_import_plugins
 from calibre.gui2 import Dispatcher
 
 from .config import PREFS, PreferenceKeys
+from .download_journal import DownloadJournal
 from .libby import LibbyClient
 from .overdrive import OverDriveClient
 from .utils import OD_IDENTIFIER, generate_od_identifier
@@ -134,6 +135,67 @@ class LibbyDownload:
 
         return metadata
 
+    @staticmethod
+    def byte_progress(
+        notifications, message: str, start: float = 0.0, end: float = 1.0
+    ) -> Callable[[int, Optional[int]], None]:
+        """
+        Creates a progress callback for streamed downloads that reports to the job notifications.
+        Updates are limited to whole percentages, or every MB if the size is unknown.
+
+        :param notifications:
+        :param message:
+        :param start: Job progress fraction at the start of the download
+        :param end: Job progress fraction at the end of the download
+        :return:
+        """
+        last_reported = [-1]
+
+        def report(downloaded: int, total: Optional[int]) -> None:
+            if not notifications:
+                return
+            if total:
+                step = int(100 * downloaded / total)
+                fraction = start + (end - start) * min(1.0, downloaded / total)
+            else:
+                step = downloaded // (1024 * 1024)
+                fraction = start
+            if step == last_reported[0]:
+                return
+            last_reported[0] = step
+            notifications.put(
+                (fraction, f"{message} ({downloaded / (1024 * 1024):.1f} MB)")
+            )
+
+        return report
+
+    @staticmethod
+    def resumable_file_path(loan_id: str, format_id: str, filename: str) -> Path:
+        """
+        A path for a streamed loan file that is the same for every attempt at downloading it,
+        so that a retried job resumes the partial file left by the earlier attempt.
+        Remove it with :meth:`remove_resumable_file` once the file has been added.
+
+        :param loan_id:
+        :param format_id:
+        :param filename:
+        :return:
+        """
+        DownloadJournal.remove_expired()
+        folder = DownloadJournal.for_loan(f"{loan_id}-{format_id}").folder
+        folder.mkdir(parents=True, exist_ok=True)
+        return folder.joinpath(filename)
+
+    @staticmethod
+    def remove_resumable_file(file_path: Path) -> None:
+        """
+        Remove a file from :meth:`resumable_file_path`, and its partial file.
+
+        :param file_path:
+        :return:
+        """
+        DownloadJournal(file_path.parent).expire()
+
     def update_custom_columns(self, book_id, loan, db):
         """
         Update custom columns from loan.
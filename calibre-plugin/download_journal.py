@@ -0,0 +1,214 @@
+#
+# Copyright (C) 2023 github.com/ping
+#
+# This file is part of the OverDrive Libby Plugin by ping
+# OverDrive Libby Plugin for calibre / libby-calibre-plugin
+#
+# See https://github.com/ping/libby-calibre-plugin for more
+# information
+#
+# Now being maintained at https://github.com/sgmoore/libby-calibre-plugin
+#
+
+import hashlib
+import json
+import re
+import shutil
+import time
+from pathlib import Path
+from tempfile import gettempdir
+from typing import Callable, Dict, List, Optional
+from urllib.parse import urlparse
+
+from .tools.CustomLogger import CustomLogger
+
+
+class DownloadJournal(object):
+    """
+    Records the progress of a download that is made up of many assets, e.g. the roster
+    entries of a magazine, so that a retried download only fetches the missing assets.
+
+    The journal is a JSON lines file next to the working folder. The first line records
+    the roster, and each line after that a completed asset and its checksum.
+    Lines are only appended, so an interrupted job loses at most the asset it was writing.
+    """
+
+    # not calibre's temporary folder, because that is removed when calibre exits
+    DEFAULT_ROOT = Path(gettempdir(), "overdrive_libby_downloads")
+    MAX_AGE_DAYS = 7
+
+    def __init__(self, folder: Path) -> None:
+        """
+
+        :param folder: Working folder that the assets are saved in
+        """
+        self.folder = folder
+        self.path = folder.with_name(f"{folder.name}.journal")
+        self._assets: Dict[str, Dict] = {}
+
+    @classmethod
+    def for_loan(cls, loan_id: str, root: Optional[Path] = None) -> "DownloadJournal":
+        """
+        The journal for a loan, so that a retried job for the same loan finds it.
+
+        :param loan_id:
+        :param root:
+        :return:
+        """
+        return cls((root or cls.DEFAULT_ROOT).joinpath(re.sub(r"[^\w-]", "_", loan_id)))
+
+    @staticmethod
+    def asset_key(url: str) -> str:
+        # the query string can have a token that changes between sessions
+        return urlparse(url).path
+
+    @staticmethod
+    def checksum(file_path: Path) -> str:
+        digest = hashlib.sha256()
+        with file_path.open("rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def _file_checksum(self, file_name: str) -> Optional[str]:
+        asset_file = self.folder.joinpath(file_name)
+        return self.checksum(asset_file) if asset_file.exists() else None
+
+    def start(
+        self,
+        roster_urls: List[str],
+        checksum: Optional[Callable[[str], Optional[str]]] = None,
+    ) -> int:
+        """
+        Load the journal for the roster. If there is no journal, or it is for
+        a different roster, the working folder is emptied and a new journal started.
+        Completed assets whose file is missing or changed are left out.
+
+        :param roster_urls:
+        :param checksum: Gets the checksum of a recorded file, if the assets are not
+                         saved as files in the working folder, e.g. because they are
+                         written into an archive
+        :return: Number of assets already completed
+        """
+        roster = [self.asset_key(url) for url in roster_urls]
+        fingerprint = hashlib.sha256("\n".join(roster).encode("utf-8")).hexdigest()
+        records = self._read()
+        self._assets = {}
+        if records and records[0].get("roster") == fingerprint:
+            self.folder.mkdir(parents=True, exist_ok=True)
+            checksum = checksum or self._file_checksum
+            for record in records[1:]:
+                if checksum(record["file"]) == record["sha256"]:
+                    self._assets[record["asset"]] = record
+            return len(self._assets)
+
+        self.expire()
+        self.folder.mkdir(parents=True, exist_ok=True)
+        self._append({"roster": fingerprint, "assets": roster, "started": time.time()})
+        return 0
+
+    def completed(self, url: str) -> Optional[Dict]:
+        """
+        :param url:
+        :return: The record of a completed asset, or None if it still has to be downloaded
+        """
+        return self._assets.get(self.asset_key(url))
+
+    def completed_files(self) -> List[str]:
+        """
+        :return: The files of the completed assets, relative to the working folder
+        """
+        return [record["file"] for record in self._assets.values()]
+
+    def record(
+        self, url: str, file_path: Path, checksum: Optional[str] = None, **details
+    ) -> None:
+        """
+        Record a completed asset.
+
+        :param url:
+        :param file_path: Where the asset was saved, in the working folder
+        :param checksum: If the asset was not saved to file_path itself,
+                         e.g. because it was written into an archive
+        :param details: Anything else needed to reuse the asset, must be JSON serialisable
+        :return:
+        """
+        record = {
+            "asset": self.asset_key(url),
+            "file": file_path.relative_to(self.folder).as_posix(),
+            "sha256": checksum or self.checksum(file_path),
+        }
+        record.update(details)
+        self._append(record)
+        self._assets[record["asset"]] = record
+
+    def expire(self) -> None:
+        """
+        Remove the journal and the working folder, e.g. once the book has been added.
+
+        :return:
+        """
+        self._assets = {}
+        shutil.rmtree(self.folder, ignore_errors=True)
+        try:
+            self.path.unlink(missing_ok=True)
+        except OSError as err:
+            CustomLogger.logger.warning("Unable to remove %s: %s", self.path, err)
+
+    @classmethod
+    def remove_expired(
+        cls, root: Optional[Path] = None, max_age_days: Optional[int] = None
+    ) -> None:
+        """
+        Remove journals, and their working folders, that have not been updated for a while,
+        e.g. for loans that were returned without being downloaded. Working folders without
+        a journal, e.g. of a streamed loan file, are removed if they have not been updated.
+
+        :param root:
+        :param max_age_days:
+        :return:
+        """
+        root = root or cls.DEFAULT_ROOT
+        max_age = (
+            cls.MAX_AGE_DAYS if max_age_days is None else max_age_days
+        ) * 24 * 60 * 60
+        if not root.exists():
+            return
+        for journal_path in root.glob("*.journal"):
+            try:
+                if time.time() - journal_path.stat().st_mtime > max_age:
+                    cls(journal_path.with_suffix("")).expire()
+            except OSError:
+                continue
+        for folder in root.iterdir():
+            try:
+                if (
+                    folder.is_dir()
+                    and not cls(folder).path.exists()
+                    and time.time() - folder.stat().st_mtime > max_age
+                ):
+                    cls(folder).expire()
+            except OSError:
+                continue
+
+    def _read(self) -> List[Dict]:
+        try:
+            with self.path.open("r", encoding="utf-8") as f:
+                lines = f.readlines()
+        except FileNotFoundError:
+            return []
+        except OSError as err:
+            CustomLogger.logger.warning("Unable to read %s: %s", self.path, err)
+            return []
+        records = []
+        for line in lines:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                # incomplete line from an interrupted write
+                break
+        return records
+
+    def _append(self, record: Dict) -> None:
+        with self.path.open("a", encoding="utf-8") as f:
+            f.write(json.dumps(record, separators=(",", ":")) + "\n")
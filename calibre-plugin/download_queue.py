@@ -0,0 +1,500 @@
+#
+# Copyright (C) 2023 github.com/ping
+#
+# This file is part of the OverDrive Libby Plugin by ping
+# OverDrive Libby Plugin for calibre / libby-calibre-plugin
+#
+# See https://github.com/ping/libby-calibre-plugin for more
+# information
+#
+# Now being maintained at https://github.com/sgmoore/libby-calibre-plugin
+#
+
+import heapq
+import itertools
+import json
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from pathlib import Path
+from threading import Event, RLock
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from .network import CircuitBreaker, RequestCancelledError, RetryPolicy
+from .tools.CustomLogger import CustomLogger
+
+
+class PermanentDownloadError(Exception):
+    """A download that will not succeed by retrying it, e.g. the user cancelled it."""
+
+
+class _EntryNotifications(object):
+    """
+    Stands in for a job's notifications queue for a single download,
+    so that the download's progress is added to the queue's overall progress.
+    """
+
+    def __init__(self, queue: "DownloadQueue", key: str):
+        self.queue = queue
+        self.key = key
+
+    def put(self, item: Tuple[float, str]) -> None:
+        fraction, message = item
+        self.queue.update_progress(self.key, fraction, message)
+
+
+class DownloadQueue(object):
+    """
+    A persisted queue of loan downloads.
+
+    Entries are downloaded in priority order (lower first) with a limit on the total
+    number of downloads running at the same time, and on the number for each host.
+    Failed downloads are retried with backoff. The queue is saved after every change
+    so that unfinished downloads can be resumed after a restart.
+    """
+
+    STATE_PENDING = "pending"
+    STATE_RUNNING = "running"
+    STATE_DONE = "done"
+    STATE_FAILED = "failed"
+
+    def __init__(
+        self,
+        persist_to_path: Optional[Path] = None,
+        max_concurrent: int = 2,
+        max_per_host: int = 1,
+        max_attempts: int = 3,
+        retry_policy: Optional[RetryPolicy] = None,
+    ) -> None:
+        """
+
+        :param persist_to_path:
+        :param max_concurrent: Maximum number of downloads running at the same time
+        :param max_per_host: Maximum number of downloads from the same host at the same time
+        :param max_attempts: Attempts for each download before it is marked as failed
+        :param retry_policy: Decides the backoff between attempts
+        """
+        self.persist_to_path = persist_to_path
+        self.max_concurrent = max_concurrent
+        self.max_per_host = max_per_host
+        self.max_attempts = max_attempts
+        # downloads are long running, so back off for longer than requests do
+        self.retry_policy = retry_policy or RetryPolicy(
+            backoff_base=5.0, max_delay=120.0, breaker=CircuitBreaker()
+        )
+        self.lock = RLock()
+        self._entries: Dict[str, Dict] = {}
+        self._heap: List[Tuple[int, int, str]] = []
+        self._counter = itertools.count()
+        self._running_by_host: Dict[str, int] = {}
+        self._is_running = False
+        self._notifications = None
+        self._format_progress: Optional[Callable[[int, int, str], str]] = None
+        self.load()
+
+    @staticmethod
+    def entry_key(loan: Dict) -> str:
+        return f'{loan["cardId"]}-{loan["id"]}'
+
+    @property
+    def is_running(self) -> bool:
+        return self._is_running
+
+    def entries(self) -> List[Dict]:
+        with self.lock:
+            return list(self._entries.values())
+
+    def unfinished_count(self) -> int:
+        """
+        :return: Number of downloads that are waiting or running
+        """
+        with self.lock:
+            return len(
+                [
+                    e
+                    for e in self._entries.values()
+                    if e["state"] in (self.STATE_PENDING, self.STATE_RUNNING)
+                ]
+            )
+
+    def add(self, loan: Dict, host: str, priority: int = 0, **details) -> bool:
+        """
+        Queue a loan for download. A loan that previously finished or failed is queued again.
+
+        :param loan:
+        :param host: Host the loan is downloaded from, for the per-host limit
+        :param priority: Lower values are downloaded first
+        :param details: Anything else that the download needs, must be JSON serialisable
+        :return: False if the loan is already waiting or being downloaded
+        """
+        key = self.entry_key(loan)
+        with self.lock:
+            existing = self._entries.get(key)
+            if existing and existing["state"] in (
+                self.STATE_PENDING,
+                self.STATE_RUNNING,
+            ):
+                return False
+            self._entries[key] = {
+                "key": key,
+                "loan": loan,
+                "host": host,
+                "priority": priority,
+                "details": details,
+                "state": self.STATE_PENDING,
+                "attempts": 0,
+                "not_before": 0.0,
+                "progress": 0.0,
+                "error": "",
+            }
+            self._push(key)
+            self.save()
+        return True
+
+    def retain(self, keys: Iterable[str]) -> None:
+        """
+        Remove the downloads that are not running and are not for one of these keys,
+        e.g. loans that have since been returned.
+
+        :param keys:
+        :return:
+        """
+        keys = set(keys)
+        with self.lock:
+            removed = [
+                k
+                for k, e in self._entries.items()
+                if k not in keys and e["state"] != self.STATE_RUNNING
+            ]
+            for k in removed:
+                del self._entries[k]
+            if removed:
+                self.save()
+
+    def take(self, now: Optional[float] = None) -> Optional[Dict]:
+        """
+        Get the next download that can be started and mark it as running.
+
+        :param now:
+        :return: None if there is nothing that can be started now
+        """
+        now = time.time() if now is None else now
+        with self.lock:
+            if self._running_total() >= self.max_concurrent:
+                return None
+            deferred = []
+            taken = None
+            while self._heap:
+                item = heapq.heappop(self._heap)
+                entry = self._entries.get(item[2])
+                if not entry or entry["state"] != self.STATE_PENDING:
+                    # stale heap item
+                    continue
+                if (
+                    entry["not_before"] > now
+                    or self._running_by_host.get(entry["host"], 0)
+                    >= self.max_per_host
+                ):
+                    deferred.append(item)
+                    continue
+                taken = entry
+                break
+            for item in deferred:
+                heapq.heappush(self._heap, item)
+            if taken:
+                taken["state"] = self.STATE_RUNNING
+                taken["attempts"] += 1
+                self._running_by_host[taken["host"]] = (
+                    self._running_by_host.get(taken["host"], 0) + 1
+                )
+                self.save()
+            return taken
+
+    def next_wait(self, now: Optional[float] = None) -> Optional[float]:
+        """
+        :param now:
+        :return: Seconds until a waiting retry can be started, or None if no download is waiting
+        """
+        now = time.time() if now is None else now
+        with self.lock:
+            pending = [
+                e["not_before"]
+                for e in self._entries.values()
+                if e["state"] == self.STATE_PENDING
+            ]
+        if not pending:
+            return None
+        return max(0.0, min(pending) - now)
+
+    def complete(self, key: str) -> None:
+        with self.lock:
+            entry = self._entries.get(key)
+            if not entry:
+                return
+            self._release(entry)
+            entry["state"] = self.STATE_DONE
+            entry["progress"] = 1.0
+            entry["error"] = ""
+            self.save()
+        self._report()
+
+    def fail(self, key: str, error: str, retryable: bool = True) -> bool:
+        """
+        Record a failed attempt and schedule a retry if there are attempts left.
+
+        :param key:
+        :param error:
+        :param retryable:
+        :return: True if the download will be retried
+        """
+        with self.lock:
+            entry = self._entries.get(key)
+            if not entry:
+                return False
+            self._release(entry)
+            entry["error"] = error
+            entry["progress"] = 0.0
+            delay = (
+                self.retry_policy.get_delay(entry["attempts"] - 1)
+                if retryable and entry["attempts"] < self.max_attempts
+                else None
+            )
+            if delay is None:
+                entry["state"] = self.STATE_FAILED
+            else:
+                entry["state"] = self.STATE_PENDING
+                entry["not_before"] = time.time() + delay
+                self._push(key)
+            self.save()
+        self._report()
+        return delay is not None
+
+    def requeue(self, key: str) -> None:
+        """
+        Put a running download back in the queue without using up an attempt, e.g. when aborted.
+
+        :param key:
+        :return:
+        """
+        with self.lock:
+            entry = self._entries.get(key)
+            if not entry or entry["state"] != self.STATE_RUNNING:
+                return
+            self._release(entry)
+            entry["state"] = self.STATE_PENDING
+            entry["attempts"] = max(0, entry["attempts"] - 1)
+            entry["progress"] = 0.0
+            self._push(key)
+            self.save()
+
+    def update_progress(self, key: str, fraction: float, message: str = "") -> None:
+        with self.lock:
+            entry = self._entries.get(key)
+            if not entry:
+                return
+            entry["progress"] = max(0.0, min(1.0, fraction))
+        self._report(message)
+
+    def progress(self) -> Tuple[float, int, int]:
+        """
+        The overall progress of the downloads in the queue.
+
+        :return: Tuple of the completed fraction, number of finished and total downloads
+        """
+        with self.lock:
+            entries = list(self._entries.values())
+        if not entries:
+            return 1.0, 0, 0
+        finished = len(
+            [e for e in entries if e["state"] in (self.STATE_DONE, self.STATE_FAILED)]
+        )
+        fraction = sum(
+            1.0
+            if e["state"] in (self.STATE_DONE, self.STATE_FAILED)
+            else e["progress"]
+            for e in entries
+        ) / len(entries)
+        return fraction, finished, len(entries)
+
+    def clear_finished(self) -> None:
+        with self.lock:
+            finished = [
+                k
+                for k, e in self._entries.items()
+                if e["state"] in (self.STATE_DONE, self.STATE_FAILED)
+            ]
+            for k in finished:
+                del self._entries[k]
+            if finished:
+                self.save()
+
+    def is_retryable(self, err: Exception) -> bool:
+        if isinstance(
+            err,
+            (PermanentDownloadError, RequestCancelledError, NotImplementedError, ValueError),
+        ):
+            return False
+        # ClientError has http_status, HTTPError has code
+        status = getattr(err, "http_status", 0) or getattr(err, "code", 0)
+        if isinstance(status, int) and status:
+            return self.retry_policy.is_retryable_status(status)
+        return True
+
+    def run(
+        self,
+        download: Callable[[Dict, _EntryNotifications, Optional[Event]], None],
+        notifications=None,
+        abort: Optional[Event] = None,
+        format_progress: Optional[Callable[[int, int, str], str]] = None,
+    ) -> List[Dict]:
+        """
+        Download everything in the queue, including downloads added while running.
+        Only one run can be active at a time.
+
+        :param download: Downloads an entry, reporting its progress to the notifications
+        :param notifications: Receives the overall progress, as (fraction, message)
+        :param abort: Stops starting new downloads when set. Running downloads are put back in the queue.
+        :param format_progress: Creates the progress message from the number of finished
+                                and total downloads, and the current download's message
+        :return: The finished entries
+        """
+        with self.lock:
+            if self._is_running:
+                return []
+            self._is_running = True
+            self._notifications = notifications
+            self._format_progress = format_progress
+            self.clear_finished()
+        futures: Dict = {}
+        try:
+            with ThreadPoolExecutor(max_workers=max(1, self.max_concurrent)) as executor:
+                while not (abort and abort.is_set()):
+                    while True:
+                        entry = self.take()
+                        if not entry:
+                            break
+                        futures[
+                            executor.submit(self._download, download, entry, abort)
+                        ] = entry["key"]
+                    timeout = self.next_wait()
+                    if timeout is None:
+                        if not futures:
+                            break
+                        timeout = 1.0
+                    # wake up at least every second to check for abort
+                    timeout = min(timeout, 1.0)
+                    if futures:
+                        done, _ = wait(
+                            list(futures.keys()),
+                            timeout=timeout,
+                            return_when=FIRST_COMPLETED,
+                        )
+                        for future in done:
+                            futures.pop(future)
+                    elif abort:
+                        abort.wait(timeout)
+                    else:
+                        time.sleep(timeout)
+        finally:
+            with self.lock:
+                self._is_running = False
+                self._notifications = None
+                self._format_progress = None
+                finished = [
+                    e
+                    for e in self._entries.values()
+                    if e["state"] in (self.STATE_DONE, self.STATE_FAILED)
+                ]
+        return finished
+
+    def _download(
+        self,
+        download: Callable[[Dict, _EntryNotifications, Optional[Event]], None],
+        entry: Dict,
+        abort: Optional[Event],
+    ) -> None:
+        key = entry["key"]
+        try:
+            download(entry, _EntryNotifications(self, key), abort)
+        except Exception as err:
+            if abort and abort.is_set():
+                self.requeue(key)
+                return
+            retrying = self.fail(key, str(err), retryable=self.is_retryable(err))
+            CustomLogger.logger.warning(
+                "Download of %s failed (attempt %d)%s: %s",
+                key,
+                entry["attempts"],
+                ", retrying" if retrying else "",
+                err,
+            )
+        else:
+            self.complete(key)
+
+    def _report(self, message: str = "") -> None:
+        notifications = self._notifications
+        if not notifications:
+            return
+        fraction, finished, total = self.progress()
+        format_progress = self._format_progress
+        notifications.put(
+            (
+                fraction,
+                format_progress(finished, total, message)
+                if format_progress
+                else f"{finished}/{total} {message}".strip(),
+            )
+        )
+
+    def _push(self, key: str) -> None:
+        entry = self._entries[key]
+        heapq.heappush(self._heap, (entry["priority"], next(self._counter), key))
+
+    def _release(self, entry: Dict) -> None:
+        if entry["state"] != self.STATE_RUNNING:
+            return
+        host = entry["host"]
+        self._running_by_host[host] = max(0, self._running_by_host.get(host, 0) - 1)
+
+    def _running_total(self) -> int:
+        return sum(self._running_by_host.values())
+
+    def save(self) -> None:
+        if not self.persist_to_path:
+            return
+        try:
+            with self.lock:
+                data = {"entries": list(self._entries.values())}
+                self.persist_to_path.parent.mkdir(parents=True, exist_ok=True)
+                temp_path = self.persist_to_path.with_suffix(".tmp")
+                with temp_path.open("w", encoding="utf-8") as f:
+                    json.dump(data, f, separators=(",", ":"))
+                temp_path.replace(self.persist_to_path)
+        except (OSError, TypeError, ValueError) as err:
+            CustomLogger.logger.warning("Unable to save download queue: %s", err)
+
+    def load(self) -> None:
+        """
+        Load the saved queue. Downloads that were running when it was saved are queued again,
+        and finished ones are dropped.
+
+        :return:
+        """
+        if not (self.persist_to_path and self.persist_to_path.exists()):
+            return
+        try:
+            with self.persist_to_path.open("r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError) as err:
+            CustomLogger.logger.warning("Unable to load download queue: %s", err)
+            return
+        with self.lock:
+            self._entries.clear()
+            self._heap = []
+            for entry in data.get("entries", []):
+                if entry.get("state") in (self.STATE_DONE, self.STATE_FAILED):
+                    continue
+                entry["state"] = self.STATE_PENDING
+                entry["not_before"] = 0.0
+                entry["progress"] = 0.0
+                self._entries[entry["key"]] = entry
+                self._push(entry["key"])
@@ -13,7 +13,6 @@
 from pathlib import Path
 from typing import Dict, Optional
 
-from calibre.ptempfile import PersistentTemporaryDirectory
 from calibre.gui2 import open_url
 
 from .compat import _c
@@ -102,14 +101,15 @@ class CustomEbookDownload(LibbyDownload):
         abort=None,
         notifications=None,
     ) -> Path:
-        book_folder_path = Path(PersistentTemporaryDirectory())
-        book_file_path = book_folder_path.joinpath(filename)
-
-        notifications.put((0.5, _c("Downloading")))
-        res_content = libby_client.fulfill_loan_file(
-            loan["id"], loan["cardId"], format_id
+        # a retried job resumes the partial file, remove with remove_resumable_file()
+        book_file_path = self.resumable_file_path(loan["id"], format_id, filename)
+
+        notifications.put((0, _c("Downloading")))
+        return libby_client.fulfill_loan_file_to_path(
+            loan["id"],
+            loan["cardId"],
+            format_id,
+            book_file_path,
+            progress=self.byte_progress(notifications, _c("Downloading")),
+            abort=abort,
         )
-        with book_file_path.open("w+b") as tf:
-            tf.write(res_content)
-
-        return book_file_path
@@ -15,7 +15,6 @@ from urllib.parse import urlencode, urlparse
 
 from calibre import browser
 from calibre.ebooks.metadata.book.base import Metadata
-from calibre.ptempfile import PersistentTemporaryDirectory
 
 from .compat import _c
 from .config import PREFS, PreferenceKeys
@@ -23,6 +22,7 @@ from .download import LibbyDownload
 from .libby import LibbyClient, LibbyMediaTypes
 from .models import get_media_title
 from .overdrive import OverDriveClient
+from .utils import COVER_CACHE
 
 from .tools.CustomLogger import CustomLogger
 
@@ -44,6 +44,10 @@ class EmptyBookDownload(LibbyDownload):
             return None, None
 
         br = browser()
+
+        def download(url: str) -> bytes:
+            return br.open(url, timeout=PREFS[PreferenceKeys.NETWORK_TIMEOUT]).read()
+
         if OverDriveClient.extract_type(loan) == LibbyMediaTypes.Audiobook:
             square_cover_url_params = {
                 "type": "auto",
@@ -57,19 +61,13 @@ class EmptyBookDownload(LibbyDownload):
                 square_cover_url_params
             )
             try:
-                resize_cover_res = br.open(
-                    resize_cover_url, timeout=PREFS[PreferenceKeys.NETWORK_TIMEOUT]
-                )
-                return "jpeg", resize_cover_res.read()
+                return "jpeg", COVER_CACHE.get_or_fetch(resize_cover_url, download)
             except Exception as err:
                 # fallback to original cover_url
                 CustomLogger.logger.warning("Unable to download resized cover: %s", err)
 
         try:
-            cover_res = br.open(
-                cover_url, timeout=PREFS[PreferenceKeys.NETWORK_TIMEOUT]
-            )
-            return "jpeg", cover_res.read()
+            return "jpeg", COVER_CACHE.get_or_fetch(cover_url, download)
         except Exception as err:
             CustomLogger.logger.warning("Unable to download cover: %s", err)
 
@@ -88,7 +86,6 @@ class EmptyBookDownload(LibbyDownload):
         if not bundled_contents:
             return book_file_paths
 
-        book_folder_path = Path(PersistentTemporaryDirectory())
         for i, content in enumerate(bundled_contents):
             try:
                 format_id = LibbyClient.get_loan_format(
@@ -100,14 +97,23 @@ class EmptyBookDownload(LibbyDownload):
                 continue
 
             filename = f'{content["id"]}.{LibbyClient.get_file_extension(format_id)}'
-            book_file_path = book_folder_path.joinpath(filename)
+            # a retried job resumes the partial file
+            book_file_path = self.resumable_file_path(content["id"], format_id, filename)
 
             notifications.put((i / len(bundled_contents), _c("Downloading")))
-            res_content = libby_client.fulfill_loan_file(
-                content["id"], loan["cardId"], format_id
+            libby_client.fulfill_loan_file_to_path(
+                content["id"],
+                loan["cardId"],
+                format_id,
+                book_file_path,
+                progress=self.byte_progress(
+                    notifications,
+                    _c("Downloading"),
+                    start=i / len(bundled_contents),
+                    end=(i + 1) / len(bundled_contents),
+                ),
+                abort=abort,
             )
-            with book_file_path.open("w+b") as tf:
-                tf.write(res_content)
 
             book_file_paths.append(book_file_path)
 
@@ -126,6 +132,7 @@ class EmptyBookDownload(LibbyDownload):
             for book_file_path in book_file_paths:
                 ext = book_file_path.suffix[1:]  # remove the "." in suffix
                 db.add_format(book_id, ext.upper(), str(book_file_path), replace=False)
+                self.remove_resumable_file(book_file_path)
 
     def __call__(
         self,
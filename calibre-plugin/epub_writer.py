@@ -0,0 +1,140 @@
+#
+# Copyright (C) 2023 github.com/ping
+#
+# This file is part of the OverDrive Libby Plugin by ping
+# OverDrive Libby Plugin for calibre / libby-calibre-plugin
+#
+# See https://github.com/ping/libby-calibre-plugin for more
+# information
+#
+# Now being maintained at https://github.com/sgmoore/libby-calibre-plugin
+#
+
+import hashlib
+import zipfile
+from pathlib import Path
+from typing import Dict, Iterable, Optional, Set, Union
+
+from .tools.CustomLogger import CustomLogger
+
+
+class EpubWriter(object):
+    """
+    Writes the items of an EPUB straight into the archive as they are processed,
+    instead of saving them to a folder and zipping the folder afterwards.
+
+    The archive is always closed, even if the download fails, so that a retried download
+    can carry over the items that were already written with :meth:`open`.
+    """
+
+    MIMETYPE_NAME = "mimetype"
+    MIMETYPE = "application/epub+zip"
+    # already compressed, so deflating them again only costs time
+    STORED_MEDIA_TYPES = (
+        "image/jpeg",
+        "image/png",
+        "image/gif",
+        "font/woff",
+        "font/woff2",
+    )
+
+    def __init__(self, path: Path):
+        """
+
+        :param path: The EPUB file
+        """
+        self.path = path
+        self.previous_path = path.with_name(f"{path.name}.partial")
+        self._zip: Optional[zipfile.ZipFile] = None
+        self._names: Set[str] = set()
+
+    @staticmethod
+    def checksum(data: bytes) -> str:
+        return hashlib.sha256(data).hexdigest()
+
+    @classmethod
+    def read_checksums(cls, path: Path) -> Dict[str, str]:
+        """
+        Checksums of the items in an archive left by an interrupted download.
+
+        :param path:
+        :return: Empty if there is no archive, or it cannot be read
+        """
+        if not path.exists():
+            return {}
+        try:
+            with zipfile.ZipFile(path) as previous_zip:
+                return {
+                    name: cls.checksum(previous_zip.read(name))
+                    for name in previous_zip.namelist()
+                }
+        except (zipfile.BadZipFile, OSError) as err:
+            CustomLogger.logger.warning("Unable to read %s: %s", path, err)
+            return {}
+
+    def open(self, carry_over: Iterable[str] = ()) -> "EpubWriter":
+        """
+        Start the archive, with the mimetype as the first item.
+
+        :param carry_over: Names of items to copy from the archive left by an interrupted download
+        :return:
+        """
+        carry_over = list(carry_over)
+        if carry_over and self.path.exists():
+            self.path.replace(self.previous_path)
+        self._zip = zipfile.ZipFile(
+            self.path, mode="w", compression=zipfile.ZIP_DEFLATED
+        )
+        self._zip.writestr(self.MIMETYPE_NAME, self.MIMETYPE, compress_type=zipfile.ZIP_STORED)
+        if carry_over:
+            try:
+                with zipfile.ZipFile(self.previous_path) as previous_zip:
+                    for name in carry_over:
+                        info = previous_zip.getinfo(name)
+                        self._zip.writestr(
+                            name, previous_zip.read(info), compress_type=info.compress_type
+                        )
+                        self._names.add(name)
+            finally:
+                self.previous_path.unlink(missing_ok=True)
+        return self
+
+    def write(
+        self, name: str, data: Union[bytes, str], media_type: Optional[str] = None
+    ) -> str:
+        """
+        Add an item to the archive.
+
+        :param name: Path in the archive, with "/" separators
+        :param data:
+        :param media_type: Used to leave already compressed items uncompressed
+        :return: The checksum of the data
+        """
+        if not self._zip:
+            raise ValueError("EpubWriter is not open")
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        self._zip.writestr(
+            name,
+            data,
+            compress_type=zipfile.ZIP_STORED
+            if media_type in self.STORED_MEDIA_TYPES
+            else zipfile.ZIP_DEFLATED,
+        )
+        self._names.add(name)
+        CustomLogger.logger.debug('epub: Added "%s"', name)
+        return self.checksum(data)
+
+    def has(self, name: str) -> bool:
+        return name in self._names
+
+    def close(self) -> None:
+        if self._zip:
+            self._zip.close()
+            self._zip = None
+
+    def __enter__(self) -> "EpubWriter":
+        return self.open() if not self._zip else self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self.close()
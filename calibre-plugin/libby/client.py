@@ -19,14 +19,16 @@ from datetime import datetime, timezone
 from http.client import HTTPException
 from http.cookiejar import CookieJar
 from io import BytesIO
+from pathlib import Path
 from socket import error as SocketError, timeout as SocketTimeout
 from ssl import SSLError
-from typing import Dict, List, Optional, Tuple, Union
+from typing import Callable, Dict, List, Optional, Tuple, Union
 from urllib import parse, request
 from urllib.error import HTTPError, URLError
-from urllib.parse import urlencode, urljoin
+from urllib.parse import urlencode, urljoin, urlparse
 from urllib.request import HTTPCookieProcessor, Request, build_opener
 from ..config import PREFS, PreferenceKeys
+from ..network import RetryPolicy, pooled_handlers, raise_if_cancelled
 from .errors import ClientConnectionError, ErrorHandler, ClientForbiddenError
 from .utils import StringEnum
 
@@ -130,15 +132,16 @@ class LibbyClient(object):
         self.identity_token = identity_token
         self.max_retries = max_retries
         self.user_agent = kwargs.pop("user_agent", USER_AGENT)
+        self.retry_policy: RetryPolicy = kwargs.pop("retry_policy", None) or RetryPolicy()
         self.api_base = "https://sentry.libbyapp.com/"
         self.tags_api_base = "https://vandal.libbyapp.com/"
 
         cookie_jar = CookieJar()
         handlers = [
             HTTPCookieProcessor(cookie_jar),
-        ]
+        ] + pooled_handlers()
         self.opener = build_opener(*handlers)
-        self.opener_noredirect = build_opener(NoRedirectHandler)
+        self.opener_noredirect = build_opener(NoRedirectHandler, *pooled_handlers())
         self.cookie_jar = cookie_jar
 
     @staticmethod
@@ -411,11 +414,17 @@ class LibbyClient(object):
         :param response:
         :return:
         """
-        if response.info().get("Content-Encoding") == "gzip":
-            buf = BytesIO(response.read())
-            res = gzip.GzipFile(fileobj=buf).read()
-        else:
-            res = response.read()
+        try:
+            if response.info().get("Content-Encoding") == "gzip":
+                buf = BytesIO(response.read())
+                res = gzip.GzipFile(fileobj=buf).read()
+            else:
+                res = response.read()
+        except Exception:
+            # the connection may have been shut down because the request was cancelled
+            response.close()
+            raise_if_cancelled()
+            raise
         if not decode:
             return res
 
@@ -493,69 +502,100 @@ class LibbyClient(object):
                 lambda: method.upper()  # pylint: disable=unnecessary-lambda 
             )
 
-        for attempt in range(0, self.max_retries + 1):
-            try:
-                CustomLogger.log_request(req, endpoint_url , data )
-                req_opener = self.opener if not no_redirect else self.opener_noredirect
-                response = req_opener.open(req, timeout=self.timeout)
-            except HTTPError as e:
-                if e.code in (301, 302) and no_redirect:
-                    response = e
-                else:
+        host = urlparse(endpoint_url).netloc
+        try:
+            for attempt in range(0, self.max_retries + 1):
+                raise_if_cancelled()
+                blocked_for = self.retry_policy.breaker.blocked_for(host)
+                if blocked_for:
+                    raise ClientConnectionError(
+                        f"Not connecting to {host} for {blocked_for:.0f} seconds due to earlier failures"
+                    )
+                try:
+                    CustomLogger.log_request(req, endpoint_url , data )
+                    req_opener = self.opener if not no_redirect else self.opener_noredirect
+                    response = req_opener.open(req, timeout=self.timeout)
+                except HTTPError as e:
+                    if e.code in (301, 302) and no_redirect:
+                        response = e
+                    else:
               
-                    CustomLogger.log_response_headers(e)
-                    error_response = self._read_response(e)
-                    if (
-                        attempt < self.max_retries and e.code >= 500
-                    ):  # retry for server 5XX errors
-                        # do nothing, try
+                        CustomLogger.log_response_headers(e)
+                        error_response = self._read_response(e)
+                        if e.code >= 500:
+                            self.retry_policy.breaker.record_failure(host)
+                        else:
+                            self.retry_policy.breaker.record_success(host)
+                        delay = (
+                            self.retry_policy.get_delay(
+                                attempt, e.headers.get("Retry-After")
+                            )
+                            if self.retry_policy.is_retryable_status(e.code)
+                            else None
+                        )
+                        if (
+                            attempt < self.max_retries and delay is not None
+                        ):  # retry for server 5XX errors and throttling
+                            CustomLogger.logger.warning(
+                                "Retrying in %.1f seconds due to %s: %s",
+                                delay,
+                                e.__class__.__name__,
+                                str(e),
+                            )
+                            CustomLogger.logger.debug(error_response)
+                            self.retry_policy.sleep(delay)
+                            continue
+                        ErrorHandler.process(e, error_response)  # type: ignore[arg-type]
+                                                                 # We can ignore the type error because error_response will be str since
+                                                                 # self._read_response(e) returns a string unless we set decode to false
+
+                except (
+                    SSLError,
+                    SocketTimeout,
+                    SocketError,
+                    URLError,  # URLError is base of HTTPError
+                    HTTPException,
+                    ConnectionError,
+                ) as connection_error:
+                    # an aborted connection is not a failure of the host
+                    raise_if_cancelled()
+                    self.retry_policy.breaker.record_failure(host)
+                    if attempt < self.max_retries:
+                        delay = self.retry_policy.get_delay(attempt)
                         CustomLogger.logger.warning(
-                            "Retrying due to %s: %s", e.__class__.__name__, str(e)
+                            "Retrying in %.1f seconds due to %s: %s",
+                            delay,
+                            connection_error.__class__.__name__,
+                            str(connection_error),
                         )
-                        CustomLogger.logger.debug(error_response)
+                        self.retry_policy.sleep(delay)  # type: ignore[arg-type]
                         continue
-                    ErrorHandler.process(e, error_response)  # type: ignore[arg-type]
-                                                             # We can ignore the type error because error_response will be str since
-                                                             # self._read_response(e) returns a string unless we set decode to false
+                    raise ClientConnectionError(
+                        "{} {}".format(
+                            connection_error.__class__.__name__, str(connection_error)
+                        )
+                    ) from connection_error
 
-            except (
-                SSLError,
-                SocketTimeout,
-                SocketError,
-                URLError,  # URLError is base of HTTPError
-                HTTPException,
-                ConnectionError,
-            ) as connection_error:
-                if attempt < self.max_retries:
-                    CustomLogger.logger.warning(
-                        "Retrying due to %s: %s",
-                        connection_error.__class__.__name__,
-                        str(connection_error),
-                    )
-                    # do nothing, try
-                    continue
-                raise ClientConnectionError(
-                    "{} {}".format(
-                        connection_error.__class__.__name__, str(connection_error)
-                    )
-                ) from connection_error
-        
-            CustomLogger.log_response_headers(response)
-            if return_response:
-                return response
+                self.retry_policy.breaker.record_success(host)
+                CustomLogger.log_response_headers(response)
+                if return_response:
+                    return response
 
-            if not decode_response:
-                return self._read_response(response, decode_response)
+                if not decode_response:
+                    return self._read_response(response, decode_response)
 
-            response_content = self._read_response(response)
-            if not response_content.strip():
-                return {}
+                response_content = self._read_response(response)
+                if not response_content.strip():
+                    return {}
 
-            if response.headers["content-type"].startswith("application/json"):
-                res_obj = json.loads(response_content)
-                return res_obj
+                if response.headers["content-type"].startswith("application/json"):
+                    res_obj = json.loads(response_content)
+                    return res_obj
 
-            return response_content
+                return response_content
+        finally:
+            # a trial request that was cancelled, or failed unexpectedly, has no result
+            self.retry_policy.breaker.release_trial(host)
 
     def send_request(
         self,
@@ -772,6 +812,168 @@ class LibbyClient(object):
         res = opener.open(req, timeout=timeout)
         return res.read()
 
+    @staticmethod
+    def _parse_content_range(value: Optional[str]) -> Tuple[Optional[int], Optional[int]]:
+        """
+        Parses a Content-Range header, e.g. "bytes 100-199/200" or "bytes */200".
+
+        :param value:
+        :return: The first byte position and the complete length, where known
+        """
+        if not value or not value.startswith("bytes "):
+            return None, None
+        byte_range, _, total_str = value[len("bytes ") :].partition("/")
+        first_str = byte_range.split("-", 1)[0]
+        return (
+            int(first_str) if first_str.isdigit() else None,
+            int(total_str) if total_str.isdigit() else None,
+        )
+
+    @staticmethod
+    def _stream_response_to_file(
+        response,
+        part_path: Path,
+        offset: int = 0,
+        progress: Optional[Callable[[int, Optional[int]], None]] = None,
+        abort=None,
+        chunk_size: int = 64 * 1024,
+    ) -> None:
+        """
+        Write a http response body to file in chunks.
+
+        :param response:
+        :param part_path: File to write to
+        :param offset: Bytes already downloaded to part_path. The response is appended if > 0.
+        :param progress: Called with (bytes downloaded, total bytes if known)
+        :param abort:
+        :param chunk_size:
+        :return:
+        """
+        _, total = LibbyClient._parse_content_range(response.headers.get("Content-Range"))
+        if total is None and response.headers.get("Content-Length", "").isdigit():
+            total = offset + int(response.headers["Content-Length"])
+
+        source = response
+        if response.headers.get("Content-Encoding") == "gzip":
+            source = gzip.GzipFile(fileobj=response)
+            total = None  # content length is of the compressed bytes
+
+        written = offset
+        with part_path.open("ab" if offset else "wb") as f:
+            while True:
+                if abort and abort.is_set():
+                    raise RuntimeError("Abort signal received.")
+                chunk = source.read(chunk_size)
+                if not chunk:
+                    break
+                f.write(chunk)
+                written += len(chunk)
+                if progress:
+                    progress(written, total)
+
+    def _urlretrieve_to_path(
+        self,
+        endpoint: str,
+        destination: Path,
+        headers: Optional[Dict] = None,
+        progress: Optional[Callable[[int, Optional[int]], None]] = None,
+        abort=None,
+    ) -> Path:
+        """
+        Streaming version of _urlretrieve. The file is downloaded to a .part file
+        next to destination. If a previous attempt left a partial file, the download
+        is resumed with a Range request where the server supports it.
+
+        :param endpoint: fulfillment url
+        :param destination:
+        :param headers:
+        :param progress: Called with (bytes downloaded, total bytes if known)
+        :param abort:
+        :return:
+        """
+        part_path = destination.with_name(destination.name + ".part")
+        attempt = 0
+        while True:
+            req_headers = dict(headers or {})
+            # byte ranges only make sense on the uncompressed content
+            req_headers["Accept-Encoding"] = "identity"
+            offset = part_path.stat().st_size if part_path.exists() else 0
+            if offset:
+                req_headers["Range"] = f"bytes={offset}-"
+            # fresh opener, see _urlretrieve
+            opener = request.build_opener()
+            try:
+                try:
+                    res = opener.open(
+                        request.Request(endpoint, headers=req_headers),
+                        timeout=self.timeout,
+                    )
+                except HTTPError as e:
+                    if e.code == 416 and offset:
+                        _, total = self._parse_content_range(e.headers.get("Content-Range"))
+                        if total == offset:
+                            # range not satisfiable because we already have the whole file
+                            break
+                        # the partial file is not of this file, e.g. it has been replaced
+                        CustomLogger.logger.info(
+                            "Partial download does not match (%d of %s bytes), restarting",
+                            offset,
+                            total,
+                        )
+                        part_path.unlink()
+                        continue
+                    raise
+                with res:
+                    if offset and res.status == 206:
+                        first, _ = self._parse_content_range(res.headers.get("Content-Range"))
+                        if first != offset:
+                            CustomLogger.logger.info(
+                                "Resumed download starts at %s instead of %d, restarting",
+                                first,
+                                offset,
+                            )
+                            part_path.unlink()
+                            continue
+                        CustomLogger.logger.info("Resuming download from %d bytes", offset)
+                    elif offset:
+                        # range not supported, start over
+                        CustomLogger.logger.info("Unable to resume download, restarting")
+                        offset = 0
+                    self._stream_response_to_file(
+                        res, part_path, offset, progress=progress, abort=abort
+                    )
+                break
+            except HTTPError:
+                raise
+            except (
+                SSLError,
+                SocketTimeout,
+                SocketError,
+                URLError,
+                HTTPException,
+                ConnectionError,
+            ) as connection_error:
+                raise_if_cancelled()
+                delay = self.retry_policy.get_delay(attempt)
+                if attempt < self.max_retries and delay is not None:
+                    CustomLogger.logger.warning(
+                        "Resuming download in %.1f seconds due to %s: %s",
+                        delay,
+                        connection_error.__class__.__name__,
+                        str(connection_error),
+                    )
+                    self.retry_policy.sleep(delay)
+                    attempt += 1
+                    continue
+                raise ClientConnectionError(
+                    "{} {}".format(
+                        connection_error.__class__.__name__, str(connection_error)
+                    )
+                ) from connection_error
+
+        part_path.replace(destination)
+        return destination
+
     def fulfill_loan_file(self, loan_id: str, card_id: str, format_id: str) -> bytes:
         """
         Returns the loan file contents directly for MP3 audiobooks (.odm)
@@ -813,6 +1015,58 @@ class LibbyClient(object):
         )
         return res
 
+    def fulfill_loan_file_to_path(
+        self,
+        loan_id: str,
+        card_id: str,
+        format_id: str,
+        destination: Path,
+        progress: Optional[Callable[[int, Optional[int]], None]] = None,
+        abort=None,
+    ) -> Path:
+        """
+        Same as fulfill_loan_file but the contents are streamed directly to destination
+        instead of being held in memory. Interrupted open epub/pdf downloads are resumed.
+
+        :param loan_id:
+        :param card_id:
+        :param format_id:
+        :param destination:
+        :param progress: Called with (bytes downloaded, total bytes if known)
+        :param abort:
+        :return: destination
+        """
+        if format_id not in DOWNLOADABLE_FORMATS:
+            raise ValueError(f"Unsupported format_id: {format_id}")
+
+        headers = self.default_headers()
+        headers["Accept"] = "*/*"
+
+        if format_id in (LibbyFormats.EBookEPubOpen, LibbyFormats.EBookPDFOpen):
+            res_redirect = self.send_request(
+                f"card/{card_id}/loan/{loan_id}/fulfill/{format_id}",
+                headers=headers,
+                no_redirect=True,
+                return_response=True,
+            )
+            return self._urlretrieve_to_path(
+                res_redirect.info()["Location"],
+                destination,
+                headers=headers,
+                progress=progress,
+                abort=abort,
+            )
+
+        part_path = destination.with_name(destination.name + ".part")
+        with self.send_request(
+            f"card/{card_id}/loan/{loan_id}/fulfill/{format_id}",
+            headers=headers,
+            return_response=True,
+        ) as res:
+            self._stream_response_to_file(res, part_path, progress=progress, abort=abort)
+        part_path.replace(destination)
+        return destination
+
     def process_ebook(self, loan: Dict) -> Tuple[str, Dict, List[Dict]]:
         """
         Returns the data needed to download an ebook/magazine directly.
@@ -10,29 +10,29 @@
 # Now being maintained at https://github.com/sgmoore/libby-calibre-plugin
 #
 
-import base64
 import os
 import re
-import shutil
 import xml.etree.ElementTree as ET
-import zipfile
 from datetime import datetime
 from functools import cmp_to_key
 from pathlib import Path
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Tuple
 from urllib.parse import urljoin, urlparse
 
-from bs4 import BeautifulSoup, Doctype, Tag, element
-from calibre.ptempfile import PersistentTemporaryDirectory
+from bs4 import BeautifulSoup, Tag
 
 from .compat import _c
+from .config import PREFS, PreferenceKeys
 from .download import LibbyDownload
+from .download_journal import DownloadJournal
 from .empty_download import EmptyBookDownload
+from .epub_writer import EpubWriter
 from .libby import LibbyClient
 from .libby.client import LibbyFormats, LibbyMediaTypes
-from .magazine_download_utils import build_opf_package, guess_mimetype
+from .magazine_download_utils import build_opf_package, fetch_in_order, guess_mimetype
+from .magazine_page import PageSummary, PageTransformPool
 from .overdrive import OverDriveClient
-from .utils import is_windows, slugify
+from .utils import ASSET_STORE, COVER_CACHE, is_windows, slugify
 from .tools.CustomLogger import CustomLogger
 
 from typing import TYPE_CHECKING
@@ -206,61 +206,6 @@ def _sanitise_opf_id(string_id: str) -> str:
     return string_id
 
 
-def _cleanup_soup(soup: BeautifulSoup, version: str = "2.0") -> None:
-    """
-    Tries to fix up book content pages to be epub-version compliant.
-
-    :param soup:
-    :param version:
-    :return:
-    """
-    if version == "2.0":
-        # v2 is a lot pickier about the acceptable elements and attributes
-        modified_doctype = 'html PUBLIC "-//W3C//DTD XHTML 1.1//EN" "http://www.w3.org/TR/xhtml11/DTD/xhtml11.dtd"'
-        for item in soup.contents:
-            if isinstance(item, Doctype):
-                item.replace_with(Doctype(modified_doctype))
-                break
-        remove_attributes = [
-            # this list will not be complete, but we try
-            "aria-label",
-            "data-loc",
-            "data-epub-type",
-            "data-document-status",
-            "data-xml-lang",
-            "lang",
-            "role",
-            "epub:type",
-            "epub:prefix",
-        ]
-        for attribute in remove_attributes:
-            for tag in soup.find_all(attrs={attribute: True}):
-                del tag[attribute]
-        convert_tags = ["nav", "section"]  # this list will not be complete, but we try
-        for tag in convert_tags:
-            for invalid_tag in soup.find_all(tag):
-                invalid_tag.name = "div"
-
-    # known issues, this will not be complete
-    for svg in soup.find_all("svg"):
-        if not svg.get("xmlns"):
-            svg["xmlns"] = "http://www.w3.org/2000/svg"
-        if not svg.get("xmlns:xlink"):
-            svg["xmlns:xlink"] = "http://www.w3.org/1999/xlink"
-    convert_tags = ["figcaption"]
-    for tag in convert_tags:
-        for invalid_tag in soup.find_all(tag):
-            invalid_tag.name = "div"
-    remove_tags = ["base"]
-    for tag in remove_tags:
-        for remove_tag in soup.find_all(tag):
-            remove_tag.decompose()
-
-    html_tag = soup.find("html")
-    if html_tag and isinstance(html_tag, element.Tag) and not html_tag.get("xmlns"):
-        html_tag["xmlns"] = "http://www.w3.org/1999/xhtml"
-
-
 def _sort_spine_entries(a: Dict, b: Dict, toc_pages: List[str]):
     """
     Sort spine according to TOC. For magazines, this is sometimes a
@@ -367,6 +312,59 @@ def _filter_content(entry: Dict, media_info: Dict, toc_pages: List[str]):
     return True
 
 
+# Used to patch magazine css that causes paged mode in calibre viewer to not work.
+# This expression is used to strip `overflow-x: hidden` from the css definition
+# for `#article-body`.
+patch_magazine_css_overflow_re = re.compile(
+    r"(#article-body\s*\{[^{}]+?)overflow-x:\s*hidden;([^{}]+?})"
+)
+# This expression is used to strip `padding: Xem Xem;` from the css definition
+# for `#article-body` to remove the extraneous padding
+patch_magazine_css_padding_re = re.compile(
+    r"(#article-body\s*\{[^{}]+?)padding:\s*[^;]+;([^{}]+?})"
+)
+# This expression is used to patch the missing fonts-specified in magazine css
+patch_magazine_css_font_re = re.compile(r"(font-family: '[^']+(Sans|Serif)[^']+';)")
+# This expression is used to strip the missing font src in magazine css
+patch_magazine_css_font_src_re = re.compile(
+    r"@font-face\s*\{[^{}]+?(src:\s*url\('(fonts/.+\.ttf)'\).+?;)[^{}]+?}"
+)
+# Identifies _patch_magazine_css in the asset store, change it when the patch changes
+MAGAZINE_CSS_PATCH_ID = "magazine-css-1"
+
+
+def _patch_magazine_css(css: bytes) -> bytes:
+    """
+    Patch magazine css to fix various rendering problems.
+    Only depends on the css, so that the result can be kept in the asset store.
+
+    :param css:
+    :return:
+    """
+    css_content = patch_magazine_css_overflow_re.sub(r"\1\2", css.decode("utf-8"))
+    css_content = patch_magazine_css_padding_re.sub(r"\1\2", css_content)
+    if "#article-body" in css_content:
+        # patch font-family declarations
+        # libby declares these font-faces but does not supply them in the roster
+        # nor are they actually available when viewed online (http 403)
+        font_families = list(set(patch_magazine_css_font_re.findall(css_content)))
+        for font_family, font_declaration in font_families:
+            new_font_css = font_family[:-1]
+            if "Serif" in font_family:
+                new_font_css += ',Charter,"Bitstream Charter","Sitka Text",Cambria,serif'
+            elif "Sans" in font_family:
+                new_font_css += ",system-ui,sans-serif"
+            new_font_css += ";"
+            if "-Bold" in font_family:
+                new_font_css += " font-weight: 700;"
+            elif "-SemiBold" in font_family:
+                new_font_css += " font-weight: 600;"
+            elif "-Light" in font_family:
+                new_font_css += " font-weight: 300;"
+            css_content = css_content.replace(font_family, new_font_css)
+    return css_content.encode("utf-8")
+
+
 class CustomMagazineDownload(LibbyDownload):
     def __call__(
         self,
@@ -411,9 +409,12 @@ class CustomMagazineDownload(LibbyDownload):
                 tags,
                 None,
             )
+            # the book has been added, so a retry won't be needed
+            DownloadJournal.for_loan(loan["id"]).expire()
         except UnsupportedException as unsupported_err:
             CustomLogger.logger.warning(_("Unable to download magazine: %s"), str(unsupported_err))
             CustomLogger.logger.warning(_("Downloading as an empty book instead."))
+            DownloadJournal.for_loan(loan["id"]).expire()
 
             # download as empty book
             download_empty_book = EmptyBookDownload()
@@ -458,7 +459,10 @@ class CustomMagazineDownload(LibbyDownload):
         meta_progress_fraction = 1.0 - download_progress_fraction
         meta_tasks = 3
 
-        book_folder = Path(PersistentTemporaryDirectory())
+        # a retried job for the same loan reuses the assets that were already downloaded
+        DownloadJournal.remove_expired()
+        journal = DownloadJournal.for_loan(loan["id"])
+        book_folder = journal.folder
         epub_file_path = book_folder.joinpath(filename)
         epub_version = "3.0"
 
@@ -469,9 +473,21 @@ class CustomMagazineDownload(LibbyDownload):
             )
         )
         download_base, openbook, rosters = libby_client.process_ebook(loan)
+        title_contents: Dict = next(
+            iter([r for r in rosters if r["group"] == "title-content"]), {}
+        )
+        # the items written by an interrupted download are carried over into the new epub
+        resumed = journal.start(
+            [e["url"] for e in title_contents.get("entries", [])],
+            checksum=EpubWriter.read_checksums(epub_file_path).get,
+        )
+        if resumed:
+            CustomLogger.logger.info(
+                "Resuming download, %d roster entries already downloaded", resumed
+            )
         cover_url = OverDriveClient.get_best_cover_url(loan)
+        cover_data: Optional[bytes] = None
         if cover_url:
-            cover_path: Optional[Path] = book_folder.joinpath("cover.jpg")
             try:
                 notifications.put(
                     (
@@ -479,22 +495,19 @@ class CustomMagazineDownload(LibbyDownload):
                         _c("Downloading cover..."),
                     )
                 )
-                with cover_path.open("w+b") as cover_f:  # type:ignore[union-attr]
-                    cover_f.write(
-                        libby_client.send_request(
-                            cover_url, authenticated=False, decode_response=False
-                        )
-                    )
+                cover_data = COVER_CACHE.get_or_fetch(
+                    cover_url,
+                    lambda url: libby_client.send_request(
+                        url, authenticated=False, decode_response=False
+                    ),
+                )
             except:  # noqa
-                cover_path = None
+                cover_data = None
 
         book_meta_name = "META-INF"
         book_content_name = "OEBPS"
-        book_meta_folder = book_folder.joinpath(book_meta_name)
+        # only used to work out relative paths, the items are written into the epub
         book_content_folder = book_folder.joinpath(book_content_name)
-        for d in (book_meta_folder, book_content_folder):
-            if not d.exists():
-                d.mkdir(parents=True, exist_ok=True)
 
         notifications.put(
             (
@@ -503,12 +516,8 @@ class CustomMagazineDownload(LibbyDownload):
             )
         )
         media_info = overdrive_client.media(loan["id"])
-        title_contents: Dict = next(
-            iter([r for r in rosters if r["group"] == "title-content"]), {}
-        )
         headers = libby_client.default_headers()
         headers["Accept"] = "*/*"
-        contents_re = re.compile(r"parent\.__bif_cfc0\(self,'(?P<base64_text>.+)'\)")
 
         openbook_toc = openbook["nav"]["toc"]
         if (
@@ -556,466 +565,430 @@ class CustomMagazineDownload(LibbyDownload):
         has_ncx = False
         has_nav = False
 
-        # Used to patch magazine css that causes paged mode in calibre viewer to not work.
-        # This expression is used to strip `overflow-x: hidden` from the css definition
-        # for `#article-body`.
-        patch_magazine_css_overflow_re = re.compile(
-            r"(#article-body\s*\{[^{}]+?)overflow-x:\s*hidden;([^{}]+?})"
-        )
-        # This expression is used to strip `padding: Xem Xem;` from the css definition
-        # for `#article-body` to remove the extraneous padding
-        patch_magazine_css_padding_re = re.compile(
-            r"(#article-body\s*\{[^{}]+?)padding:\s*[^;]+;([^{}]+?})"
-        )
-        # This expression is used to patch the missing fonts-specified in magazine css
-        patch_magazine_css_font_re = re.compile(
-            r"(font-family: '[^']+(Sans|Serif)[^']+';)"
-        )
-        # This expression is used to strip the missing font src in magazine css
-        patch_magazine_css_font_src_re = re.compile(
-            r"@font-face\s*\{[^{}]+?(src:\s*url\('(fonts/.+\.ttf)'\).+?;)[^{}]+?}"
-        )
-
         # holds the manifest item ID for the image identified as the cover
         cover_img_manifest_id = None
 
         total_downloads = len(title_content_entries)
 
-        for i, entry in enumerate(title_content_entries, start=1):
-            if abort.is_set():
-                msg = "Abort signal received."
-                CustomLogger.logger.info(msg)
-                raise RuntimeError(msg)
-            entry_url = entry["url"]
-            parsed_entry_url = urlparse(entry_url)
-            title_content_path = Path(parsed_entry_url.path[1:])
-            CustomLogger.logger.info(
-                "Proccesing %d/%d : %s", i, total_downloads, title_content_path.name
+        # EPUB3 compliance: Ensure that the identifier in ncx matches the one in the OPF
+        expected_book_identifier = (
+            OverDriveClient.extract_isbn(
+                media_info["formats"],
+                format_types=[
+                    LibbyFormats.MagazineOverDrive
+                    if OverDriveClient.extract_type(loan) == LibbyMediaTypes.Magazine
+                    else LibbyFormats.EBookOverdrive
+                ],
             )
-            media_type = guess_mimetype(title_content_path.name)
-            if not media_type:
-                CustomLogger.logger.warning("Skipped roster entry: %s", title_content_path.name)
-                continue
-            asset_folder = book_content_folder.joinpath(title_content_path.parent)
-            if media_type == "application/x-dtbncx+xml":
-                has_ncx = True
-            manifest_entry = {
-                "href": parsed_entry_url.path[1:],
-                "id": "ncx"
-                if media_type == "application/x-dtbncx+xml"
-                else _sanitise_opf_id(parsed_entry_url.path[1:]),
-                "media-type": media_type,
-            }
-
-            # try to find cover image for magazines
-            if cover_toc_item and manifest_entry["id"] == _sanitise_opf_id(
-                cover_toc_item["featureImage"]
+            or media_info["id"]
+        )  # this is the summarised logic from build_opf_package
+
+        # issues of the same magazine share their css and fonts
+        asset_scope = str(media_info.get("parentMagazineTitleId") or media_info["id"])
+
+        def get_cover_img_src(page_path: str) -> Optional[str]:
+            """
+            :param page_path: Roster url path of a page
+            :return: The magazine cover image, relative to the page, if it is the cover page
+            """
+            if not (
+                cover_toc_item
+                and cover_toc_item.get("featureImage")
+                and _sanitise_opf_id(page_path[1:]) == _sanitise_opf_id(cover_toc_item["path"])
             ):
-                # we assign it here to ensure that the image referenced in the
-                # toc actually exists
-                cover_img_manifest_id = manifest_entry["id"]
+                return None
+            img_src = os.path.relpath(
+                book_content_folder.joinpath(cover_toc_item["featureImage"]),
+                start=book_content_folder.joinpath(Path(page_path[1:]).parent),
+            )
+            if is_windows():
+                img_src = Path(img_src).as_posix()
+            return img_src
 
-            if not asset_folder.exists():
-                asset_folder.mkdir(parents=True, exist_ok=True)
-            asset_file_path = asset_folder.joinpath(Path(parsed_entry_url.path).name)
+        # pages are parsed in worker processes, one per fetch thread at most
+        page_pool = PageTransformPool(
+            min(PREFS[PreferenceKeys.NETWORK_CONCURRENCY], os.cpu_count() or 1)
+        )
 
-            soup = None
+        def fetch_entry(
+            roster_entry: Dict,
+        ) -> Optional[Tuple[bytes, Optional[PageSummary]]]:
+            roster_path = urlparse(roster_entry["url"]).path
+            entry_media_type = guess_mimetype(Path(roster_path).name)
+            if (
+                abort.is_set()
+                or journal.completed(roster_entry["url"])
+                or not entry_media_type
+            ):
+                return None
             # use the libby client session because the required
             # auth cookies are set there
-            res: bytes = libby_client.send_request(
-                entry_url, headers=headers, authenticated=False, decode_response=False
+            res = ASSET_STORE.get_or_fetch(
+                asset_scope,
+                roster_path,
+                entry_media_type,
+                lambda: libby_client.send_request(
+                    roster_entry["url"],
+                    headers=headers,
+                    authenticated=False,
+                    decode_response=False,
+                ),
             )
-            # patch magazine css to fix various rendering problems
-            if (
-                OverDriveClient.extract_type(media_info) == LibbyMediaTypes.Magazine
-                and media_type == "text/css"
-            ):
-                css_content = patch_magazine_css_overflow_re.sub(
-                    r"\1\2", res.decode("utf-8")
-                )
-                css_content = patch_magazine_css_padding_re.sub(r"\1\2", css_content)
-                if "#article-body" in css_content:
-                    # patch font-family declarations
-                    # libby declares these font-faces but does not supply them in the roster
-                    # nor are they actually available when viewed online (http 403)
-                    font_families = list(
-                        set(patch_magazine_css_font_re.findall(css_content))
+            if entry_media_type not in ("application/xhtml+xml", "text/html"):
+                return res, None
+            # pages are transformed here, so that the parsing runs alongside the downloads
+            # instead of holding up the processing of the other roster entries
+            return res, page_pool.transform(
+                res, roster_path, epub_version, get_cover_img_src(roster_path)
+            )
+
+        # each item is written into the epub as soon as it is processed
+        with EpubWriter(epub_file_path).open(journal.completed_files()) as writer, page_pool:
+            fetched_entries = fetch_in_order(
+                fetch_entry,
+                title_content_entries,
+                PREFS[PreferenceKeys.NETWORK_CONCURRENCY],
+            )
+            try:
+                for i, (entry, fetched) in enumerate(fetched_entries, start=1):
+                    if abort.is_set():
+                        msg = "Abort signal received."
+                        CustomLogger.logger.info(msg)
+                        raise RuntimeError(msg)
+                    entry_url = entry["url"]
+                    parsed_entry_url = urlparse(entry_url)
+                    title_content_path = Path(parsed_entry_url.path[1:])
+                    CustomLogger.logger.info(
+                        "Proccesing %d/%d : %s", i, total_downloads, title_content_path.name
                     )
-                    for font_family, font_declaration in font_families:
-                        new_font_css = font_family[:-1]
-                        if "Serif" in font_family:
-                            new_font_css += ',Charter,"Bitstream Charter","Sitka Text",Cambria,serif'
-                        elif "Sans" in font_family:
-                            new_font_css += ",system-ui,sans-serif"
-                        new_font_css += ";"
-                        if "-Bold" in font_family:
-                            new_font_css += " font-weight: 700;"
-                        elif "-SemiBold" in font_family:
-                            new_font_css += " font-weight: 600;"
-                        elif "-Light" in font_family:
-                            new_font_css += " font-weight: 300;"
-                        css_content = css_content.replace(font_family, new_font_css)
-                else:
-                    # patch font url declarations
-                    # since ttf/otf files are downloaded ahead of css, we can verify
-                    # if the font files are actually available
-                    try:
-                        font_sources = patch_magazine_css_font_src_re.findall(
-                            css_content
-                        )
-                        for src_match, font_src in font_sources:
-                            asset_font_path = Path(
-                                urljoin(str(asset_file_path), font_src)
-                            )
-                            if not asset_font_path.exists():
-                                css_content = css_content.replace(src_match, "")
-                    except Exception as patch_err:
-                        CustomLogger.logger.warning(
-                            "Error while patching font sources: %s", patch_err
-                        )
-                with open(asset_file_path, "w", encoding="utf-8") as f_out:
-                    f_out.write(css_content)
-            elif media_type in ("application/xhtml+xml", "text/html"):
-                soup = BeautifulSoup(res.decode("utf8"), features="html.parser")
-                script_ele = soup.find("script", attrs={"type": "text/javascript"})
-                if script_ele and hasattr(script_ele, "string"):
-                    mobj = contents_re.search(script_ele.string or "")
-                    if not mobj:
-                        CustomLogger.logger.warning(
-                            "Unable to extract content string for %s",
-                            parsed_entry_url.path,
+                    media_type = guess_mimetype(title_content_path.name)
+                    if not media_type:
+                        CustomLogger.logger.warning("Skipped roster entry: %s", title_content_path.name)
+                        continue
+                    # using posix path because zipfile requires "/" separators
+                    # and may break on Windows otherwise
+                    archive_name = Path(book_content_name, title_content_path).as_posix()
+                    if media_type == "application/x-dtbncx+xml":
+                        has_ncx = True
+                    manifest_entry = {
+                        "href": parsed_entry_url.path[1:],
+                        "id": "ncx"
+                        if media_type == "application/x-dtbncx+xml"
+                        else _sanitise_opf_id(parsed_entry_url.path[1:]),
+                        "media-type": media_type,
+                    }
+
+                    # try to find cover image for magazines
+                    if cover_toc_item and manifest_entry["id"] == _sanitise_opf_id(
+                        cover_toc_item["featureImage"]
+                    ):
+                        # we assign it here to ensure that the image referenced in the
+                        # toc actually exists
+                        cover_img_manifest_id = manifest_entry["id"]
+
+                    record = journal.completed(entry_url)
+                    if record:
+                        # downloaded by an earlier attempt
+                        manifest_entry = record["manifest_entry"]
+                        cover_img_manifest_id = (
+                            record["cover_img_manifest_id"] or cover_img_manifest_id
                         )
+                        if manifest_entry.get("properties") == "nav":
+                            has_nav = True
                     else:
-                        new_soup = BeautifulSoup(
-                            base64.b64decode(mobj.group("base64_text")),
-                            features="html.parser",
-                        )
-                        soup.body.replace_with(new_soup.body)  # type: ignore[arg-type,union-attr]
-                _cleanup_soup(soup, version=epub_version)
-                if (
-                    cover_toc_item
-                    and cover_toc_item.get("featureImage")
-                    and manifest_entry["id"] == _sanitise_opf_id(cover_toc_item["path"])
-                ):
-                    img_src = os.path.relpath(
-                        book_content_folder.joinpath(cover_toc_item["featureImage"]),
-                        start=asset_folder,
-                    )
-                    if is_windows():
-                        img_src = Path(img_src).as_posix()
-                    # patch the svg based cover for magazines
-                    cover_svg = soup.find("svg")
-                    if cover_svg:
-                        # replace the svg ele with a simple image tag
-                        cover_svg.decompose()  # type: ignore[union-attr]
-                        for c in soup.body.find_all(recursive=False):  # type: ignore[union-attr]
-                            c.decompose()
-                        soup.body.append(  # type: ignore[union-attr]
-                            soup.new_tag("img", attrs={"src": img_src, "alt": "Cover"})
+                        if fetched is None:
+                            # fetch_entry only skips entries that are already recorded
+                            raise RuntimeError(f"Missing content for {entry_url}")
+                        res, page = fetched
+                        checksum = None
+                        # patch magazine css to fix various rendering problems
+                        if (
+                            OverDriveClient.extract_type(media_info) == LibbyMediaTypes.Magazine
+                            and media_type == "text/css"
+                        ):
+                            css_content = ASSET_STORE.patched(
+                                res, MAGAZINE_CSS_PATCH_ID, _patch_magazine_css
+                            ).decode("utf-8")
+                            if "#article-body" not in css_content:
+                                # patch font url declarations
+                                # since ttf/otf files are downloaded ahead of css, we can verify
+                                # if the font files are actually available
+                                try:
+                                    font_sources = patch_magazine_css_font_src_re.findall(
+                                        css_content
+                                    )
+                                    for src_match, font_src in font_sources:
+                                        if not writer.has(urljoin(archive_name, font_src)):
+                                            css_content = css_content.replace(src_match, "")
+                                except Exception as patch_err:
+                                    CustomLogger.logger.warning(
+                                        "Error while patching font sources: %s", patch_err
+                                    )
+                            checksum = writer.write(archive_name, css_content, media_type)
+                        elif page is not None:
+                            # xhtml/html, transformed by fetch_entry
+                            checksum = writer.write(archive_name, page.content, media_type)
+                        elif media_type == "application/x-dtbncx+xml":
+                            # Mismatch due to the toc.ncx being supplied by publisher
+                            ncx_soup = BeautifulSoup(res, features="xml")
+                            meta_id = ncx_soup.find("meta", attrs={"name": "dtb:uid"})
+                            if (
+                                meta_id
+                                and type(meta_id) is Tag
+                                and meta_id.get("content")
+                                and meta_id["content"] != expected_book_identifier
+                            ):
+                                CustomLogger.logger.debug(
+                                    'Replacing identifier in %s: "%s" -> "%s"',
+                                    title_content_path.name,
+                                    meta_id["content"],
+                                    expected_book_identifier,
+                                )
+                                meta_id["content"] = expected_book_identifier
+                                res = str(ncx_soup).encode("utf-8")
+                            checksum = writer.write(archive_name, res, media_type)
+                        else:
+                            checksum = writer.write(archive_name, res, media_type)
+                        if page:
+                            if (
+                                (not cover_img_manifest_id)
+                                and cover_page_landmark
+                                and cover_page_landmark["path"] == parsed_entry_url.path[1:]
+                            ):
+                                # try to find cover image for the book from the cover html content
+                                if page.img_src:
+                                    cover_img_manifest_id = _sanitise_opf_id(
+                                        urljoin(cover_page_landmark["path"], page.img_src)
+                                    )
+                            elif (not has_nav) and page.is_toc:
+                                # identify nav page
+                                manifest_entry["properties"] = "nav"
+                                has_nav = True
+                            elif page.has_svg:
+                                # page has svg
+                                manifest_entry["properties"] = "svg"
+
+                        if cover_img_manifest_id == manifest_entry["id"]:
+                            manifest_entry["properties"] = "cover-image"
+                        journal.record(
+                            entry_url,
+                            book_folder.joinpath(archive_name),
+                            checksum,
+                            manifest_entry=manifest_entry,
+                            cover_img_manifest_id=cover_img_manifest_id,
                         )
-                        style_ele = soup.new_tag("style")
-                        style_ele.append(
-                            "img { max-width: 100%; margin-left: auto; margin-right: auto; }"
+                    notifications.put(
+                        (
+                            (i / total_downloads) * download_progress_fraction
+                            + meta_progress_fraction,
+                            _c("Downloading"),
                         )
-                        soup.head.append(style_ele)  # type: ignore[union-attr]
-
-                with open(asset_file_path, "w", encoding="utf-8") as f_out:
-                    f_out.write(str(soup))
-            else:
-                with open(asset_file_path, "wb") as f_out:
-                    f_out.write(res)
-            notifications.put(
-                (
-                    (i / total_downloads) * download_progress_fraction
-                    + meta_progress_fraction,
-                    _c("Downloading"),
-                )
-            )
+                    )
 
-            if soup:
-                # try to min. soup searches where possible
-                if (
-                    (not cover_img_manifest_id)
-                    and cover_page_landmark
-                    and cover_page_landmark["path"] == parsed_entry_url.path[1:]
-                ):
-                    # try to find cover image for the book from the cover html content
-                    cover_image = soup.find("img", attrs={"src": True})
-                    if cover_image:
-                        cover_img_manifest_id = _sanitise_opf_id(
-                            urljoin(cover_page_landmark["path"], cover_image["src"])  # type: ignore[index]
-                        )
-                elif (not has_nav) and soup.find(attrs={"epub:type": "toc"}):
-                    # identify nav page
-                    manifest_entry["properties"] = "nav"
-                    has_nav = True
-                elif soup.find("svg"):
-                    # page has svg
-                    manifest_entry["properties"] = "svg"
-
-            if cover_img_manifest_id == manifest_entry["id"]:
-                manifest_entry["properties"] = "cover-image"
-            manifest_entries.append(manifest_entry)
-            if manifest_entry.get("properties") == "cover-image" and cover_path:
-                # replace the cover image already downloaded via the OD api, in case it is to be kept
-                shutil.copyfile(asset_file_path, cover_path)
-
-        if not has_nav:
-            # Generate nav - needed for magazines
-
-            # we give the nav an id-stamped file name to avoid accidentally overwriting
-            # an existing file name
-            nav_file_name = f'nav_{loan["id"]}.xhtml'
-
-            nav_soup = BeautifulSoup(NAV_XHTMLTEMPLATE, features="html.parser")
-            nav_soup.find("title").append(loan["title"])  # type: ignore[union-attr]
-            toc_ele = nav_soup.find(id="toc")
-
-            # sort toc into hierarchical sections
-            hierarchical_toc = _sort_toc(openbook_toc)
-            for item in hierarchical_toc:
-                li_ele = nav_soup.new_tag("li")
-                if not item.get("sectionName"):
-                    a_ele = nav_soup.new_tag("a", attrs={"href": item["path"]})
-                    a_ele.append(item["title"])
+                    manifest_entries.append(manifest_entry)
+            finally:
+                fetched_entries.close()
+
+            if not has_nav:
+                # Generate nav - needed for magazines
+
+                # we give the nav an id-stamped file name to avoid accidentally overwriting
+                # an existing file name
+                nav_file_name = f'nav_{loan["id"]}.xhtml'
+
+                nav_soup = BeautifulSoup(NAV_XHTMLTEMPLATE, features="html.parser")
+                nav_soup.find("title").append(loan["title"])  # type: ignore[union-attr]
+                toc_ele = nav_soup.find(id="toc")
+
+                # sort toc into hierarchical sections
+                hierarchical_toc = _sort_toc(openbook_toc)
+                for item in hierarchical_toc:
+                    li_ele = nav_soup.new_tag("li")
+                    if not item.get("sectionName"):
+                        a_ele = nav_soup.new_tag("a", attrs={"href": item["path"]})
+                        a_ele.append(item["title"])
+                        li_ele.append(a_ele)
+                        toc_ele.append(li_ele)  # type: ignore[union-attr]
+                        continue
+                    # since we don't have a section content page, and this can cause problems,
+                    # link section to first article path
+                    a_ele = nav_soup.new_tag("a", attrs={"href": item["items"][0]["path"]})
+                    a_ele.append(item["sectionName"])
                     li_ele.append(a_ele)
+                    ol_ele = nav_soup.new_tag("ol", attrs={"type": "1"})
+                    for section_item in item.get("items", []):
+                        section_li_ele = nav_soup.new_tag("li")
+                        section_item_a_ele = nav_soup.new_tag(
+                            "a", attrs={"href": section_item["path"]}
+                        )
+                        section_item_a_ele.append(section_item["title"])
+                        section_li_ele.append(section_item_a_ele)
+                        ol_ele.append(section_li_ele)
+                        continue
+                    li_ele.append(ol_ele)
                     toc_ele.append(li_ele)  # type: ignore[union-attr]
-                    continue
-                # since we don't have a section content page, and this can cause problems,
-                # link section to first article path
-                a_ele = nav_soup.new_tag("a", attrs={"href": item["items"][0]["path"]})
-                a_ele.append(item["sectionName"])
-                li_ele.append(a_ele)
-                ol_ele = nav_soup.new_tag("ol", attrs={"type": "1"})
-                for section_item in item.get("items", []):
-                    section_li_ele = nav_soup.new_tag("li")
-                    section_item_a_ele = nav_soup.new_tag(
-                        "a", attrs={"href": section_item["path"]}
-                    )
-                    section_item_a_ele.append(section_item["title"])
-                    section_li_ele.append(section_item_a_ele)
-                    ol_ele.append(section_li_ele)
-                    continue
-                li_ele.append(ol_ele)
-                toc_ele.append(li_ele)  # type: ignore[union-attr]
-
-            with book_content_folder.joinpath(nav_file_name).open(
-                "w", encoding="utf-8"
-            ) as f_nav:
-                f_nav.write(str(nav_soup).strip())
-            manifest_entries.append(
-                {
-                    "href": nav_file_name,
-                    "id": _sanitise_opf_id(nav_file_name),
-                    "media-type": "application/xhtml+xml",
-                    "properties": "nav",
-                }
-            )
 
-        if not has_ncx:
-            # generate ncx for backward compat
-            ncx = _build_ncx(media_info, openbook, nav_file_name if not has_nav else "")
-            # we give the ncx an id-stamped file name to avoid accidentally overwriting
-            # an existing file name
-            toc_ncx_name = f'toc_{loan["id"]}.ncx'
-            tree = ET.ElementTree(ncx)
-            tree.write(
-                book_content_folder.joinpath(toc_ncx_name),
-                xml_declaration=True,
-                encoding="utf-8",
-            )
-            manifest_entries.append(
-                {
-                    "href": toc_ncx_name,
-                    "id": "ncx",
-                    "media-type": "application/x-dtbncx+xml",
-                }
-            )
-            has_ncx = True
-        else:
-            # EPUB3 compliance: Ensure that the identifier in ncx matches the one in the OPF
-            # Mismatch due to the toc.ncx being supplied by publisher
-            ncx_manifest_entry = next(
-                iter([m for m in manifest_entries if m["id"] == "ncx"]), None
-            )
-            if ncx_manifest_entry:
-                expected_book_identifier = (
-                    OverDriveClient.extract_isbn(
-                        media_info["formats"],
-                        format_types=[
-                            LibbyFormats.MagazineOverDrive
-                            if OverDriveClient.extract_type(loan)
-                            == LibbyMediaTypes.Magazine
-                            else LibbyFormats.EBookOverdrive
-                        ],
-                    )
-                    or media_info["id"]
-                )  # this is the summarised logic from build_opf_package
-                ncx_path = book_content_folder.joinpath(ncx_manifest_entry["href"])
-                new_ncx_contents = None
-                with ncx_path.open("r", encoding="utf-8") as ncx_f:
-                    ncx_soup = BeautifulSoup(ncx_f, features="xml")
-                    meta_id = ncx_soup.find("meta", attrs={"name": "dtb:uid"})
-                    if (
-                        meta_id
-                        and type(meta_id) is Tag
-                        and meta_id.get("content")
-                        and meta_id["content"] != expected_book_identifier
-                    ):
-                        CustomLogger.logger.debug(
-                            'Replacing identifier in %s: "%s" -> "%s"',
-                            ncx_path.name,
-                            meta_id["content"],
-                            expected_book_identifier,
-                        )
-                        meta_id["content"] = expected_book_identifier
-                        new_ncx_contents = str(ncx_soup)
-                if new_ncx_contents:
-                    with ncx_path.open("w", encoding="utf-8") as ncx_f:
-                        ncx_f.write(new_ncx_contents)
-
-        # create epub OPF
-        opf_file_name = "package.opf"
-        opf_file_path = book_content_folder.joinpath(opf_file_name)
-        package = build_opf_package(
-            media_info,
-            version=epub_version,
-            loan_format=LibbyFormats.MagazineOverDrive
-            if OverDriveClient.extract_type(loan) == LibbyMediaTypes.Magazine
-            else LibbyFormats.EBookOverdrive,
-        )
+                writer.write(
+                    Path(book_content_name, nav_file_name).as_posix(),
+                    str(nav_soup).strip(),
+                    "application/xhtml+xml",
+                )
+                manifest_entries.append(
+                    {
+                        "href": nav_file_name,
+                        "id": _sanitise_opf_id(nav_file_name),
+                        "media-type": "application/xhtml+xml",
+                        "properties": "nav",
+                    }
+                )
 
-        # add manifest
-        manifest = ET.SubElement(package, "manifest")
-        for entry in manifest_entries:
-            ET.SubElement(manifest, "item", attrib=entry)
+            if not has_ncx:
+                # generate ncx for backward compat
+                ncx = _build_ncx(media_info, openbook, nav_file_name if not has_nav else "")
+                # we give the ncx an id-stamped file name to avoid accidentally overwriting
+                # an existing file name
+                toc_ncx_name = f'toc_{loan["id"]}.ncx'
+                writer.write(
+                    Path(book_content_name, toc_ncx_name).as_posix(),
+                    ET.tostring(ncx, xml_declaration=True, encoding="utf-8"),
+                    "application/x-dtbncx+xml",
+                )
+                manifest_entries.append(
+                    {
+                        "href": toc_ncx_name,
+                        "id": "ncx",
+                        "media-type": "application/x-dtbncx+xml",
+                    }
+                )
+                has_ncx = True
 
-        cover_manifest_entry = next(
-            iter(
-                [
-                    entry
-                    for entry in manifest_entries
-                    if entry.get("properties", "") == "cover-image"
-                ]
-            ),
-            None,
-        )
-        if not cover_manifest_entry:
-            cover_img_manifest_id = None
-        if cover_path and not cover_manifest_entry:
-            # add cover image separately since we can't identify which item is the cover
-            # we give the cover a timestamped file name to avoid accidentally overwriting
-            # an existing file name
-            cover_image_name = f"cover_{int(datetime.now().timestamp())}.jpg"
-            shutil.copyfile(cover_path, book_content_folder.joinpath(cover_image_name))
-            cover_img_manifest_id = "coverimage"
-            ET.SubElement(
-                manifest,
-                "item",
-                attrib={
-                    "id": cover_img_manifest_id,
-                    "href": cover_image_name,
-                    "media-type": "image/jpeg",
-                    "properties": "cover-image",
-                },
+            # create epub OPF
+            opf_file_name = "package.opf"
+            package = build_opf_package(
+                media_info,
+                version=epub_version,
+                loan_format=LibbyFormats.MagazineOverDrive
+                if OverDriveClient.extract_type(loan) == LibbyMediaTypes.Magazine
+                else LibbyFormats.EBookOverdrive,
             )
-        if cover_img_manifest_id:
-            metadata = package.find("metadata")
-            if metadata:
-                ET.SubElement(
-                    metadata,
-                    "meta",
-                    attrib={"name": "cover", "content": cover_img_manifest_id},
-                )
 
-        # add spine
-        spine = ET.SubElement(package, "spine")
-        if has_ncx:
-            spine.set("toc", "ncx")
-        spine_entries = list(
-            filter(
-                lambda s: not (
-                    OverDriveClient.extract_type(media_info) == LibbyMediaTypes.Magazine
-                    and s["-odread-original-path"] not in toc_pages
+            # add manifest
+            manifest = ET.SubElement(package, "manifest")
+            for entry in manifest_entries:
+                ET.SubElement(manifest, "item", attrib=entry)
+
+            cover_manifest_entry = next(
+                iter(
+                    [
+                        entry
+                        for entry in manifest_entries
+                        if entry.get("properties", "") == "cover-image"
+                    ]
                 ),
-                openbook["spine"],
+                None,
             )
-        )
-
-        # Ignoring mypy error below because of https://github.com/python/mypy/issues/9372
-        spine_entries = sorted(
-            spine_entries, key=cmp_to_key(lambda a, b: _sort_spine_entries(a, b, toc_pages))  # type:  ignore[arg-type,misc]
-        )
-        for spine_idx, entry in enumerate(spine_entries):
-            if (
-                OverDriveClient.extract_type(media_info) == LibbyMediaTypes.Magazine
-                and entry["-odread-original-path"] not in toc_pages
-            ):
-                continue
-            item_ref = ET.SubElement(spine, "itemref")
-            item_ref.set("idref", _sanitise_opf_id(entry["-odread-original-path"]))
-            if spine_idx == 0 and not has_nav:
-                item_ref = ET.SubElement(spine, "itemref")
-                item_ref.set("idref", _sanitise_opf_id(nav_file_name))
-
-        # add guide
-        if openbook.get("nav", {}).get("landmarks"):
-            guide = ET.SubElement(package, "guide")
-            for landmark in openbook["nav"]["landmarks"]:
+            if not cover_manifest_entry:
+                cover_img_manifest_id = None
+            if cover_data and not cover_manifest_entry:
+                # add cover image separately since we can't identify which item is the cover
+                # we give the cover a timestamped file name to avoid accidentally overwriting
+                # an existing file name
+                cover_image_name = f"cover_{int(datetime.now().timestamp())}.jpg"
+                writer.write(
+                    Path(book_content_name, cover_image_name).as_posix(),
+                    cover_data,
+                    "image/jpeg",
+                )
+                cover_img_manifest_id = "coverimage"
                 ET.SubElement(
-                    guide,
-                    "reference",
+                    manifest,
+                    "item",
                     attrib={
-                        "href": landmark["path"],
-                        "title": landmark["title"],
-                        "type": landmark["type"],
+                        "id": cover_img_manifest_id,
+                        "href": cover_image_name,
+                        "media-type": "image/jpeg",
+                        "properties": "cover-image",
                     },
                 )
-        tree = ET.ElementTree(package)
-        tree.write(opf_file_path, xml_declaration=True, encoding="utf-8")
-
-        # create container.xml
-        container_file_path = book_meta_folder.joinpath("container.xml")
-        container = ET.Element(
-            "container",
-            attrib={
-                "version": "1.0",
-                "xmlns": "urn:oasis:names:tc:opendocument:xmlns:container",
-            },
-        )
-        root_files = ET.SubElement(container, "rootfiles")
-        ET.SubElement(  # noqa: F841
-            root_files,
-            "rootfile",
-            attrib={
-                # use posix path because zipFile requires "/"
-                "full-path": Path(book_content_name, opf_file_name).as_posix(),
-                "media-type": "application/oebps-package+xml",
-            },
-        )
-        tree = ET.ElementTree(container)
-        tree.write(container_file_path, xml_declaration=True, encoding="utf-8")
-        CustomLogger.logger.debug('Saved "%s"', container_file_path)
-
-        # create epub zip
-        with zipfile.ZipFile(
-            epub_file_path, mode="w", compression=zipfile.ZIP_DEFLATED
-        ) as epub_zip:
-            epub_zip.writestr(
-                "mimetype", "application/epub+zip", compress_type=zipfile.ZIP_STORED
+            if cover_img_manifest_id:
+                metadata = package.find("metadata")
+                if metadata:
+                    ET.SubElement(
+                        metadata,
+                        "meta",
+                        attrib={"name": "cover", "content": cover_img_manifest_id},
+                    )
+
+            # add spine
+            spine = ET.SubElement(package, "spine")
+            if has_ncx:
+                spine.set("toc", "ncx")
+            spine_entries = list(
+                filter(
+                    lambda s: not (
+                        OverDriveClient.extract_type(media_info) == LibbyMediaTypes.Magazine
+                        and s["-odread-original-path"] not in toc_pages
+                    ),
+                    openbook["spine"],
+                )
             )
-            for root_start in (book_meta_folder, book_content_folder):
-                for p in root_start.glob("**/*"):
-                    if p.is_dir():
-                        continue
-                    zip_archive_file = p.relative_to(book_folder)
-                    # using posix path because zipfile requires "/" separators
-                    # and may break on Windows otherwise
-                    zip_archive_name = zip_archive_file.as_posix()
-                    zip_target_file = book_folder.joinpath(zip_archive_file)
-                    epub_zip.write(zip_target_file, zip_archive_name)
-                    CustomLogger.logger.debug(
-                        'epub: Added "%s" as "%s"', zip_target_file, zip_archive_name
+
+            # Ignoring mypy error below because of https://github.com/python/mypy/issues/9372
+            spine_entries = sorted(
+                spine_entries, key=cmp_to_key(lambda a, b: _sort_spine_entries(a, b, toc_pages))  # type:  ignore[arg-type,misc]
+            )
+            for spine_idx, entry in enumerate(spine_entries):
+                if (
+                    OverDriveClient.extract_type(media_info) == LibbyMediaTypes.Magazine
+                    and entry["-odread-original-path"] not in toc_pages
+                ):
+                    continue
+                item_ref = ET.SubElement(spine, "itemref")
+                item_ref.set("idref", _sanitise_opf_id(entry["-odread-original-path"]))
+                if spine_idx == 0 and not has_nav:
+                    item_ref = ET.SubElement(spine, "itemref")
+                    item_ref.set("idref", _sanitise_opf_id(nav_file_name))
+
+            # add guide
+            if openbook.get("nav", {}).get("landmarks"):
+                guide = ET.SubElement(package, "guide")
+                for landmark in openbook["nav"]["landmarks"]:
+                    ET.SubElement(
+                        guide,
+                        "reference",
+                        attrib={
+                            "href": landmark["path"],
+                            "title": landmark["title"],
+                            "type": landmark["type"],
+                        },
                     )
+            writer.write(
+                Path(book_content_name, opf_file_name).as_posix(),
+                ET.tostring(package, xml_declaration=True, encoding="utf-8"),
+                "application/oebps-package+xml",
+            )
+
+            # create container.xml
+            container = ET.Element(
+                "container",
+                attrib={
+                    "version": "1.0",
+                    "xmlns": "urn:oasis:names:tc:opendocument:xmlns:container",
+                },
+            )
+            root_files = ET.SubElement(container, "rootfiles")
+            ET.SubElement(  # noqa: F841
+                root_files,
+                "rootfile",
+                attrib={
+                    # use posix path because zipFile requires "/"
+                    "full-path": Path(book_content_name, opf_file_name).as_posix(),
+                    "media-type": "application/oebps-package+xml",
+                },
+            )
+            writer.write(
+                Path(book_meta_name, "container.xml").as_posix(),
+                ET.tostring(container, xml_declaration=True, encoding="utf-8"),
+            )
         CustomLogger.logger.info('Saved "%s"', epub_file_path)
         return epub_file_path
@@ -11,9 +11,11 @@
 #
 
 import xml.etree.ElementTree as ET
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
 from mimetypes import guess_type
 from pathlib import Path
-from typing import Dict, Optional
+from typing import Callable, Deque, Dict, Generator, List, Optional, Tuple, TypeVar
 
 from .libby.client import LibbyClient, LibbyFormats
 from .overdrive import OverDriveClient
@@ -35,6 +37,8 @@ MIMETYPE_MAP = {
     ".ncx": "application/x-dtbncx+xml",
 }
 
+T = TypeVar("T")
+
 
 def guess_mimetype(url: str) -> Optional[str]:
     """
@@ -364,3 +368,36 @@ def build_opf_package(
                 meta_series_pos.text = reading_order
 
     return package
+
+
+def fetch_in_order(
+    fetch: Callable[[Dict], T], entries: List[Dict], max_workers: int
+) -> Generator[Tuple[Dict, T], None, None]:
+    """
+    Fetch the roster entries concurrently but yield them in the original order,
+    so that the order-dependent processing (e.g. fonts before css) still works.
+    Only a limited number of responses are held ahead of the consumer.
+
+    :param fetch:
+    :param entries:
+    :param max_workers:
+    :return:
+    """
+    max_workers = max(1, max_workers)
+    window = max_workers * 2
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    pending: Deque[Future] = deque()
+    next_index = 0
+    try:
+        for i, entry in enumerate(entries):
+            while next_index < len(entries) and next_index - i < window:
+                pending.append(executor.submit(fetch, entries[next_index]))
+                next_index += 1
+            yield entry, pending.popleft().result()
+    finally:
+        # consumer is done or has bailed out, e.g. abort
+        for future in pending:
+            future.cancel()
+        # wait for the fetches already running, so that none of them outlive
+        # the resources that the consumer closes next
+        executor.shutdown(wait=True)
@@ -0,0 +1,337 @@
+#
+# Copyright (C) 2023 github.com/ping
+#
+# This file is part of the OverDrive Libby Plugin by ping
+# OverDrive Libby Plugin for calibre / libby-calibre-plugin
+#
+# See https://github.com/ping/libby-calibre-plugin for more
+# information
+#
+# Now being maintained at https://github.com/sgmoore/libby-calibre-plugin
+#
+
+# Kept apart from magazine_download so that the calibre worker processes
+# only have to import bs4 to transform pages
+
+import base64
+import re
+from collections import namedtuple
+from threading import Lock, Semaphore
+from typing import List, Optional, Tuple
+
+from bs4 import BeautifulSoup, Doctype, Tag
+from bs4.builder import builder_registry
+
+from .tools.CustomLogger import CustomLogger
+
+
+# what the single walk of a page found
+PageScan = namedtuple("PageScan", ["first_svg", "first_img_src", "is_toc"])
+
+
+def cleanup_soup(soup: BeautifulSoup, version: str = "2.0") -> PageScan:
+    """
+    Tries to fix up book content pages to be epub-version compliant.
+    The fixes and the page facts needed later are all done in a single walk of the page,
+    so that the cost grows with the size of the page rather than the number of checks.
+
+    :param soup:
+    :param version:
+    :return:
+    """
+    remove_attributes = []
+    convert_tags = {"figcaption"}  # known issues, this will not be complete
+    if version == "2.0":
+        # v2 is a lot pickier about the acceptable elements and attributes
+        modified_doctype = 'html PUBLIC "-//W3C//DTD XHTML 1.1//EN" "http://www.w3.org/TR/xhtml11/DTD/xhtml11.dtd"'
+        for item in soup.contents:
+            if isinstance(item, Doctype):
+                item.replace_with(Doctype(modified_doctype))
+                break
+        remove_attributes = [
+            # this list will not be complete, but we try
+            "aria-label",
+            "data-loc",
+            "data-epub-type",
+            "data-document-status",
+            "data-xml-lang",
+            "lang",
+            "role",
+            "epub:type",
+            "epub:prefix",
+        ]
+        convert_tags.update(["nav", "section"])  # this list will not be complete, but we try
+
+    first_svg: Optional[Tag] = None
+    first_img_src: Optional[str] = None
+    is_toc = False
+    html_tag: Optional[Tag] = None
+    remove_tags = []
+    for tag in soup.find_all(True):
+        for attribute in remove_attributes:
+            if attribute in tag.attrs:
+                del tag[attribute]
+        if tag.name in convert_tags:
+            tag.name = "div"
+        elif tag.name == "svg":
+            if not tag.get("xmlns"):
+                tag["xmlns"] = "http://www.w3.org/2000/svg"
+            if not tag.get("xmlns:xlink"):
+                tag["xmlns:xlink"] = "http://www.w3.org/1999/xlink"
+            if first_svg is None:
+                first_svg = tag
+        elif tag.name == "base":
+            remove_tags.append(tag)
+            continue
+        elif tag.name == "html" and html_tag is None:
+            html_tag = tag
+        elif tag.name == "img" and first_img_src is None and tag.get("src") is not None:
+            first_img_src = tag["src"]
+        if not is_toc and tag.get("epub:type") == "toc":
+            is_toc = True
+    for tag in remove_tags:
+        tag.decompose()
+
+    if html_tag is not None and not html_tag.get("xmlns"):
+        html_tag["xmlns"] = "http://www.w3.org/1999/xhtml"
+    return PageScan(first_svg=first_svg, first_img_src=first_img_src, is_toc=is_toc)
+
+
+# lxml, which calibre bundles, parses pages much faster than the pure python html.parser
+PAGE_PARSER = "lxml" if builder_registry.lookup("lxml") else "html.parser"
+
+# Used to extract the actual page content, which is base64 encoded in a script
+page_contents_re = re.compile(r"parent\.__bif_cfc0\(self,'(?P<base64_text>.+)'\)")
+
+# what the manifest construction needs to know about a transformed page
+PageSummary = namedtuple("PageSummary", ["content", "is_toc", "has_svg", "img_src"])
+
+
+def transform_page(
+    data: bytes,
+    page_path: str,
+    version: str,
+    cover_img_src: Optional[str] = None,
+    parser: str = PAGE_PARSER,
+) -> PageSummary:
+    """
+    Transforms a downloaded content page into an epub page.
+    Only depends on its arguments, so that it can run in a worker process.
+
+    :param data: The page as downloaded
+    :param page_path: Only used for logging
+    :param version: Epub version
+    :param cover_img_src: The magazine cover image, relative to the page, if this is the cover page
+    :param parser: BeautifulSoup parser
+    :return:
+    """
+    soup = BeautifulSoup(data.decode("utf8"), features=parser)
+    script_ele = soup.find("script", attrs={"type": "text/javascript"})
+    if script_ele and hasattr(script_ele, "string"):
+        mobj = page_contents_re.search(script_ele.string or "")
+        if not mobj:
+            CustomLogger.logger.warning("Unable to extract content string for %s", page_path)
+        else:
+            new_soup = BeautifulSoup(
+                base64.b64decode(mobj.group("base64_text")), features=parser
+            )
+            soup.body.replace_with(new_soup.body)  # type: ignore[arg-type,union-attr]
+    scan = cleanup_soup(soup, version=version)
+    if cover_img_src and scan.first_svg is not None:
+        # patch the svg based cover for magazines
+        # replace the svg ele with a simple image tag
+        scan.first_svg.decompose()
+        for c in soup.body.find_all(recursive=False):  # type: ignore[union-attr]
+            c.decompose()
+        soup.body.append(  # type: ignore[union-attr]
+            soup.new_tag("img", attrs={"src": cover_img_src, "alt": "Cover"})
+        )
+        style_ele = soup.new_tag("style")
+        style_ele.append(
+            "img { max-width: 100%; margin-left: auto; margin-right: auto; }"
+        )
+        soup.head.append(style_ele)  # type: ignore[union-attr]
+        # the body now only has the cover image
+        return PageSummary(
+            content=str(soup), is_toc=False, has_svg=False, img_src=cover_img_src
+        )
+
+    return PageSummary(
+        content=str(soup),
+        is_toc=scan.is_toc,
+        has_svg=scan.first_svg is not None,
+        img_src=scan.first_img_src,
+    )
+
+
+def transform_page_in_worker(
+    data: bytes,
+    page_path: str,
+    version: str,
+    cover_img_src: Optional[str] = None,
+    parser: str = PAGE_PARSER,
+) -> Tuple:
+    """
+    Entry point for :class:`PageTransformPool` workers.
+    Returns a plain tuple so that unpickling the result does not depend on this module.
+    """
+    return tuple(transform_page(data, page_path, version, cover_img_src, parser))
+
+
+class PageTransformPool(object):
+    """
+    Transforms pages in calibre worker processes, so that parsing a large magazine
+    is spread over several cores instead of holding up one in the GUI process.
+
+    Workers are started when they are first needed, up to max_workers. If a worker
+    cannot be started, or the pool has been closed, the pages are transformed in process instead.
+    """
+
+    def __init__(self, max_workers: int, parser: str = PAGE_PARSER):
+        """
+
+        :param max_workers: Most pages transformed at the same time
+        :param parser: BeautifulSoup parser, passed on to the workers so that
+                       every page is parsed the same way, wherever it is transformed
+        """
+        self.max_workers = max(1, max_workers)
+        self.parser = parser
+        self.lock = Lock()
+        self._slots = Semaphore(self.max_workers)
+        self._idle: List = []
+        self._workers: List = []
+        self._disabled = False
+        self._closed = False
+
+    def _start_worker(self):
+        from calibre.utils.ipc.simple_worker import offload_worker
+
+        worker = offload_worker()
+        try:
+            # check that the worker can import the plugin
+            res = worker(
+                __name__,
+                "transform_page_in_worker",
+                b"<html></html>",
+                "",
+                "2.0",
+                None,
+                self.parser,
+            )
+        except Exception:
+            worker.shutdown()
+            raise
+        if res["tb"]:
+            worker.shutdown()
+            raise RuntimeError(res["tb"])
+        return worker
+
+    def _take_worker(self):
+        with self.lock:
+            if self._closed:
+                return None
+            if self._idle:
+                return self._idle.pop()
+            if self._disabled:
+                return None
+        try:
+            worker = self._start_worker()
+        except Exception as err:
+            CustomLogger.logger.warning(
+                "Unable to start a page worker, transforming pages in process: %s", err
+            )
+            with self.lock:
+                self._disabled = True
+            return None
+        with self.lock:
+            if not self._closed:
+                self._workers.append(worker)
+                return worker
+        # closed while the worker was starting
+        self._stop_worker(worker)
+        return None
+
+    @staticmethod
+    def _stop_worker(worker) -> None:
+        try:
+            worker.shutdown()
+        except Exception as err:
+            CustomLogger.logger.warning("Unable to stop page worker: %s", err)
+
+    def _discard_worker(self, worker) -> None:
+        with self.lock:
+            if worker in self._workers:
+                self._workers.remove(worker)
+        self._stop_worker(worker)
+
+    def _release_worker(self, worker) -> None:
+        with self.lock:
+            if not self._closed:
+                self._idle.append(worker)
+                return
+        # closed while the worker was in use, close() did not see it
+        self._stop_worker(worker)
+
+    def transform(
+        self,
+        data: bytes,
+        page_path: str,
+        version: str,
+        cover_img_src: Optional[str] = None,
+    ) -> PageSummary:
+        """
+        Same as :func:`transform_page`, but in a worker process.
+        Can be called from several threads.
+
+        :param data:
+        :param page_path:
+        :param version:
+        :param cover_img_src:
+        :return:
+        """
+        with self._slots:
+            worker = self._take_worker()
+            if worker is None:
+                return transform_page(data, page_path, version, cover_img_src, self.parser)
+            try:
+                res = worker(
+                    __name__,
+                    "transform_page_in_worker",
+                    data,
+                    page_path,
+                    version,
+                    cover_img_src,
+                    self.parser,
+                )
+            except Exception as err:
+                # the worker has died, the next page starts a new one
+                CustomLogger.logger.warning("Page worker failed: %s", err)
+                self._discard_worker(worker)
+                return transform_page(data, page_path, version, cover_img_src, self.parser)
+            self._release_worker(worker)
+            if res["tb"]:
+                # transform again in process, so that the error is raised here
+                CustomLogger.logger.warning(
+                    "Unable to transform %s in worker: %s", page_path, res["tb"]
+                )
+                return transform_page(data, page_path, version, cover_img_src, self.parser)
+            return PageSummary(*res["result"])
+
+    def close(self) -> None:
+        """
+        Stop the idle workers. Workers still in use are stopped when they are done,
+        and pages transformed after this are transformed in process.
+
+        :return:
+        """
+        with self.lock:
+            self._closed = True
+            idle, self._workers, self._idle = self._idle, [], []
+        for worker in idle:
+            self._stop_worker(worker)
+
+    def __enter__(self) -> "PageTransformPool":
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self.close()
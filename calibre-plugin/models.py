@@ -9,9 +9,10 @@
 #
 # Now being maintained at https://github.com/sgmoore/libby-calibre-plugin
 #
+from bisect import bisect_left, insort
 from collections import namedtuple
 from functools import cmp_to_key
-from typing import Dict, List, Optional
+from typing import Dict, Iterable, List, Optional, Set, Tuple
 
 from calibre.constants import DEBUG as CALIBRE_DEBUG
 from calibre.gui2 import elided_text
@@ -32,7 +33,7 @@ from .compat import QColor_fromString, _c
 from .config import MAX_SEARCH_LIBRARIES, PREFS, PreferenceKeys
 from .libby import LibbyClient
 from .libby.client import LibbyFormats, LibbyMediaTypes
-from .overdrive import OverDriveClient
+from .overdrive import AvailabilityRefresher, OverDriveClient
 from .utils import PluginColors, PluginImages, obfuscate_date, obfuscate_name
 from re import sub, IGNORECASE
 from .tools.CustomLogger import CustomLogger
@@ -380,6 +381,91 @@ class LibbyModel(QAbstractTableModel):
             m for m in medias if not (m["id"] == title_id and m["cardId"] == card_id)
         ]
 
+    @staticmethod
+    def row_key(row: Dict) -> Tuple:
+        return row.get("id"), row.get("cardId")
+
+    def update_rows(self, rows: List[Dict], changed_keys: Iterable[Tuple] = ()):
+        """
+        Replace the rows with only the insert, remove, move and change notifications
+        needed, so that views keep their selection and scroll position.
+        Falls back to a model reset if the row keys are not unique.
+
+        :param rows: The new rows, already sorted
+        :param changed_keys: Keys of rows that were modified in place
+        :return:
+        """
+        old_keys = [self.row_key(r) for r in self._rows]
+        new_keys = [self.row_key(r) for r in rows]
+        new_key_set = set(new_keys)
+        if len(new_key_set) != len(new_keys) or len(set(old_keys)) != len(old_keys):
+            # duplicates, can't diff by key
+            self._reset_rows(rows)
+            return
+        kept_keys = [k for k in old_keys if k in new_key_set]
+        kept_key_set = set(kept_keys)
+        new_kept_keys = [k for k in new_keys if k in kept_key_set]
+
+        # remove rows, from the end so that the row numbers stay valid
+        row = len(old_keys) - 1
+        while row >= 0:
+            if old_keys[row] in new_key_set:
+                row -= 1
+                continue
+            end = row
+            while row >= 0 and old_keys[row] not in new_key_set:
+                row -= 1
+            self.beginRemoveRows(QModelIndex(), row + 1, end)
+            del self._rows[row + 1 : end + 1]
+            self.endRemoveRows()
+
+        if kept_keys != new_kept_keys:
+            # move the remaining rows into their new order
+            self.layoutAboutToBeChanged.emit()
+            new_positions = {k: row for row, k in enumerate(new_kept_keys)}
+            rows_by_key = {k: r for k, r in zip(kept_keys, self._rows)}
+            self._rows = [rows_by_key[k] for k in new_kept_keys]
+            from_indices = self.persistentIndexList()
+            self.changePersistentIndexList(
+                from_indices,
+                [
+                    self.index(new_positions[kept_keys[i.row()]], i.column())
+                    for i in from_indices
+                ],
+            )
+            self.layoutChanged.emit()
+
+        # insert new rows, in order so that the row numbers match the new list
+        row = 0
+        while row < len(new_keys):
+            if new_keys[row] in kept_key_set:
+                row += 1
+                continue
+            start = row
+            while row < len(new_keys) and new_keys[row] not in kept_key_set:
+                row += 1
+            self.beginInsertRows(QModelIndex(), start, row - 1)
+            self._rows[start:start] = rows[start:row]
+            self.endInsertRows()
+
+        # update changed rows
+        changed_key_set = set(changed_keys)
+        last_column = self.columnCount() - 1
+        for row, new_row in enumerate(rows):
+            old_row = self._rows[row]
+            if old_row is not new_row:
+                self._rows[row] = new_row
+                if old_row == new_row:
+                    continue
+            elif new_keys[row] not in changed_key_set:
+                continue
+            self.dataChanged.emit(self.index(row, 0), self.index(row, last_column))
+
+    def _reset_rows(self, rows: List[Dict]):
+        self.beginResetModel()
+        self._rows = rows
+        self.endResetModel()
+
 
 class LibbySortFilterModel(QSortFilterProxyModel):
     filter_text_set = pyqtSignal()
@@ -406,10 +492,236 @@ class LibbySortFilterModel(QSortFilterProxyModel):
         self.filter_text_set.emit()
 
 
+class LibraryMatchIndex:
+    """
+    Index of the calibre library's normalised titles, ISBNs and ASINs to book IDs,
+    so that checking if a title is already in the library does not require a
+    scan of every book.
+    """
+
+    # metadata fields that affect the index
+    INDEXED_FIELDS = ("title", "identifiers", "formats")
+
+    def __init__(self, db):
+        self.db = db
+        self._titles: Dict[str, Set[int]] = {}
+        self._isbns: Dict[str, Set[int]] = {}
+        self._asins: Dict[str, Set[int]] = {}
+        # the keys each book is indexed under, so that it can be removed
+        self._book_keys: Dict[int, List] = {}
+        self._has_formats: Dict[int, bool] = {}
+        self.rebuild()
+
+    def rebuild(self):
+        self._titles = {}
+        self._isbns = {}
+        self._asins = {}
+        self._book_keys = {}
+        self._has_formats = {}
+        for book_id in list(self.db.fields["title"].table.book_col_map.keys()):
+            self._add_book(book_id)
+
+    def _add_book(self, book_id: int):
+        title = self.db.fields["title"].table.book_col_map.get(book_id)
+        if title is None:
+            # book no longer exists
+            return
+        identifiers = (
+            self.db.fields["identifiers"].table.book_col_map.get(book_id) or {}
+        )
+        keys = [(self._titles, icu_lower(title))]
+        if identifiers.get("isbn"):
+            keys.append((self._isbns, identifiers["isbn"]))
+        for asin_key in ("amazon", "asin"):
+            if identifiers.get(asin_key):
+                keys.append((self._asins, identifiers[asin_key]))
+        for index, key in keys:
+            index.setdefault(key, set()).add(book_id)
+        self._book_keys[book_id] = keys
+        self._has_formats[book_id] = bool(
+            self.db.fields["formats"].table.book_col_map.get(book_id)
+        )
+
+    def _remove_book(self, book_id: int):
+        for index, key in self._book_keys.pop(book_id, []):
+            book_ids = index.get(key)
+            if book_ids is None:
+                continue
+            book_ids.discard(book_id)
+            if not book_ids:
+                del index[key]
+        self._has_formats.pop(book_id, None)
+
+    def update_books(self, book_ids: Iterable[int]):
+        """
+        Re-index books that have been added or edited, and drop books that have been removed.
+
+        :param book_ids:
+        :return:
+        """
+        for book_id in book_ids:
+            self._remove_book(book_id)
+            self._add_book(book_id)
+
+    def handle_db_event(self, event_type, event_data) -> bool:
+        """
+        Update the index from a calibre database event.
+
+        :param event_type: calibre.db.listeners.EventType
+        :param event_data:
+        :return: True if the index may have changed
+        """
+        event_name = getattr(event_type, "name", str(event_type))
+        if event_name in ("book_created", "format_added"):
+            self.update_books([event_data[0]])
+        elif event_name == "books_removed":
+            self.update_books(event_data[0])
+        elif event_name == "formats_removed":
+            self.update_books(event_data[0].keys())
+        elif event_name == "metadata_changed":
+            field, book_ids = event_data[0], event_data[1]
+            if field not in self.INDEXED_FIELDS:
+                return False
+            self.update_books(book_ids)
+        else:
+            return False
+        return True
+
+    def find_book(
+        self,
+        titles: Iterable[str],
+        isbn: Optional[str] = None,
+        asin: Optional[str] = None,
+    ) -> Optional[int]:
+        """
+        Find the first book matching any of the titles, isbn or asin.
+
+        :param titles: Titles already lower-cased with icu_lower
+        :param isbn:
+        :param asin:
+        :return: The lowest matching book ID, or None if not found
+        """
+        book_ids: Set[int] = set()
+        for title in titles:
+            book_ids.update(self._titles.get(title, ()))
+        if isbn:
+            book_ids.update(self._isbns.get(isbn, ()))
+        if asin:
+            book_ids.update(self._asins.get(asin, ()))
+        return min(book_ids) if book_ids else None
+
+    def has_formats(self, book_id: int) -> bool:
+        return self._has_formats.get(book_id, False)
+
+
 LoanMatchCondition = namedtuple(
     "LoanMatchCondition", ["title1", "title2", "isbn", "asin"]
 )
 
+class SearchResultsMerger:
+    """
+    Merges the search results from multiple libraries as each library responds.
+    Results for the same title are combined into one item, and the items are kept
+    ordered by their average rank across the libraries.
+    """
+
+    SITE_AVAILABILITY_KEYS = (
+        "advantageKey",
+        "availabilityType",
+        "availableCopies",
+        "estimatedWaitDays",
+        "formats",
+        "holdsCount",
+        "holdsRatio",
+        "isAdvantageFiltered",
+        "isAvailable",
+        "isOwned",
+        "isRecommendableToLibrary",
+        "isFastlane",
+        "isHoldable",
+        "juvenileEligible",
+        "luckyDayAvailableCopies",
+        "luckyDayOwnedCopies",
+        "ownedCopies",
+        "visitorEligible",
+        "youngAdultEligible",
+    )
+
+    def __init__(self):
+        self._items: Dict[str, Dict] = {}
+        self._format_ids: Dict[str, Set[str]] = {}
+        # (sort key, title id) in rank order
+        self._order: List[Tuple[Tuple, str]] = []
+        self._sort_keys: Dict[str, Tuple] = {}
+        # so that titles with the same rank stay in the order they were first seen
+        self._first_seen: Dict[str, int] = {}
+
+    def _sort_key(self, item: Dict, title_id: str) -> Tuple:
+        ranks = item["__item_ranks"]
+        return (
+            sum(ranks) / len(ranks),  # average rank
+            1 / len(ranks),
+            self._first_seen[title_id],
+        )
+
+    def add_library_results(self, library_key: str, items: List[Dict]) -> List[Dict]:
+        """
+        Merge in the results from a library.
+
+        :param library_key:
+        :param items: The search result items from the library
+        :return: The merged items that were added or changed
+        """
+        changed: List[Dict] = []
+        for item_rank, item in enumerate(items, start=1):
+            site_availability = {}
+            for k in self.SITE_AVAILABILITY_KEYS:
+                if k in item:
+                    site_availability[k] = item.pop(k)
+            site_availability["advantageKey"] = library_key
+            title_id = item["id"]
+            merged = self._items.get(title_id)
+            if merged is None:
+                merged = item
+                merged.setdefault("siteAvailabilities", {})
+                merged.setdefault("__item_ranks", [])
+                merged.setdefault("formats", [])
+                self._items[title_id] = merged
+                self._format_ids[title_id] = set([f["id"] for f in merged["formats"]])
+                self._first_seen[title_id] = len(self._first_seen)
+            else:
+                self._remove_from_order(title_id)
+            # merge site availabilities
+            merged["siteAvailabilities"][library_key] = site_availability
+            # merge item ranks
+            merged["__item_ranks"].append(item_rank)
+            # merge formats
+            format_ids = self._format_ids[title_id]
+            for f in site_availability.get("formats", []):
+                if f["id"] not in format_ids:
+                    format_ids.add(f["id"])
+                    merged["formats"].append(f)
+            sort_key = self._sort_key(merged, title_id)
+            self._sort_keys[title_id] = sort_key
+            insort(self._order, (sort_key, title_id))
+            changed.append(merged)
+        return changed
+
+    def _remove_from_order(self, title_id: str):
+        entry = (self._sort_keys[title_id], title_id)
+        index = bisect_left(self._order, entry)
+        if index < len(self._order) and self._order[index] == entry:
+            del self._order[index]
+
+    def ordered_items(self) -> List[Dict]:
+        return [self._items[title_id] for _, title_id in self._order]
+
+
+# precomputed tooltip, display and sort values for each column of a search result
+SearchRowDisplay = namedtuple(
+    "SearchRowDisplay", ["media", "tooltips", "display", "sort"]
+)
+
 
 class LibbyLoansModel(LibbyModel):
     """
@@ -441,9 +753,8 @@ class LibbyLoansModel(LibbyModel):
         super().sync(synced_state)
         if not synced_state:
             synced_state = {}
-        self._rows = synced_state.get("loans", [])
         self._holds = synced_state.get("holds", [])
-        self.sort_rows()
+        self.sort_rows(synced_state.get("loans", []))
 
     def has_hold(self, loan: Dict) -> bool:
         # used to check that we don't offer to create a new hold for
@@ -451,12 +762,10 @@ class LibbyLoansModel(LibbyModel):
         return self.has_media(loan["id"], loan["cardId"], self._holds)
 
     def add_loan(self, loan: Dict):
-        self._rows.append(loan)
-        self.sort_rows()
+        self.sort_rows(self._rows + [loan])
 
     def remove_loan(self, loan: Dict):
-        self._rows = self.remove_media(loan["id"], loan["cardId"], self._rows)
-        self.sort_rows()
+        self.sort_rows(self.remove_media(loan["id"], loan["cardId"], self._rows))
 
     def add_hold(self, hold: Dict):
         self._holds.append(hold)
@@ -464,10 +773,14 @@ class LibbyLoansModel(LibbyModel):
     def remove_hold(self, hold: Dict):
         self._holds = self.remove_media(hold["id"], hold["cardId"], self._holds)
 
-    def sort_rows(self):
-        self.beginResetModel()
-        self._rows = sorted(self._rows, key=lambda ln: ln["checkoutDate"], reverse=True)
-        self.endResetModel()
+    def sort_rows(self, rows: Optional[List[Dict]] = None):
+        self.update_rows(
+            sorted(
+                self._rows if rows is None else rows,
+                key=lambda ln: ln["checkoutDate"],
+                reverse=True,
+            )
+        )
 
     def set_filter_hide_books_already_in_library(self, value: bool):
         if value != self.filter_hide_books_already_in_library:
@@ -583,11 +896,15 @@ class LibbyLoansModel(LibbyModel):
 
 
 class LibbyLoansSortFilterModel(LibbySortFilterModel):
-    def __init__(self, parent, model=None, db=None):
+    def __init__(
+        self,
+        parent,
+        model=None,
+        db=None,
+        library_index: Optional[LibraryMatchIndex] = None,
+    ):
         super().__init__(parent, model, db)
-        self.all_book_ids_titles = self.db.fields["title"].table.book_col_map
-        self.all_book_ids_formats = self.db.fields["formats"].table.book_col_map
-        self.all_book_ids_identifiers = self.db.fields["identifiers"].table.book_col_map
+        self.library_index = library_index or LibraryMatchIndex(self.db)
         self.filter_hide_books_already_in_library = PREFS[
             PreferenceKeys.HIDE_BOOKS_ALREADY_IN_LIB
         ]
@@ -620,6 +937,30 @@ class LibbyLoansSortFilterModel(LibbySortFilterModel):
             self.filter_hide_books_already_in_library = value
             self.invalidateFilter()
 
+    def is_in_library(self, loan: Dict, loan_format: Optional[str]) -> bool:
+        """
+        Check if a loan is already in the calibre library.
+        Empty books don't count if EXCLUDE_EMPTY_BOOKS is set.
+
+        :param loan:
+        :param loan_format:
+        :return:
+        """
+        loan_title1 = icu_lower(get_media_title(loan).strip())
+        loan_title2 = icu_lower(get_media_title(loan, include_subtitle=True).strip())
+        loan_isbn = OverDriveClient.extract_isbn(
+            loan.get("formats", []), [loan_format] if loan_format else []
+        )
+        loan_asin = OverDriveClient.extract_asin(loan.get("formats", []))
+        # check only first matching book
+        book_id = self.library_index.find_book(
+            (loan_title1, loan_title2), isbn=loan_isbn, asin=loan_asin
+        )
+        return book_id is not None and not (
+            PREFS[PreferenceKeys.EXCLUDE_EMPTY_BOOKS]
+            and not self.library_index.has_formats(book_id)
+        )
+
     def filterAcceptsRow(self, sourceRow, sourceParent):
         model: LibbyModel = self.sourceModel()
         index = model.index(sourceRow, 0, sourceParent)
@@ -649,30 +990,7 @@ class LibbyLoansSortFilterModel(LibbySortFilterModel):
             if self.is_temporarily_hidden(loan):
                 return False
 
-            book_in_library = False
-            loan_title2 = icu_lower(
-                get_media_title(loan, include_subtitle=True).strip()
-            )
-            loan_isbn = OverDriveClient.extract_isbn(
-                loan.get("formats", []), [loan_format] if loan_format else []
-            )
-            loan_asin = OverDriveClient.extract_asin(loan.get("formats", []))
-            for book_id, title in iter(self.all_book_ids_titles.items()):
-                book_identifiers = self.all_book_ids_identifiers.get(book_id) or {}
-                book_in_library = (
-                    icu_lower(title) in (loan_title1, loan_title2)
-                    or (loan_isbn and loan_isbn == book_identifiers.get("isbn", ""))
-                    or (loan_asin and loan_asin == book_identifiers.get("amazon", ""))
-                    or (loan_asin and loan_asin == book_identifiers.get("asin", ""))
-                )
-                if book_in_library:
-                    if PREFS[
-                        PreferenceKeys.EXCLUDE_EMPTY_BOOKS
-                    ] and not self.all_book_ids_formats.get(book_id):
-                        book_in_library = False
-                    break  # check only first matching book
-
-            if book_in_library:
+            if self.is_in_library(loan, loan_format):
                 return False
 
         if not self.filter_text:
@@ -714,29 +1032,60 @@ class LibbyHoldsModel(LibbyModel):
         super().sync(synced_state)
         if not synced_state:
             synced_state = {}
-        self._rows = synced_state.get("holds", [])
-        self.sort_rows()
+        self.sort_rows(synced_state.get("holds", []))
 
     def add_hold(self, hold: Dict):
-        self._rows.append(hold)
-        self.sort_rows()
+        self.sort_rows(self._rows + [hold])
 
     def remove_hold(self, hold: Dict):
-        self._rows = self.remove_media(hold["id"], hold["cardId"], self._rows)
-        self.sort_rows()
+        self.sort_rows(self.remove_media(hold["id"], hold["cardId"], self._rows))
 
-    def sort_rows(self):
-        self.beginResetModel()
-        self._rows = sorted(
-            self._rows,
-            key=lambda h: (
-                h["isAvailable"],
-                -h.get("estimatedWaitDays", 9999),
-                h["placedDate"],
+    def sort_rows(
+        self, rows: Optional[List[Dict]] = None, changed_keys: Iterable[Tuple] = ()
+    ):
+        self.update_rows(
+            sorted(
+                self._rows if rows is None else rows,
+                key=lambda h: (
+                    h["isAvailable"],
+                    -h.get("estimatedWaitDays", 9999),
+                    h["placedDate"],
+                ),
+                reverse=True,
             ),
-            reverse=True,
+            changed_keys,
         )
-        self.endResetModel()
+
+    def _library_key(self, hold: Dict) -> Optional[str]:
+        try:
+            return self.get_card(hold["cardId"])["advantageKey"]
+        except (KeyError, ValueError):
+            return None
+
+    def availability_title_ids(self) -> Dict[str, List[str]]:
+        """
+        The holds to refresh the availability for, by library key.
+
+        :return:
+        """
+        return AvailabilityRefresher.group_holds(self._rows, self._library_key)
+
+    def refresh_availability(self, availabilities: Dict[str, Dict[str, Dict]]):
+        """
+        Update the holds in place and re-sort them.
+
+        :param availabilities: Availability by library key and title ID
+        :return:
+        """
+        changed_keys = []
+        for hold in self._rows:
+            availability = availabilities.get(self._library_key(hold) or "", {}).get(
+                str(hold.get("id"))
+            )
+            if AvailabilityRefresher.patch_hold(hold, availability):
+                changed_keys.append(self.row_key(hold))
+        if changed_keys:
+            self.sort_rows(changed_keys=changed_keys)
 
     def setData(self, index, hold, role=Qt.EditRole):
         if role == Qt.EditRole:
@@ -983,12 +1332,10 @@ class LibbyMagazinesModel(LibbyModel):
         if not synced_state:
             synced_state = {}
         self._loans = synced_state.get("loans", [])
-        self._rows = synced_state.get("__subscriptions", [])
-        self.fill_and_sort_rows()
+        self.fill_and_sort_rows(synced_state.get("__subscriptions", []))
 
     def sync_subscriptions(self, subscriptions: List[Dict]):
-        self._rows = subscriptions
-        self.fill_and_sort_rows()
+        self.fill_and_sort_rows(subscriptions)
 
     def add_loan(self, loan: Dict):
         self._loans.append(loan)
@@ -998,16 +1345,20 @@ class LibbyMagazinesModel(LibbyModel):
         self._loans = self.remove_media(loan["id"], loan["cardId"], self._loans)
         self.fill_and_sort_rows()
 
-    def fill_and_sort_rows(self):
-        self.beginResetModel()
-        self._rows = sorted(
-            self._rows, key=lambda t: t["estimatedReleaseDate"], reverse=True
+    def fill_and_sort_rows(self, rows: Optional[List[Dict]] = None):
+        rows = sorted(
+            self._rows if rows is None else rows,
+            key=lambda t: t["estimatedReleaseDate"],
+            reverse=True,
         )
-        for r in self._rows:
-            r[self.is_borrowed_key] = bool(
-                [loan for loan in self._loans if loan["id"] == r["id"]]
-            )
-        self.endResetModel()
+        loan_ids = set([loan["id"] for loan in self._loans])
+        changed_keys = []
+        for r in rows:
+            is_borrowed = r["id"] in loan_ids
+            if r.get(self.is_borrowed_key) != is_borrowed:
+                r[self.is_borrowed_key] = is_borrowed
+                changed_keys.append(self.row_key(r))
+        self.update_rows(rows, changed_keys)
 
     def data(self, index, role):
         row, col = index.row(), index.column()
@@ -1055,10 +1406,15 @@ class LibbyMagazinesModel(LibbyModel):
 
 
 class LibbyMagazinesSortFilterModel(LibbySortFilterModel):
-    def __init__(self, parent, model=None, db=None):
+    def __init__(
+        self,
+        parent,
+        model=None,
+        db=None,
+        library_index: Optional[LibraryMatchIndex] = None,
+    ):
         super().__init__(parent, model, db)
-        self.all_book_ids_titles = self.db.fields["title"].table.book_col_map
-        self.all_book_ids_formats = self.db.fields["formats"].table.book_col_map
+        self.library_index = library_index or LibraryMatchIndex(self.db)
         self.filter_hide_magazines_already_in_library = PREFS[
             PreferenceKeys.HIDE_BOOKS_ALREADY_IN_LIB
         ]
@@ -1079,17 +1435,14 @@ class LibbyMagazinesSortFilterModel(LibbySortFilterModel):
 
         if self.filter_hide_magazines_already_in_library:
             # hide lib books filter is enabled
-            book_in_library = False
             q1 = icu_lower(get_media_title(subscription).strip())
             q2 = icu_lower(get_media_title(subscription, include_subtitle=True).strip())
-            for book_id, title in iter(self.all_book_ids_titles.items()):
-                if icu_lower(title) not in (q1, q2):
-                    continue
-                if (
-                    not PREFS[PreferenceKeys.EXCLUDE_EMPTY_BOOKS]
-                ) or self.all_book_ids_formats.get(book_id):
-                    book_in_library = True
-                break  # check only first matching book title
+            # check only first matching book title
+            book_id = self.library_index.find_book((q1, q2))
+            book_in_library = book_id is not None and (
+                not PREFS[PreferenceKeys.EXCLUDE_EMPTY_BOOKS]
+                or self.library_index.has_formats(book_id)
+            )
             if book_in_library:
                 return False
 
@@ -1121,6 +1474,10 @@ class LibbySearchModel(LibbyModel):
     filter_hide_magazines_already_in_library = False
 
     def __init__(self, parent, synced_state=None, db=None):
+        # display values per row, keyed by id(media)
+        self._display_cache: Dict[int, SearchRowDisplay] = {}
+        # if a merged result is listed, keyed by id(media)
+        self._listed_results: Dict[int, bool] = {}
         super().__init__(parent, synced_state, db)
         self._search_results: List[Dict] = []
         self.sync(synced_state)
@@ -1156,45 +1513,168 @@ class LibbySearchModel(LibbyModel):
 
         if "search_results" not in synced_state:
             return
-        self.beginResetModel()
+        new_rows = [
+            r for r in synced_state["search_results"] if self._prepare_search_result(r)
+        ]
         if (self._rows is None) or clearOldResults :
-            self._rows = []
-        for r in synced_state["search_results"]:
-            try:
-                if is_valid_type(r, include_provisional=True):
-                    # Patch missing formats: Sometimes search returns no "formats"
-                    # even if siteAvailabilities does contain formats. Maybe a setup problem.
-                    # We'll manually patch these cases here. These "patched" formats are not
-                    # full formats, just a dict("id, "name"), no ISBN etc.
-                    if r.get("siteAvailabilities") and not r.get("formats"):
-                        formats: List[Dict] = []
-                        for sa in r["siteAvailabilities"].values():
-                            for site_format in sa.get("formats", []):
-                                if [
-                                    f
-                                    for f in formats
-                                    if f.get("id", "") == site_format.get("id", "")
-                                ]:
-                                    continue
-                                formats.append(site_format)
-                        if formats:
-                            r["formats"] = formats
-                    self._rows.append(r)
-            except ValueError:
-                pass
-        self.endResetModel()
+            # a new search
+            self._display_cache = {}
+            self._listed_results = {}
+            for r in new_rows:
+                self._display_cache[id(r)] = self._compute_display(r)
+            self._reset_rows(new_rows)
+            return
+        # another page of results, so only add the new rows
+        for r in new_rows:
+            self._display_cache[id(r)] = self._compute_display(r)
+        if new_rows:
+            self.beginInsertRows(
+                QModelIndex(), len(self._rows), len(self._rows) + len(new_rows) - 1
+            )
+            self._rows.extend(new_rows)
+            self.endInsertRows()
+
+    @staticmethod
+    def _prepare_search_result(r: Dict) -> bool:
+        """
+        Check if a search result should be listed, and patch missing formats.
+
+        :param r:
+        :return: True if the result should be listed
+        """
+        try:
+            if not is_valid_type(r, include_provisional=True):
+                return False
+        except ValueError:
+            return False
+        # Patch missing formats: Sometimes search returns no "formats"
+        # even if siteAvailabilities does contain formats. Maybe a setup problem.
+        # We'll manually patch these cases here. These "patched" formats are not
+        # full formats, just a dict("id, "name"), no ISBN etc.
+        if r.get("siteAvailabilities") and not r.get("formats"):
+            formats: List[Dict] = []
+            for sa in r["siteAvailabilities"].values():
+                for site_format in sa.get("formats", []):
+                    if [
+                        f
+                        for f in formats
+                        if f.get("id", "") == site_format.get("id", "")
+                    ]:
+                        continue
+                    formats.append(site_format)
+            if formats:
+                r["formats"] = formats
+        return True
+
+    def merge_search_results(
+        self, previous_rows: List[Dict], results: List[Dict], changed: List[Dict]
+    ):
+        """
+        Show a partially merged page of search results, updating only the rows that changed.
+
+        :param previous_rows: Rows from earlier pages, shown before results
+        :param results: The merged results for the current page, in rank order
+        :param changed: Results that were added or updated since the last call
+        :return:
+        """
+        for r in changed:
+            self._listed_results[id(r)] = self._prepare_search_result(r)
+            self._display_cache[id(r)] = self._compute_display(r)
+        rows = list(previous_rows) + [
+            r for r in results if self._listed_results.get(id(r))
+        ]
+        self.update_rows(rows, [self.row_key(r) for r in changed])
 
     def add_hold(self, hold: Dict):
         self._holds.append(hold)
+        self.invalidate_media(hold["id"])
 
     def remove_hold(self, hold: Dict):
         self._holds = self.remove_media(hold["id"], hold["cardId"], self._holds)
+        self.invalidate_media(hold["id"])
 
     def add_loan(self, loan: Dict):
         self._loans.append(loan)
+        self.invalidate_media(loan["id"])
 
     def remove_loan(self, loan: Dict):
         self._loans = self.remove_media(loan["id"], loan["cardId"], self._loans)
+        self.invalidate_media(loan["id"])
+
+    def availability_title_ids(self) -> Dict[str, List[str]]:
+        """
+        The search results to refresh the availability for, by library key.
+
+        :return:
+        """
+        return AvailabilityRefresher.group_search_results(self._rows or [])
+
+    def refresh_availability(self, availabilities: Dict[str, Dict[str, Dict]]):
+        """
+        Update the siteAvailabilities of the search results in place.
+
+        :param availabilities: Availability by library key and title ID
+        :return:
+        """
+        changed_keys = []
+        for media in self._rows or []:
+            if AvailabilityRefresher.patch_search_result(media, availabilities):
+                self._display_cache[id(media)] = self._compute_display(media)
+                changed_keys.append(self.row_key(media))
+        if changed_keys:
+            self.update_rows(list(self._rows), changed_keys)
+
+    def invalidate_media(self, title_id: str):
+        """
+        Recompute the display values of the rows for a title, e.g. when its availability has changed.
+
+        :param title_id:
+        :return:
+        """
+        for row, media in enumerate(self._rows or []):
+            if media.get("id") != title_id:
+                continue
+            self._display_cache[id(media)] = self._compute_display(media)
+            self.dataChanged.emit(
+                self.index(row, 0), self.index(row, self.columnCount() - 1)
+            )
+
+    def _get_display(self, media: Dict) -> "SearchRowDisplay":
+        display = self._display_cache.get(id(media))
+        if display is None or display.media is not media:
+            # rows can be set directly, e.g. when restoring saved results
+            display = self._compute_display(media)
+            self._display_cache[id(media)] = display
+        return display
+
+    def _compute_display(self, media: Dict) -> "SearchRowDisplay":
+        available_sites = []
+        for k, v in media.get("siteAvailabilities", {}).items():
+            v["advantageKey"] = k
+            available_sites.append(v)
+        available_sites = sorted(
+            available_sites,
+            key=cmp_to_key(OverDriveClient.sort_availabilities),
+            reverse=True,
+        )
+        columns = range(len(self.column_headers))
+        return SearchRowDisplay(
+            media,
+            tuple(
+                self._compute_data(media, col, Qt.ToolTipRole, available_sites)
+                for col in columns
+            ),
+            tuple(
+                self._compute_data(media, col, Qt.DisplayRole, available_sites)
+                for col in columns
+            ),
+            tuple(
+                self._compute_data(
+                    media, col, LibbyModel.DisplaySortRole, available_sites
+                )
+                for col in columns
+            ),
+        )
 
     def data(self, index, role):
         row, col = index.row(), index.column()
@@ -1207,16 +1687,16 @@ class LibbySearchModel(LibbyModel):
         # TextAlignmentRole
         if role == Qt.TextAlignmentRole and col >= 2:
             return Qt.AlignCenter
+        if role == Qt.ToolTipRole:
+            return self._get_display(media).tooltips[col]
+        if role == Qt.DisplayRole:
+            return self._get_display(media).display[col]
+        if role == LibbyModel.DisplaySortRole:
+            return self._get_display(media).sort[col]
+        return None
+
+    def _compute_data(self, media: Dict, col: int, role, available_sites: List[Dict]):
         # ToolTipRole
-        available_sites = []
-        for k, v in media.get("siteAvailabilities", {}).items():
-            v["advantageKey"] = k
-            available_sites.append(v)
-        available_sites = sorted(
-            available_sites,
-            key=cmp_to_key(OverDriveClient.sort_availabilities),
-            reverse=True,
-        )
         if role == Qt.ToolTipRole:
             if col == 0:
                 return get_media_title(media, include_subtitle=True)
@@ -1245,7 +1725,13 @@ class LibbySearchModel(LibbyModel):
         if col == 2:
             publish_date = media.get("publishDate") or media.get("estimatedReleaseDate")
             if publish_date:
-                dt_value = LibbyClient.parse_datetime(publish_date)
+                try:
+                    dt_value = LibbyClient.parse_datetime(publish_date)
+                except ValueError:
+                    dt_value = None
+                if not dt_value:
+                    # malformed date
+                    return ""
                 if role == LibbyModel.DisplaySortRole:
                     return dt_value.isoformat()
                 return dt_value.year
@@ -0,0 +1,28 @@
+#
+# Copyright (C) 2023 github.com/ping
+#
+# This file is part of the OverDrive Libby Plugin by ping
+# OverDrive Libby Plugin for calibre / libby-calibre-plugin
+#
+# See https://github.com/ping/libby-calibre-plugin for more
+# information
+#
+# Now being maintained at https://github.com/sgmoore/libby-calibre-plugin
+#
+
+# flake8: noqa
+from .cancel import (
+    CancelToken,
+    RequestCancelledError,
+    cancellation_scope,
+    current_cancel_token,
+    raise_if_cancelled,
+)
+from .pool import (
+    ConnectionPool,
+    PooledHTTPHandler,
+    PooledHTTPSHandler,
+    SHARED_POOL,
+    pooled_handlers,
+)
+from .retry import CircuitBreaker, RetryPolicy, SHARED_BREAKER
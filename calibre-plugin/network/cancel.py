@@ -0,0 +1,127 @@
+#
+# Copyright (C) 2023 github.com/ping
+#
+# This file is part of the OverDrive Libby Plugin by ping
+# OverDrive Libby Plugin for calibre / libby-calibre-plugin
+#
+# See https://github.com/ping/libby-calibre-plugin for more
+# information
+#
+# Now being maintained at https://github.com/sgmoore/libby-calibre-plugin
+#
+
+from contextlib import contextmanager
+from threading import Event, Lock, local
+from typing import Callable, Iterator, List, Optional
+
+
+class RequestCancelledError(Exception):
+    """Raised when a request is dropped because its cancel token was cancelled."""
+
+    pass
+
+
+class CancelToken(object):
+    """
+    Cooperative cancellation for the requests made by a worker.
+
+    Cancelling runs the registered callbacks, which the connection pool uses to
+    shut down the sockets of requests that are still in flight.
+    """
+
+    def __init__(self) -> None:
+        self._event = Event()
+        self._lock = Lock()
+        self._callbacks: List[Callable[[], None]] = []
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def cancel(self) -> None:
+        with self._lock:
+            if self._event.is_set():
+                return
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception:  # noqa
+                pass
+
+    def on_cancel(self, callback: Callable[[], None]) -> Callable[[], None]:
+        """
+        Register a callback to run when the token is cancelled.
+        If the token is already cancelled, the callback is run immediately.
+
+        :param callback:
+        :return: A function that unregisters the callback
+        """
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+                return lambda: self._remove(callback)
+        callback()
+        return lambda: None
+
+    def _remove(self, callback: Callable[[], None]) -> None:
+        with self._lock:
+            try:
+                self._callbacks.remove(callback)
+            except ValueError:
+                pass
+
+    def wait(self, seconds: float) -> bool:
+        """
+        Sleep for up to the number of seconds, waking up early if cancelled.
+
+        :param seconds:
+        :return: True if cancelled
+        """
+        return self._event.wait(seconds)
+
+    def raise_if_cancelled(self) -> None:
+        if self._event.is_set():
+            raise RequestCancelledError("Request was cancelled")
+
+
+_current = local()
+
+
+def current_cancel_token() -> Optional[CancelToken]:
+    """
+    The cancel token of the worker running on this thread, if any.
+
+    :return:
+    """
+    return getattr(_current, "token", None)
+
+
+@contextmanager
+def cancellation_scope(token: Optional[CancelToken]) -> Iterator[None]:
+    """
+    Make token the current cancel token for requests sent from this thread.
+
+    :param token:
+    :return:
+    """
+    previous = current_cancel_token()
+    _current.token = token
+    try:
+        yield
+    finally:
+        _current.token = previous
+
+
+def raise_if_cancelled() -> None:
+    """
+    Raise RequestCancelledError if the current cancel token was cancelled.
+    Called by the clients before each attempt, and when a request fails,
+    so that an aborted connection is not mistaken for a network failure.
+
+    :return:
+    """
+    token = current_cancel_token()
+    if token is not None:
+        token.raise_if_cancelled()
@@ -0,0 +1,320 @@
+#
+# Copyright (C) 2023 github.com/ping
+#
+# This file is part of the OverDrive Libby Plugin by ping
+# OverDrive Libby Plugin for calibre / libby-calibre-plugin
+#
+# See https://github.com/ping/libby-calibre-plugin for more
+# information
+#
+# Now being maintained at https://github.com/sgmoore/libby-calibre-plugin
+#
+
+import socket
+import time
+from http.client import HTTPConnection, HTTPResponse
+from threading import Lock
+from typing import Dict, List, Optional, Tuple
+from urllib.error import URLError
+from urllib.request import HTTPHandler, HTTPSHandler, Request
+
+from .cancel import current_cancel_token
+
+# Errors that indicate a kept-alive connection was closed by the server while idle.
+# RemoteDisconnected is a subclass of ConnectionResetError.
+STALE_CONNECTION_ERRORS = (ConnectionResetError, BrokenPipeError, ConnectionAbortedError)
+# requests that can be sent again if the server may already have received them
+IDEMPOTENT_METHODS = ("GET", "HEAD", "OPTIONS", "PUT", "DELETE", "TRACE")
+
+
+class _PooledHTTPResponse(HTTPResponse):
+    """
+    Tracks if the response was closed before the body was fully consumed,
+    in which case the connection it came from cannot be reused.
+    """
+
+    abandoned = False
+
+    def close(self):
+        if not self.isclosed():
+            self.abandoned = True
+        super().close()
+
+
+class ConnectionPool(object):
+    """
+    A thread-safe pool of keep-alive http(s) connections, keyed by scheme and host.
+
+    A connection is handed back to the pool together with its response, and only
+    becomes available for reuse once that response body has been fully read.
+    """
+
+    def __init__(self, max_per_host: int = 6, idle_timeout: float = 30.0) -> None:
+        """
+
+        :param max_per_host: Maximum number of connections kept per host
+        :param idle_timeout: Seconds an idle connection is kept before being closed
+        """
+        self.max_per_host = max_per_host
+        self.idle_timeout = idle_timeout
+        self._lock = Lock()
+        # (scheme, host) -> [(connection, last used)]
+        self._idle: Dict[Tuple[str, str], List[Tuple[HTTPConnection, float]]] = {}
+        # (scheme, host) -> [(connection, response, released at)]
+        self._busy: Dict[
+            Tuple[str, str], List[Tuple[HTTPConnection, HTTPResponse, float]]
+        ] = {}
+        self.reused_count = 0
+        self.new_count = 0
+
+    @staticmethod
+    def _close(conn: HTTPConnection) -> None:
+        try:
+            conn.close()
+        except Exception:  # noqa
+            pass
+
+    @staticmethod
+    def _detach(conn: HTTPConnection) -> None:
+        """
+        Drop the connection's own reference to its socket. The socket stays open
+        until the outstanding response is closed, the same as a non-pooled urllib request.
+        """
+        if conn.sock:
+            conn.sock.close()
+            conn.sock = None
+
+    def _sweep(self, key: Tuple[str, str], now: float) -> None:
+        """
+        Move connections with fully read responses to the idle list and
+        drop anything that has expired. Must be called with the lock held.
+        """
+        idle = self._idle.setdefault(key, [])
+        still_busy = []
+        for conn, res, released_at in self._busy.get(key, []):
+            if res.isclosed():
+                if getattr(res, "abandoned", False) or res.will_close:
+                    self._close(conn)
+                else:
+                    idle.append((conn, released_at))
+            elif now - released_at > self.idle_timeout:
+                # response was never read, stop tracking it
+                self._detach(conn)
+            else:
+                still_busy.append((conn, res, released_at))
+        self._busy[key] = still_busy
+
+        fresh = []
+        for conn, last_used in idle:
+            if now - last_used > self.idle_timeout:
+                self._close(conn)
+            else:
+                fresh.append((conn, last_used))
+        self._idle[key] = fresh
+
+    def acquire(
+        self, scheme: str, host: str, http_class, timeout: Optional[float], **conn_args
+    ) -> Tuple[HTTPConnection, bool]:
+        """
+        Get a connection for the host, reusing an idle one if available.
+
+        :param scheme:
+        :param host:
+        :param http_class: HTTPConnection or HTTPSConnection
+        :param timeout:
+        :param conn_args: Extra connection args, e.g. ssl context
+        :return: Tuple of (connection, is_reused)
+        """
+        key = (scheme, host)
+        with self._lock:
+            self._sweep(key, time.monotonic())
+            idle = self._idle[key]
+            if idle:
+                conn, _ = idle.pop()  # most recently used first
+                self.reused_count += 1
+                conn.timeout = timeout
+                if conn.sock is not None:
+                    conn.sock.settimeout(timeout)
+                return conn, True
+            self.new_count += 1
+
+        conn = http_class(host, timeout=timeout, **conn_args)
+        conn.response_class = _PooledHTTPResponse
+        return conn, False
+
+    def release(self, scheme: str, host: str, conn: HTTPConnection, res) -> None:
+        """
+        Return a connection to the pool. It is reused only after the response is read.
+
+        :param scheme:
+        :param host:
+        :param conn:
+        :param res: The response received on the connection
+        :return:
+        """
+        key = (scheme, host)
+        if res.will_close:
+            self._detach(conn)
+            return
+        with self._lock:
+            tracked = len(self._idle.get(key, [])) + len(self._busy.get(key, []))
+            if tracked >= self.max_per_host:
+                self._detach(conn)
+                return
+            self._busy.setdefault(key, []).append((conn, res, time.monotonic()))
+
+    def discard(self, conn: HTTPConnection) -> None:
+        self._close(conn)
+
+    def clear(self) -> None:
+        """
+        Close all idle connections and stop tracking busy ones.
+
+        :return:
+        """
+        with self._lock:
+            for conns in self._idle.values():
+                for conn, _ in conns:
+                    self._close(conn)
+            for busy in self._busy.values():
+                for conn, _, _ in busy:
+                    self._detach(conn)
+            self._idle = {}
+            self._busy = {}
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Connection counters, to confirm that connections are being reused.
+
+        :return:
+        """
+        with self._lock:
+            return {
+                "reused": self.reused_count,
+                "new": self.new_count,
+                "pooled": sum(len(v) for v in self._idle.values())
+                + sum(len(v) for v in self._busy.values()),
+            }
+
+
+# shared by the Libby and OverDrive clients
+SHARED_POOL = ConnectionPool()
+
+
+def _abort_callback(conn: HTTPConnection, state: Dict):
+    """
+    Build a cancel callback that shuts down the connection's socket, which
+    makes a blocked send or read on another thread fail straight away.
+    It does nothing once the response has been fully read, because the
+    connection may by then be in use by another request.
+
+    :param conn:
+    :param state: Holds the socket and response once they are available
+    :return:
+    """
+
+    def abort() -> None:
+        res = state.get("response")
+        if res is not None and res.isclosed():
+            return
+        sock = state.get("sock") or conn.sock
+        if sock is None:
+            return
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    return abort
+
+
+class _PooledHandlerMixin(object):
+    pool: ConnectionPool
+
+    def do_open(self, http_class, req: Request, **http_conn_args):
+        """
+        Replaces AbstractHTTPHandler.do_open so that the connection
+        is kept alive and returned to the pool instead of closed.
+        """
+        if getattr(req, "_tunnel_host", None) or req.has_proxy():
+            # leave proxied requests to the stock implementation
+            return super().do_open(http_class, req, **http_conn_args)  # type: ignore[misc]
+
+        host = req.host
+        if not host:
+            raise URLError("no host given")
+
+        headers = dict(req.unredirected_hdrs)
+        headers.update({k: v for k, v in req.headers.items() if k not in headers})
+        headers.pop("Connection", None)
+        headers = {name.title(): val for name, val in headers.items()}
+        scheme = req.type
+
+        token = current_cancel_token()
+        while True:
+            if token is not None:
+                token.raise_if_cancelled()
+            conn, is_reused = self.pool.acquire(
+                scheme, host, http_class, req.timeout, **http_conn_args
+            )
+            conn.set_debuglevel(self._debuglevel)  # type: ignore[attr-defined]
+            state: Dict = {"sock": conn.sock}
+            if token is not None:
+                token.on_cancel(_abort_callback(conn, state))
+            try:
+                try:
+                    conn.request(
+                        req.get_method(),
+                        req.selector,
+                        req.data,
+                        headers,
+                        encode_chunked=req.has_header("Transfer-encoding"),
+                    )
+                except OSError as err:
+                    if is_reused and isinstance(err, STALE_CONNECTION_ERRORS):
+                        raise
+                    raise URLError(err)
+                state["sock"] = conn.sock
+                res = conn.getresponse()
+                state["response"] = res
+            except STALE_CONNECTION_ERRORS:
+                self.pool.discard(conn)
+                if is_reused and req.get_method() in IDEMPOTENT_METHODS:
+                    # server closed the idle connection, try again with a new one
+                    continue
+                raise
+            except:  # noqa: E722
+                self.pool.discard(conn)
+                raise
+            break
+
+        self.pool.release(scheme, host, conn, res)
+        res.url = req.get_full_url()
+        # as in AbstractHTTPHandler.do_open, HTTPErrorProcessor and HTTPError
+        # use msg as the reason phrase instead of the headers
+        setattr(res, "msg", res.reason)
+        return res
+
+
+class PooledHTTPHandler(_PooledHandlerMixin, HTTPHandler):
+    def __init__(self, pool: Optional[ConnectionPool] = None, debuglevel: int = 0):
+        super().__init__(debuglevel=debuglevel)
+        self.pool = pool or SHARED_POOL
+
+
+class PooledHTTPSHandler(_PooledHandlerMixin, HTTPSHandler):
+    def __init__(
+        self, pool: Optional[ConnectionPool] = None, debuglevel: int = 0, **kwargs
+    ):
+        super().__init__(debuglevel=debuglevel, **kwargs)
+        self.pool = pool or SHARED_POOL
+
+
+def pooled_handlers(pool: Optional[ConnectionPool] = None) -> List:
+    """
+    Handlers to pass to urllib's build_opener so that requests use the connection pool.
+
+    :param pool: Defaults to the shared pool
+    :return:
+    """
+    return [PooledHTTPHandler(pool), PooledHTTPSHandler(pool)]
@@ -0,0 +1,184 @@
+#
+# Copyright (C) 2023 github.com/ping
+#
+# This file is part of the OverDrive Libby Plugin by ping
+# OverDrive Libby Plugin for calibre / libby-calibre-plugin
+#
+# See https://github.com/ping/libby-calibre-plugin for more
+# information
+#
+# Now being maintained at https://github.com/sgmoore/libby-calibre-plugin
+#
+
+import random
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from threading import Lock, get_ident
+from typing import Dict, Optional, Tuple
+
+from .cancel import current_cancel_token
+
+
+class CircuitBreaker(object):
+    """
+    Per-host circuit breaker. After a number of consecutive failures, the host is
+    treated as down for a cooldown period so that concurrent workers stop sending
+    requests instead of each one waiting for its own timeout.
+    After the cooldown, a single trial request is let through. If the trial does not
+    report back within another cooldown, e.g. because its worker died, a new trial is let through.
+    """
+
+    def __init__(self, failure_threshold: int = 5, cooldown: float = 30.0) -> None:
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self._lock = Lock()
+        self._failures: Dict[str, int] = {}
+        self._opened_at: Dict[str, float] = {}
+        # when the current trial request for each host was let through, and to which thread
+        self._trials: Dict[str, Tuple[float, int]] = {}
+
+    def blocked_for(self, host: str) -> float:
+        """
+        Check if requests to the host should be blocked.
+
+        :param host:
+        :return: Remaining seconds that the host is blocked for, 0 if not blocked
+        """
+        with self._lock:
+            opened_at = self._opened_at.get(host)
+            if opened_at is None:
+                return 0
+            now = time.monotonic()
+            remaining = self.cooldown - (now - opened_at)
+            if remaining > 0:
+                return remaining
+            trial = self._trials.get(host)
+            if trial is not None:
+                remaining = self.cooldown - (now - trial[0])
+                if remaining > 0:
+                    # someone else is already testing the host
+                    return remaining
+            self._trials[host] = (now, get_ident())
+            return 0
+
+    def record_success(self, host: str) -> None:
+        with self._lock:
+            self._failures.pop(host, None)
+            self._opened_at.pop(host, None)
+            self._trials.pop(host, None)
+
+    def record_failure(self, host: str) -> None:
+        with self._lock:
+            failures = self._failures.get(host, 0) + 1
+            self._failures[host] = failures
+            if self._trials.pop(host, None) is not None or (
+                failures >= self.failure_threshold
+            ):
+                self._opened_at[host] = time.monotonic()
+
+    def release_trial(self, host: str) -> None:
+        """
+        Give up the trial request held by the current thread, if it ended without a result,
+        e.g. because it was cancelled, so that the next request can be the trial.
+        The host stays open.
+
+        :param host:
+        :return:
+        """
+        with self._lock:
+            trial = self._trials.get(host)
+            if trial is not None and trial[1] == get_ident():
+                del self._trials[host]
+
+    def reset(self) -> None:
+        with self._lock:
+            self._failures = {}
+            self._opened_at = {}
+            self._trials = {}
+
+
+# shared by the Libby and OverDrive clients
+SHARED_BREAKER = CircuitBreaker()
+
+
+class RetryPolicy(object):
+    """
+    Decides if and when a failed request should be retried.
+    Uses exponential backoff with jitter and honours the Retry-After header.
+    """
+
+    RETRYABLE_STATUS_CODES = (429,)
+
+    def __init__(
+        self,
+        backoff_base: float = 1.0,
+        max_delay: float = 30.0,
+        breaker: Optional[CircuitBreaker] = None,
+    ) -> None:
+        """
+
+        :param backoff_base: Delay in seconds before the first retry
+        :param max_delay: Maximum delay in seconds between retries. If the server asks
+                          for a longer wait via Retry-After, the request is not retried.
+        :param breaker: Defaults to the shared circuit breaker
+        """
+        self.backoff_base = backoff_base
+        self.max_delay = max_delay
+        self.breaker = breaker or SHARED_BREAKER
+
+    def is_retryable_status(self, status_code: int) -> bool:
+        return status_code >= 500 or status_code in self.RETRYABLE_STATUS_CODES
+
+    @staticmethod
+    def parse_retry_after(value: Optional[str]) -> Optional[float]:
+        """
+        Parse a Retry-After header value, which can be in seconds or a http date.
+
+        :param value:
+        :return: Seconds to wait, or None if not parseable
+        """
+        if not value:
+            return None
+        value = value.strip()
+        if value.isdigit():
+            return float(value)
+        try:
+            retry_at = parsedate_to_datetime(value)
+        except (TypeError, ValueError, IndexError):
+            return None
+        if retry_at.tzinfo is None:
+            retry_at = retry_at.replace(tzinfo=timezone.utc)
+        return max(0.0, (retry_at - datetime.now(tz=timezone.utc)).total_seconds())
+
+    def get_delay(self, attempt: int, retry_after: Optional[str] = None) -> Optional[float]:
+        """
+        The time to wait before the next attempt.
+
+        :param attempt: The zero-based attempt number that failed
+        :param retry_after: Retry-After header value, if any
+        :return: Seconds to wait, or None if the request should not be retried
+        """
+        retry_after_seconds = self.parse_retry_after(retry_after)
+        if retry_after_seconds is not None:
+            if retry_after_seconds > self.max_delay:
+                return None
+            return retry_after_seconds
+        delay = min(self.max_delay, self.backoff_base * (2**attempt))
+        # "equal jitter" so that concurrent workers don't retry in lockstep
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    def sleep(self, seconds: float) -> None:
+        """
+        Wait before retrying. Raises RequestCancelledError if the
+        current cancel token is cancelled while waiting.
+
+        :param seconds:
+        :return:
+        """
+        token = current_cancel_token()
+        if token is None:
+            time.sleep(seconds)
+            return
+        token.wait(seconds)
+        token.raise_if_cancelled()
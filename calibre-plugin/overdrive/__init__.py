@@ -11,4 +11,8 @@
 #
 
 # flake8: noqa
+from .cache import LibrarySearchCache, SHARED_SEARCH_CACHE
 from .client import OverDriveClient, LibraryMediaSearchParams
+from .planner import LibrarySearchPlanner
+from .prefetch import SearchPagePrefetches
+from .availability import AvailabilityRefresher
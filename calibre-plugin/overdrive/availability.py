@@ -0,0 +1,145 @@
+#
+# Copyright (C) 2023 github.com/ping
+#
+# This file is part of the OverDrive Libby Plugin by ping
+# OverDrive Libby Plugin for calibre / libby-calibre-plugin
+#
+# See https://github.com/ping/libby-calibre-plugin for more
+# information
+#
+# Now being maintained at https://github.com/sgmoore/libby-calibre-plugin
+#
+
+from typing import Callable, Dict, Iterable, List, Optional
+from urllib.error import HTTPError
+
+from .cache import LibrarySearchCache
+from .client import OverDriveClient
+from .errors import ClientError
+from ..tools.CustomLogger import CustomLogger
+
+
+class AvailabilityRefresher(object):
+    """
+    Refreshes the availability of titles already shown, e.g. holds and search results,
+    with library_media_availability_bulk instead of a full sync or a new search.
+
+    Fetching is done on a worker thread. Patching modifies the rows in place
+    and is left to the models, on the gui thread.
+    """
+
+    # Hold fields updated from the availability
+    HOLD_AVAILABILITY_KEYS = ("estimatedWaitDays", "isAvailable")
+
+    def __init__(self, client: OverDriveClient, batch_size: int = 50) -> None:
+        """
+
+        :param client:
+        :param batch_size: Maximum number of title IDs per request
+        """
+        self.client = client
+        self.batch_size = batch_size
+
+    def fetch(
+        self, title_ids_by_library: Dict[str, Iterable[str]]
+    ) -> Dict[str, Dict[str, Dict]]:
+        """
+        Get the availability of titles, one request per library and batch.
+        Libraries that fail are left out.
+
+        :param title_ids_by_library:
+        :return: Availability by library key and title ID
+        """
+        availabilities: Dict[str, Dict[str, Dict]] = {}
+        for library_key, title_ids in title_ids_by_library.items():
+            title_ids = sorted(set(title_ids))
+            library_availabilities: Dict[str, Dict] = {}
+            try:
+                for i in range(0, len(title_ids), self.batch_size):
+                    res = self.client.library_media_availability_bulk(
+                        library_key, title_ids[i : i + self.batch_size]
+                    )
+                    for item in res.get("items") or []:
+                        if item and item.get("id"):
+                            library_availabilities[str(item["id"])] = item
+            except (ClientError, HTTPError) as err:
+                CustomLogger.logger.warning(
+                    "Unable to refresh availability for %s: %s", library_key, err
+                )
+                continue
+            availabilities[library_key] = library_availabilities
+        return availabilities
+
+    @staticmethod
+    def group_holds(
+        holds: List[Dict], get_library_key: Callable[[Dict], Optional[str]]
+    ) -> Dict[str, List[str]]:
+        """
+        Group holds by library key.
+
+        :param holds:
+        :param get_library_key: Returns the library key of a hold, from its card
+        :return: Title IDs by library key
+        """
+        grouped: Dict[str, List[str]] = {}
+        for hold in holds:
+            library_key = get_library_key(hold)
+            if library_key and hold.get("id"):
+                grouped.setdefault(library_key, []).append(str(hold["id"]))
+        return grouped
+
+    @staticmethod
+    def group_search_results(medias: List[Dict]) -> Dict[str, List[str]]:
+        """
+        Group search results by the libraries in their siteAvailabilities.
+
+        :param medias:
+        :return: Title IDs by library key
+        """
+        grouped: Dict[str, List[str]] = {}
+        for media in medias:
+            if not media.get("id"):
+                continue
+            for library_key in (media.get("siteAvailabilities") or {}).keys():
+                grouped.setdefault(library_key, []).append(str(media["id"]))
+        return grouped
+
+    @classmethod
+    def patch_hold(cls, hold: Dict, availability: Optional[Dict]) -> bool:
+        """
+        Update a hold with its title's availability.
+
+        :param hold:
+        :param availability:
+        :return: True if the hold was changed
+        """
+        return cls._patch(hold, availability, cls.HOLD_AVAILABILITY_KEYS)
+
+    @classmethod
+    def patch_search_result(
+        cls, media: Dict, availabilities: Dict[str, Dict[str, Dict]]
+    ) -> bool:
+        """
+        Update the siteAvailabilities of a search result.
+
+        :param media:
+        :param availabilities: Availability by library key and title ID
+        :return: True if the search result was changed
+        """
+        changed = False
+        for library_key, site in (media.get("siteAvailabilities") or {}).items():
+            availability = availabilities.get(library_key, {}).get(str(media.get("id")))
+            if cls._patch(site, availability, LibrarySearchCache.AVAILABILITY_KEYS):
+                changed = True
+        return changed
+
+    @staticmethod
+    def _patch(target: Dict, availability: Optional[Dict], keys: Iterable[str]) -> bool:
+        if not availability:
+            return False
+        changed = False
+        for k in keys:
+            if k in availability and target.get(k) != availability[k]:
+                target[k] = availability[k]
+                changed = True
+        return changed
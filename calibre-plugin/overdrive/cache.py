@@ -0,0 +1,186 @@
+#
+# Copyright (C) 2023 github.com/ping
+#
+# This file is part of the OverDrive Libby Plugin by ping
+# OverDrive Libby Plugin for calibre / libby-calibre-plugin
+#
+# See https://github.com/ping/libby-calibre-plugin for more
+# information
+#
+# Now being maintained at https://github.com/sgmoore/libby-calibre-plugin
+#
+
+import json
+import time
+from collections import OrderedDict
+from threading import Lock
+from typing import TYPE_CHECKING, Dict, Iterable, Optional, Set, Tuple
+
+if TYPE_CHECKING:
+    from .client import LibraryMediaSearchParams
+
+
+class _CachedResponse(object):
+    __slots__ = ("content", "title_ids", "cached_at", "availability_at")
+
+    def __init__(self, content: str, title_ids: Set[str], cached_at: float):
+        self.content = content
+        self.title_ids = title_ids
+        self.cached_at = cached_at
+        self.availability_at = cached_at
+
+
+class LibrarySearchCache(object):
+    """
+    A short-lived in-memory cache of library media search responses, keyed by
+    the library and the normalised search parameters.
+
+    Availability goes stale much sooner than the rest of a response, so it has its
+    own, shorter ttl. Once that has passed, the client refreshes only the availability
+    instead of repeating the search.
+    """
+
+    # Title fields that are updated from the bulk availability endpoint
+    AVAILABILITY_KEYS = (
+        "availabilityType",
+        "availableCopies",
+        "estimatedWaitDays",
+        "holdsCount",
+        "holdsRatio",
+        "isAvailable",
+        "isFastlane",
+        "isHoldable",
+        "luckyDayAvailableCopies",
+        "luckyDayOwnedCopies",
+        "ownedCopies",
+    )
+
+    def __init__(
+        self, ttl: float = 300.0, availability_ttl: float = 60.0, capacity: int = 200
+    ) -> None:
+        """
+
+        :param ttl: Seconds a response is cached for. 0 disables the cache.
+        :param availability_ttl: Seconds before the availability of a cached response is refreshed
+        :param capacity: Maximum number of responses cached
+        """
+        self.ttl = ttl
+        self.availability_ttl = availability_ttl
+        self.capacity = capacity
+        self.lock = Lock()
+        self._responses: OrderedDict = OrderedDict()
+
+    @staticmethod
+    def cache_key(library_key: str, query: "LibraryMediaSearchParams") -> Tuple[str, str]:
+        return library_key.lower(), json.dumps(query.to_dict(), sort_keys=True)
+
+    def get(
+        self, library_key: str, query: "LibraryMediaSearchParams"
+    ) -> Optional[Tuple[Dict, bool]]:
+        """
+        Get a cached response.
+
+        :param library_key:
+        :param query:
+        :return: Tuple of (a copy of the response, if the availability should be refreshed),
+                 or None if not cached
+        """
+        if not self.ttl:
+            return None
+        key = self.cache_key(library_key, query)
+        now = time.monotonic()
+        with self.lock:
+            cached: Optional[_CachedResponse] = self._responses.get(key)
+            if cached is None:
+                return None
+            if now - cached.cached_at > self.ttl:
+                del self._responses[key]
+                return None
+            self._responses.move_to_end(key)
+            content = cached.content
+            availability_expired = now - cached.availability_at > self.availability_ttl
+        # a fresh copy every time, because the results are modified when they are merged
+        return json.loads(content), availability_expired
+
+    def put(
+        self,
+        library_key: str,
+        query: "LibraryMediaSearchParams",
+        response: Dict,
+        availability_only: bool = False,
+    ) -> None:
+        """
+        Cache a response.
+
+        :param library_key:
+        :param query:
+        :param response:
+        :param availability_only: If True, the response is the cached one with
+                                  refreshed availability, and keeps its original ttl
+        :return:
+        """
+        if not self.ttl:
+            return
+        key = self.cache_key(library_key, query)
+        content = json.dumps(response, separators=(",", ":"))
+        title_ids = {
+            str(item["id"]) for item in response.get("items", []) if item.get("id")
+        }
+        now = time.monotonic()
+        with self.lock:
+            cached: Optional[_CachedResponse] = self._responses.get(key)
+            if availability_only:
+                if cached is None:
+                    return
+                cached.content = content
+                cached.availability_at = now
+                return
+            self._responses[key] = _CachedResponse(content, title_ids, now)
+            self._responses.move_to_end(key)
+            while len(self._responses) > self.capacity:
+                self._responses.popitem(last=False)
+
+    def expire_availability(self, title_ids: Iterable[str]) -> None:
+        """
+        Mark the availability of cached responses with these titles as stale,
+        e.g. after a title has been borrowed.
+
+        :param title_ids:
+        :return:
+        """
+        title_ids = {str(t) for t in title_ids}
+        with self.lock:
+            for cached in self._responses.values():
+                if cached.title_ids & title_ids:
+                    cached.availability_at = float("-inf")
+
+    @classmethod
+    def patch_availability(cls, response: Dict, availability: Dict) -> int:
+        """
+        Update the titles in a response with the results from library_media_availability_bulk.
+
+        :param response: A library_medias response
+        :param availability: A library_media_availability_bulk response
+        :return: Number of titles updated
+        """
+        by_id = {
+            str(a["id"]): a for a in availability.get("items") or [] if a and a.get("id")
+        }
+        updated = 0
+        for item in response.get("items", []):
+            title_availability = by_id.get(str(item.get("id")))
+            if not title_availability:
+                continue
+            for k in cls.AVAILABILITY_KEYS:
+                if k in title_availability:
+                    item[k] = title_availability[k]
+            updated += 1
+        return updated
+
+    def clear(self) -> None:
+        with self.lock:
+            self._responses = OrderedDict()
+
+
+# shared so that the cache outlives the dialog
+SHARED_SEARCH_CACHE = LibrarySearchCache()
@@ -20,11 +20,13 @@ from socket import error as SocketError, timeout as SocketTimeout
 from ssl import SSLError
 from typing import Dict, List, Optional, Union
 from urllib.error import HTTPError, URLError
-from urllib.parse import urlencode, urljoin
+from urllib.parse import urlencode, urljoin, urlparse
 from urllib.request import Request, build_opener
 
+from .cache import LibrarySearchCache
 from .common import pageable
-from .errors import ClientConnectionError
+from ..network import RetryPolicy, pooled_handlers, raise_if_cancelled
+from .errors import ClientConnectionError, ClientError
 
 from ..tools.CustomLogger import CustomLogger
 
@@ -119,8 +121,13 @@ class OverDriveClient(object):
         self.timeout = timeout
         self.max_retries = max_retries
         self.user_agent = kwargs.pop("user_agent", USER_AGENT)
+        self.retry_policy: RetryPolicy = kwargs.pop("retry_policy", None) or RetryPolicy()
+        # library_medias responses are cached if set
+        self.search_cache: Optional[LibrarySearchCache] = kwargs.pop(
+            "search_cache", None
+        )
         self.api_base = THUNDER_API_URL
-        self.opener = build_opener()
+        self.opener = build_opener(*pooled_handlers())
 
     def default_headers(self) -> Dict:
         """
@@ -156,11 +163,17 @@ class OverDriveClient(object):
         :param response:
         :return:
         """
-        if response.info().get("Content-Encoding") == "gzip":
-            buf = BytesIO(response.read())
-            res = gzip.GzipFile(fileobj=buf).read()
-        else:
-            res = response.read()
+        try:
+            if response.info().get("Content-Encoding") == "gzip":
+                buf = BytesIO(response.read())
+                res = gzip.GzipFile(fileobj=buf).read()
+            else:
+                res = response.read()
+        except Exception:
+            # the connection may have been shut down because the request was cancelled
+            response.close()
+            raise_if_cancelled()
+            raise
         if not decode:
             return res
 
@@ -233,58 +246,87 @@ class OverDriveClient(object):
                 lambda: method.upper()  # pylint: disable=unnecessary-lambda
             )
 
-        for attempt in range(0, self.max_retries + 1):
-            try:
-                CustomLogger.log_request(req, endpoint_url , data )
-                response = self.opener.open(req, timeout=self.timeout)
-            except HTTPError as e:            
-                CustomLogger.log_response_headers(e)
-                if (
-                    attempt < self.max_retries and e.code >= 500
-                ):  # retry for server 5XX errors
-                    # do nothing, try
-                    CustomLogger.logger.warning(
-                        "Retrying due to %s: %s", e.__class__.__name__, str(e)
-                    )
-                    CustomLogger.logger.debug(self._read_response(e))
-                    continue
-                raise
-
-            except (
-                SSLError,
-                SocketTimeout,
-                SocketError,
-                URLError,  # URLError is base of HTTPError
-                HTTPException,
-                ConnectionError,
-            ) as connection_error:
-                if attempt < self.max_retries:
-                    # do nothing, try
-                    CustomLogger.logger.warning(
-                        "Retrying due to %s: %s",
-                        connection_error.__class__.__name__,
-                        str(connection_error),
+        host = urlparse(endpoint_url).netloc
+        try:
+            for attempt in range(0, self.max_retries + 1):
+                raise_if_cancelled()
+                blocked_for = self.retry_policy.breaker.blocked_for(host)
+                if blocked_for:
+                    raise ClientConnectionError(
+                        f"Not connecting to {host} for {blocked_for:.0f} seconds due to earlier failures"
                     )
-                    continue
-                raise ClientConnectionError(
-                    "{} {}".format(
-                        connection_error.__class__.__name__, str(connection_error)
+                try:
+                    CustomLogger.log_request(req, endpoint_url , data )
+                    response = self.opener.open(req, timeout=self.timeout)
+                except HTTPError as e:            
+                    CustomLogger.log_response_headers(e)
+                    if e.code >= 500:
+                        self.retry_policy.breaker.record_failure(host)
+                    else:
+                        self.retry_policy.breaker.record_success(host)
+                    delay = (
+                        self.retry_policy.get_delay(attempt, e.headers.get("Retry-After"))
+                        if self.retry_policy.is_retryable_status(e.code)
+                        else None
                     )
-                ) from connection_error
-            
-            CustomLogger.log_response_headers(response)
-            if not decode_response:
-                return self._read_response(response, decode_response)
-
-            response_content = self._read_response(response)
-            if not response_content.strip():
-                return {}
-
-            if response.headers["content-type"].startswith("application/json"):
-                res_obj = json.loads(response_content)
-                return res_obj
-
-            return response_content
+                    if (
+                        attempt < self.max_retries and delay is not None
+                    ):  # retry for server 5XX errors and throttling
+                        CustomLogger.logger.warning(
+                            "Retrying in %.1f seconds due to %s: %s",
+                            delay,
+                            e.__class__.__name__,
+                            str(e),
+                        )
+                        CustomLogger.logger.debug(self._read_response(e))
+                        self.retry_policy.sleep(delay)
+                        continue
+                    raise
+
+                except (
+                    SSLError,
+                    SocketTimeout,
+                    SocketError,
+                    URLError,  # URLError is base of HTTPError
+                    HTTPException,
+                    ConnectionError,
+                ) as connection_error:
+                    # an aborted connection is not a failure of the host
+                    raise_if_cancelled()
+                    self.retry_policy.breaker.record_failure(host)
+                    if attempt < self.max_retries:
+                        delay = self.retry_policy.get_delay(attempt)
+                        CustomLogger.logger.warning(
+                            "Retrying in %.1f seconds due to %s: %s",
+                            delay,
+                            connection_error.__class__.__name__,
+                            str(connection_error),
+                        )
+                        self.retry_policy.sleep(delay)  # type: ignore[arg-type]
+                        continue
+                    raise ClientConnectionError(
+                        "{} {}".format(
+                            connection_error.__class__.__name__, str(connection_error)
+                        )
+                    ) from connection_error
+
+                self.retry_policy.breaker.record_success(host)
+                CustomLogger.log_response_headers(response)
+                if not decode_response:
+                    return self._read_response(response, decode_response)
+
+                response_content = self._read_response(response)
+                if not response_content.strip():
+                    return {}
+
+                if response.headers["content-type"].startswith("application/json"):
+                    res_obj = json.loads(response_content)
+                    return res_obj
+
+                return response_content
+        finally:
+            # a trial request that was cancelled, or failed unexpectedly, has no result
+            self.retry_policy.breaker.release_trial(host)
 
     @staticmethod
     def library_title_permalink(library_key: str, title_id: str) -> str:
@@ -519,9 +561,45 @@ class OverDriveClient(object):
         :param query:
         :return:
         """
+        if self.search_cache:
+            cached = self.search_cache.get(library_key, query)
+            if cached:
+                results, availability_expired = cached
+                if not availability_expired:
+                    return results
+                if self._refresh_availability(library_key, results):
+                    self.search_cache.put(
+                        library_key, query, results, availability_only=True
+                    )
+                    return results
+
         params = self.default_query()
         params.update(query.to_dict())
-        return self.send_request(f"libraries/{library_key}/media/", query=params)
+        results = self.send_request(f"libraries/{library_key}/media/", query=params)
+        if self.search_cache:
+            self.search_cache.put(library_key, query, results)
+        return results
+
+    def _refresh_availability(self, library_key: str, results: Dict) -> bool:
+        """
+        Update the availability of cached library_medias results.
+
+        :param library_key:
+        :param results:
+        :return: False if the availability could not be refreshed
+        """
+        title_ids = [str(item["id"]) for item in results.get("items", []) if item.get("id")]
+        if not title_ids:
+            return True
+        try:
+            availability = self.library_media_availability_bulk(library_key, title_ids)
+        except (ClientError, HTTPError) as err:
+            CustomLogger.logger.warning(
+                "Unable to refresh availability for cached search results: %s", err
+            )
+            return False
+        LibrarySearchCache.patch_availability(results, availability)
+        return True
 
     def library_media_availability(self, library_key: str, title_id: str) -> Dict:
         """
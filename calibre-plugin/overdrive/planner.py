@@ -0,0 +1,174 @@
+#
+# Copyright (C) 2023 github.com/ping
+#
+# This file is part of the OverDrive Libby Plugin by ping
+# OverDrive Libby Plugin for calibre / libby-calibre-plugin
+#
+# See https://github.com/ping/libby-calibre-plugin for more
+# information
+#
+# Now being maintained at https://github.com/sgmoore/libby-calibre-plugin
+#
+
+from threading import Lock
+from typing import Dict, List, Optional
+from urllib.error import HTTPError
+
+from .client import LibraryMediaSearchParams, OverDriveClient, SearchSortBy
+from .errors import ClientError
+from ..network import RequestCancelledError
+from ..tools.CustomLogger import CustomLogger
+
+
+class LibrarySearchPlanner(object):
+    """
+    Plans the requests for a library media search across several libraries.
+
+    If the search only uses parameters that the multi-library media search endpoint
+    supports, one request is made for all the libraries and its results are split back
+    into a library_medias-like response for each library. Otherwise, each library is
+    searched with its own library_medias request.
+
+    The per-library workers share a planner, and whichever asks first makes the request.
+    """
+
+    # The most items requested from the multi-library endpoint,
+    # results after this are not paged
+    MAX_ITEMS = 200
+
+    def __init__(
+        self,
+        client: OverDriveClient,
+        library_keys: List[str],
+        query: LibraryMediaSearchParams,
+    ) -> None:
+        self.client = client
+        self.library_keys = library_keys
+        self.query = query
+        self.search_together = self.can_search_together(library_keys, query)
+        self._lock = Lock()
+        self._results: Optional[Dict[str, Dict]] = None
+        self._failed = False
+
+    @classmethod
+    def can_search_together(
+        cls, library_keys: List[str], query: LibraryMediaSearchParams
+    ) -> bool:
+        """
+        Check if the query can be sent to the multi-library endpoint.
+
+        :param library_keys:
+        :param query:
+        :return:
+        """
+        return bool(
+            len(library_keys) > 1
+            and query.query.strip()
+            and not (
+                query.title.strip()
+                or query.creator.strip()
+                or query.identifier.strip()
+                or query.show_only_prelease
+                or query.media_type
+                or query.subject_id
+                or query.title_ids
+            )
+            and query.sort_by in ("", SearchSortBy.RELEVANCE)
+            and query.per_page * query.page <= cls.MAX_ITEMS
+        )
+
+    def library_medias(self, library_key: str) -> Dict:
+        """
+        Get the search results for a library.
+
+        :param library_key:
+        :return: A response in the library_medias format
+        """
+        if self.search_together:
+            with self._lock:
+                if self._results is None and not self._failed:
+                    try:
+                        self._results = self._search_together()
+                    except RequestCancelledError:
+                        # leave it for a task that is still wanted
+                        raise
+                    except (ClientError, HTTPError, ValueError) as err:
+                        CustomLogger.logger.warning(
+                            "Multi-library search failed, searching each library instead: %s",
+                            err,
+                        )
+                        self._failed = True
+                results = self._results
+            if results is not None:
+                return results.get(library_key.lower(), {"items": []})
+        return self.client.library_medias(library_key, self.query)
+
+    def _search_together(self) -> Dict[str, Dict]:
+        """
+        Search all the libraries in one request.
+
+        :return: library_medias-like responses by library key
+        """
+        max_items = self.query.per_page * self.query.page
+        kwargs: Dict = {"maxItems": max_items}
+        if self.query.formats:
+            kwargs["format"] = self.query.formats
+        if self.query.show_only_available:
+            kwargs["showOnlyAvailable"] = "true"
+        cache = self.client.search_cache
+        cache_key = ",".join(sorted(k.lower() for k in self.library_keys))
+        cached = cache.get(cache_key, self.query) if cache else None
+        if cached and not cached[1]:
+            medias = cached[0]["items"]
+        else:
+            medias = self.client.media_search(
+                self.library_keys, self.query.query.strip(), **kwargs
+            )
+            if cache:
+                cache.put(cache_key, self.query, {"items": medias})
+        return self.split_results(
+            medias,
+            self.library_keys,
+            skip=self.query.per_page * (self.query.page - 1),
+            has_more=len(medias) >= max_items
+            and max_items + self.query.per_page <= self.MAX_ITEMS,
+            page=self.query.page,
+        )
+
+    @staticmethod
+    def split_results(
+        medias: List[Dict],
+        library_keys: List[str],
+        skip: int = 0,
+        has_more: bool = False,
+        page: int = 1,
+    ) -> Dict[str, Dict]:
+        """
+        Split multi-library search results into a response for each library,
+        with the library's availability on each item as library_medias does.
+
+        :param medias: Results from media_search
+        :param library_keys:
+        :param skip: Number of results that were shown on the earlier pages
+        :param has_more: If there may be more results on the next page
+        :param page:
+        :return: library_medias-like responses by library key. The multi-library endpoint
+                 does not return the number of matches, so totalItems is None.
+        """
+        results: Dict[str, Dict] = {
+            k.lower(): {"items": []} for k in library_keys
+        }
+        for media in medias[skip:]:
+            for site_key, availability in (media.get("siteAvailabilities") or {}).items():
+                library_results = results.get(site_key.lower())
+                if library_results is None:
+                    continue
+                item = {k: v for k, v in media.items() if k != "siteAvailabilities"}
+                item.update(availability)
+                library_results["items"].append(item)
+        # the next page is only asked for if this one was full
+        last_page = page + 1 if has_more else page
+        for library_results in results.values():
+            library_results["totalItems"] = None
+            library_results["links"] = {"last": {"page": last_page}}
+        return results
@@ -0,0 +1,124 @@
+#
+# Copyright (C) 2023 github.com/ping
+#
+# This file is part of the OverDrive Libby Plugin by ping
+# OverDrive Libby Plugin for calibre / libby-calibre-plugin
+#
+# See https://github.com/ping/libby-calibre-plugin for more
+# information
+#
+# Now being maintained at https://github.com/sgmoore/libby-calibre-plugin
+#
+
+from typing import Dict, Generic, Optional, Protocol, Tuple, TypeVar
+
+from .client import LibraryMediaSearchParams
+
+
+class Cancellable(Protocol):
+    def cancel(self) -> None:
+        ...
+
+
+# e.g. a WorkerTask
+T = TypeVar("T", bound=Cancellable)
+
+
+class SearchPagePrefetches(Generic[T]):
+    """
+    Keeps track of the next page of a library media search, fetched for each library
+    before the user asks for it.
+
+    Results are kept until they are claimed by a search for the same query, within a
+    budget of items. Tasks still running when they are claimed become part of that search.
+    """
+
+    def __init__(self, max_items: int = 600):
+        """
+
+        :param max_items: Most prefetched items kept in memory
+        """
+        self.max_items = max_items
+        self.query: Optional[LibraryMediaSearchParams] = None
+        self._tasks: Dict[str, T] = {}
+        self._results: Dict[str, Dict] = {}
+        self._items = 0
+
+    def start(self, query: LibraryMediaSearchParams, tasks: Dict[str, T]) -> None:
+        """
+        Track new prefetch tasks, discarding the earlier ones.
+
+        :param query: The query for the prefetched page
+        :param tasks: By library key
+        :return:
+        """
+        self.discard()
+        self.query = query
+        self._tasks = dict(tasks)
+
+    def discard(self) -> None:
+        for task in self._tasks.values():
+            task.cancel()
+        self._tasks = {}
+        self._results = {}
+        self._items = 0
+        self.query = None
+
+    def is_prefetch(self, library_key: str, task: T) -> bool:
+        """
+        :param library_key:
+        :param task:
+        :return: True if the task is a prefetch that has not been claimed
+        """
+        return self._tasks.get(library_key) is task
+
+    def store(self, library_key: str, task: T, results: Dict) -> bool:
+        """
+        Keep the results of a finished prefetch task.
+
+        :param library_key:
+        :param task:
+        :param results:
+        :return: False if the results were not kept, e.g. because they are over budget
+        """
+        if not self.is_prefetch(library_key, task):
+            return False
+        del self._tasks[library_key]
+        items_count = len(results.get("items", []))
+        if self._items + items_count > self.max_items:
+            # over budget, the page is fetched again if the user asks for it
+            return False
+        self._items += items_count
+        self._results[library_key] = results
+        return True
+
+    def drop(self, library_key: str, task: T) -> None:
+        """
+        Forget a prefetch task that failed, so that the page is fetched again
+        if the user asks for it.
+
+        :param library_key:
+        :param task:
+        :return:
+        """
+        if self.is_prefetch(library_key, task):
+            del self._tasks[library_key]
+
+    def claim(
+        self, query: LibraryMediaSearchParams
+    ) -> Tuple[Dict[str, T], Dict[str, Dict]]:
+        """
+        Take over the prefetches if they were for this query. Otherwise they are discarded.
+
+        :param query:
+        :return: Tasks still running, and the results of the finished ones, by library key
+        """
+        if query != self.query:
+            self.discard()
+            return {}, {}
+        tasks, results = self._tasks, self._results
+        self._tasks = {}
+        self._results = {}
+        self._items = 0
+        self.query = None
+        return tasks, results
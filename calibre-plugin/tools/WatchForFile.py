@@ -6,7 +6,7 @@ import zipfile
 from qt.core import QTimer, QEventLoop, QObject, pyqtSignal, QFileSystemWatcher
 from tempfile import gettempdir
 from shutil import move
-from typing import Optional
+from typing import Optional, Set
 from pathlib import Path
 from .CustomLogger import CustomLogger
 
@@ -21,6 +21,8 @@ class FileWaiter(QObject):
         self.extension = extension
         self.start_time = time.time()
         self.cancel_callback = cancel_callback
+        # pre-existing files already logged
+        self.ignored: Set[str] = set()
 
         self.watcher = QFileSystemWatcher([folder])
         self.watcher.directoryChanged.connect(self.check_for_file)
@@ -41,22 +43,11 @@ class FileWaiter(QObject):
             self.handle_timeout()
             return
             
-        self.extension = self.extension.lower()
-        print(f"{datetime.datetime.now()} checking for {self.extension} in {self.folder}")
-        for fname in os.listdir(self.folder):          
-            if fname.lower().endswith(self.extension):
-                full_path = os.path.join(self.folder, fname)
-                if os.path.isfile(full_path) and os.path.getsize(full_path) != 0 : # Ignore folders and zero-byte files.
-                    created = os.path.getctime(full_path)
-                    if created >= self.start_time :
-                        self.file_found.emit(full_path)
-                        self.cleanup()
-                        print(full_path)
-                        break
-                    else :
-                        createdString = datetime.datetime.fromtimestamp(created)       .strftime("%Y-%m-%d %H:%M:%S")
-                        startString   = datetime.datetime.fromtimestamp(self.start_time).strftime("%Y-%m-%d %H:%M:%S")
-                        CustomLogger.log_simple_string(f"Ignoring pre-existing file {full_path} {createdString} before {startString}")
+        file_path = find_new_file(self.folder, self.extension, self.start_time, self.ignored)
+        if file_path:
+            self.file_found.emit(file_path)
+            self.cleanup()
+            CustomLogger.log_simple_string(f"Found new file {file_path}")
 
     def handle_timeout(self):
         self.timeout_reached.emit()
@@ -67,6 +58,29 @@ class FileWaiter(QObject):
         self.timeout_timer.stop()
         self.watcher.removePath(self.folder)
                                 
+def find_new_file(folder: str, extension: str, since: float, ignored: Optional[Set[str]] = None) -> Optional[str]:
+    """
+    Find a non-empty file with the extension that was created after a time.
+
+    :param ignored: Pre-existing files that have already been logged, updated with the new ones,
+                    so that polling the folder does not log the same file again
+    """
+    extension = extension.lower()
+    for fname in os.listdir(folder):
+        if fname.lower().endswith(extension):
+            full_path = os.path.join(folder, fname)
+            if os.path.isfile(full_path) and os.path.getsize(full_path) != 0 : # Ignore folders and zero-byte files.
+                created = os.path.getctime(full_path)
+                if created >= since :
+                    return full_path
+                elif ignored is None or full_path not in ignored :
+                    if ignored is not None :
+                        ignored.add(full_path)
+                    createdString = datetime.datetime.fromtimestamp(created)       .strftime("%Y-%m-%d %H:%M:%S")
+                    startString   = datetime.datetime.fromtimestamp(since).strftime("%Y-%m-%d %H:%M:%S")
+                    CustomLogger.log_simple_string(f"Ignoring pre-existing file {full_path} {createdString} before {startString}")
+    return None
+
 def is_file_ready(path: str, extension: str) -> bool:
     """
     Check if a file is ready for processing by validating its structure.
@@ -119,7 +133,36 @@ def wait_for_file_qt(folder : str, extension : str,  interval_ms = 500, timeout_
     waiter.timeout_reached.connect(on_timeout)
     loop.exec_()
 
-    file_path = result['path']
+    return claim_downloaded_file(result['path'], extension)
+
+
+def wait_for_file(folder : str, extension : str,  interval_ms = 500, timeout_ms=300000, cancel_callback=None) -> Optional[Path]:
+    """
+    Same as wait_for_file_qt, but polls the folder without an event loop
+    so that it can be used from a job or worker thread.
+    """
+    assert folder , "folder is required and can not be blank"
+    assert extension , 'Extension is required and can not be blank'
+
+    if not extension.startswith("."):
+        extension = f".{extension}"
+
+    start_time = time.time()
+    ignored: Set[str] = set()
+    while time.time() - start_time < timeout_ms / 1000:
+        if cancel_callback and cancel_callback():
+            return None
+        file_path = find_new_file(folder, extension, start_time, ignored)
+        if file_path:
+            return claim_downloaded_file(file_path, extension)
+        time.sleep(interval_ms / 1000)
+    return None
+
+
+def claim_downloaded_file(file_path : Optional[str], extension : str) -> Optional[Path]:
+    """
+    Wait for a found file to be complete, then move it out of the downloads folder.
+    """
     if file_path:
         # Wait for file to be logically complete (valid XML/ZIP)
         # Timeout after 60 seconds of existence if it never becomes valid
@@ -1,55 +1,103 @@
 import traceback
 import sys
 from functools import wraps
-from inspect import signature
-from typing import Any , get_origin, get_args
+from inspect import Parameter, signature
+from typing import Any , Callable, List, Optional, Tuple, get_origin, get_args
+
+from calibre.constants import DEBUG
+
 from .guiMode import GuiMode
 
 def enforce_types(func):
-   
-    if sys.version_info >= (3, 10):
-        sig = signature(func)
-        return_type = func.__annotations__.get('return')
-    
+    """
+    Validate the arguments and return value of func against its type hints.
+
+    Validation is only done in tests and when calibre is in debug mode. In normal use
+    the function is returned undecorated, so there is no overhead.
+    GuiMode.IsAvailable must therefore be set before modules using this are imported.
+    """
+
+    if sys.version_info < (3, 10) or (GuiMode.IsAvailable and not DEBUG):
+        return func
+
+    sig = signature(func)
+    annotations = func.__annotations__
+    return_type = annotations.get('return')
+    return_checker = _type_checker(return_type)
+    expects_no_return = 'return' in annotations and return_type is None
+
+    parameters = list(sig.parameters.values())
+    if any(p.kind != Parameter.POSITIONAL_OR_KEYWORD for p in parameters):
+        # *args, **kwargs, positional or keyword only parameters need bind()
         @wraps(func)
         def wrapper(*args, **kwargs):
-      
             bound_args = sig.bind(*args, **kwargs)
             for name, value in bound_args.arguments.items():
-                expected_type = func.__annotations__.get(name)
-                if expected_type and not expected_type == Any and not check_type(value, expected_type):
+                checker = _type_checker(annotations.get(name))
+                if checker and not checker(value):
+                    display_error(f"Argument '{name}' must be {annotations[name]}, got {type(value)} ({value})")
+            return _check_result(func(*args, **kwargs))
+
+    else:
+        # resolve everything that doesn't depend on the call values only once
+        checks: List[Tuple[int, str, Any, Callable[[Any], bool]]] = []
+        for position, parameter in enumerate(parameters):
+            checker = _type_checker(annotations.get(parameter.name))
+            if checker:
+                checks.append((position, parameter.name, annotations[parameter.name], checker))
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            args_count = len(args)
+            for position, name, expected_type, checker in checks:
+                if position < args_count:
+                    value = args[position]
+                elif name in kwargs:
+                    value = kwargs[name]
+                else:
+                    continue  # default value
+                if not checker(value):
                     display_error(f"Argument '{name}' must be {expected_type}, got {type(value)} ({value})")
-            result = func(*args, **kwargs)
-
-            if return_type and not return_type == Any and return_type is not None and not check_type(result, return_type):
-                display_error(f"Return value must be {return_type}, got {type(result)} ({result})")
-            elif return_type is None and result is not None :
-                display_error(f"Expected no return value, but got {type(result)} ({result})")
-            return result        
-       
-        return wrapper
-    else :
-        return func 
+            return _check_result(func(*args, **kwargs))
 
-def check_type(value, expected_type):
+    def _check_result(result):
+        if return_checker and not return_checker(result):
+            display_error(f"Return value must be {return_type}, got {type(result)} ({result})")
+        elif expects_no_return and result is not None :
+            display_error(f"Expected no return value, but got {type(result)} ({result})")
+        return result
+
+    return wrapper
+
+def _type_checker(expected_type) -> Optional[Callable[[Any], bool]]:
+    """
+    Build a function that checks a value against expected_type.
+
+    :param expected_type:
+    :return: None if there is nothing to check
+    """
     if not expected_type or expected_type is Any:
-        return True
+        return None
 
     origin = get_origin(expected_type)
     args   = get_args(expected_type)
 
     if origin is list:
-        if not isinstance(value, list):
-            return False
-        if not args:  # List without parameters
-            return True
+        if not args or args[0] is Any:  # List without parameters
+            return lambda value: isinstance(value, list)
         elem_type = args[0]
-        if elem_type is Any:
-            return True
-        return all(isinstance(x, elem_type) for x in value)
-        
+        return lambda value: isinstance(value, list) and all(isinstance(x, elem_type) for x in value)
+
+    if origin is not None and not args and isinstance(origin, type):
+        # e.g. typing.Dict, isinstance() is much faster with the plain class
+        expected_type = origin
+
     # fallback for non-parameterized types
-    return isinstance(value, expected_type)
+    return lambda value: isinstance(value, expected_type)
+
+def check_type(value, expected_type):
+    checker = _type_checker(expected_type)
+    return checker(value) if checker else True
 
 
 def display_error(message : str) :
@@ -59,8 +107,3 @@ def display_error(message : str) :
         print(f"RunTime Validation failure {message}\r\n at {stack_trace}" )
     else :
        raise TypeError(message)
-
-
-    
-
-    
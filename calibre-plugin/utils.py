@@ -9,21 +9,26 @@
 #
 # Now being maintained at https://github.com/sgmoore/libby-calibre-plugin
 #
+import gzip
+import hashlib
 import json
 import math
 import os
 import platform
 import random
 import re
+import sqlite3
+import tempfile
 import time
 import unicodedata
 from collections import OrderedDict, namedtuple
 from datetime import datetime, timedelta, timezone
 from enum import Enum
 from pathlib import Path
-from threading import Lock
-from typing import Dict, Optional 
+from threading import Lock, local
+from typing import Callable, Dict, List, Optional, Tuple
 
+from calibre.constants import config_dir
 from calibre.gui2 import is_dark_theme
 from qt.core import QColor, QIcon, QPainter, QPixmap, QSvgRenderer, QXmlStreamReader
 
@@ -32,6 +37,8 @@ from .compat import (
     Qt_GlobalColor_transparent,
 )
 
+from . import PLUGIN_NAME, PLUGINS_FOLDER_NAME
+from .asset_store import AssetStore
 from .tools.CustomLogger import CustomLogger
 
 try:
@@ -140,6 +147,430 @@ class SimpleCache:
             return self.cache.items()
 
 
+class SqliteCache:
+    """
+    A persistent cache backed by an SQLite database, with the same api as SimpleCache.
+
+    Entries are read from the database only when first requested and written
+    individually on put, so there is no full load or rewrite of the cache.
+    Recently used entries are also kept in memory.
+    """
+
+    def __init__(
+        self,
+        capacity: int = 100,
+        persist_to_path: Optional[Path] = None,
+        cache_age_days: int = 3,
+        migrate_from_path: Optional[Path] = None,
+    ):
+        """
+
+        :param capacity: Number of entries kept in memory
+        :param persist_to_path: Database file path. If None, an in-memory database is used.
+        :param cache_age_days: Default age after which an entry expires
+        :param migrate_from_path: A SimpleCache json file to import entries from
+        """
+        self.cache: OrderedDict = OrderedDict()
+        self.capacity = capacity
+        self.lock = Lock()  # only guards the in-memory entries
+        self.persist_to_path = persist_to_path
+        self.cache_age_days = cache_age_days
+        self.cache_timestamp_key = "__cached_at"
+        self.migrate_from_path = migrate_from_path
+        self._local = local()
+        self._init_lock = Lock()
+        self._initialised = False
+        # a private in-memory database is only visible to a single connection
+        self._memory_conn: Optional[sqlite3.Connection] = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if not self.persist_to_path:
+            with self._init_lock:
+                if not self._memory_conn:
+                    self._memory_conn = sqlite3.connect(
+                        ":memory:", check_same_thread=False
+                    )
+                    self._create_table(self._memory_conn)
+                return self._memory_conn
+
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # one connection per thread
+            conn = sqlite3.connect(str(self.persist_to_path), timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        with self._init_lock:
+            if not self._initialised:
+                self._create_table(conn)
+                self._migrate(conn)
+                self._initialised = True
+        return conn
+
+    @staticmethod
+    def _create_table(conn: sqlite3.Connection) -> None:
+        with conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+                "cached_at REAL NOT NULL, expires_at REAL)"
+            )
+
+    def _migrate(self, conn: sqlite3.Connection) -> None:
+        if not (self.migrate_from_path and self.migrate_from_path.exists()):
+            return
+        try:
+            with self.migrate_from_path.open("r", encoding="utf-8") as fp:
+                cached_items = json.load(fp)
+            rows = [
+                (k, self._serialise(v), v[self.cache_timestamp_key], None)
+                for k, v in cached_items.items()
+                if v.get(self.cache_timestamp_key)
+            ]
+            self._upsert(conn, rows)
+            self.migrate_from_path.unlink()
+            CustomLogger.logger.debug(
+                "Migrated %d items from file cache %s", len(rows), self.migrate_from_path
+            )
+        except Exception as err:
+            CustomLogger.logger.warning(
+                "Unable to migrate file cache %s: %s", self.migrate_from_path, err
+            )
+
+    @staticmethod
+    def _serialise(value: Dict) -> str:
+        # bytes are excluded, as SimpleCache.save() does
+        return json.dumps(
+            {k: v for k, v in value.items() if not isinstance(v, bytes)},
+            separators=(",", ":"),
+        )
+
+    @staticmethod
+    def _upsert(conn: sqlite3.Connection, rows: List[Tuple]) -> None:
+        if not rows:
+            return
+        with conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO cache (key, value, cached_at, expires_at) "
+                "VALUES (?, ?, ?, ?)",
+                rows,
+            )
+
+    def _is_expired(self, cached_at: float, expires_at: Optional[float]) -> bool:
+        now = time.time()
+        if expires_at is not None:
+            return now > expires_at
+        return now - cached_at > self.cache_age_days * 86400
+
+    def _remember(self, key: str, value: Dict) -> None:
+        with self.lock:
+            self.cache[key] = value
+            self.cache.move_to_end(key)
+            if len(self.cache) > self.capacity:
+                self.cache.popitem(last=False)
+
+    def reload(self):
+        """
+        Drops the in-memory entries so that they are read again from the database.
+        Expired entries are removed from the database.
+        """
+        with self.lock:
+            self.cache.clear()
+        if not self.cache_age_days:
+            return
+        conn = self._connect()
+        with conn:
+            conn.execute(
+                "DELETE FROM cache WHERE (expires_at IS NOT NULL AND expires_at < ?) "
+                "OR (expires_at IS NULL AND cached_at < ?)",
+                (time.time(), time.time() - self.cache_age_days * 86400),
+            )
+
+    def save(self):
+        """
+        Entries are written on put, but the in-memory entries may have been
+        modified since, so write them again.
+        """
+        if not self.cache_age_days:
+            return
+        with self.lock:
+            entries = list(self.cache.items())
+        rows = [
+            (
+                k,
+                self._serialise(v),
+                v.get(self.cache_timestamp_key, time.time()),
+                v.get("__expires_at"),
+            )
+            for k, v in entries
+        ]
+        self._upsert(self._connect(), rows)
+        CustomLogger.logger.debug(
+            "Saved %d items to cache at %s", len(rows), self.persist_to_path
+        )
+
+    def clear(self):
+        with self.lock:
+            self.cache.clear()
+        conn = self._connect()
+        with conn:
+            conn.execute("DELETE FROM cache")
+
+    def get(self, key: str) -> Optional[Dict]:
+        if not self.cache_age_days:
+            return None
+        with self.lock:
+            value = self.cache.get(key)
+            if value is not None:
+                self.cache.move_to_end(key)
+        if value is not None:
+            if not self._is_expired(
+                value.get(self.cache_timestamp_key, 0), value.get("__expires_at")
+            ):
+                return value
+            with self.lock:
+                self.cache.pop(key, None)
+            return None
+
+        row = (
+            self._connect()
+            .execute(
+                "SELECT value, cached_at, expires_at FROM cache WHERE key = ?", (key,)
+            )
+            .fetchone()
+        )
+        if not row or self._is_expired(row[1], row[2]):
+            return None
+        value = json.loads(row[0])
+        self._remember(key, value)
+        return value
+
+    def put(self, key: str, value: Dict, ttl: Optional[float] = None) -> None:
+        """
+
+        :param key:
+        :param value:
+        :param ttl: Seconds before the entry expires, instead of cache_age_days
+        :return:
+        """
+        if not self.cache_age_days:
+            return
+        if not value.get(self.cache_timestamp_key):
+            value[self.cache_timestamp_key] = time.time()
+        if ttl is not None:
+            value["__expires_at"] = value[self.cache_timestamp_key] + ttl
+        self._remember(key, value)
+        self._upsert(
+            self._connect(),
+            [
+                (
+                    key,
+                    self._serialise(value),
+                    value[self.cache_timestamp_key],
+                    value.get("__expires_at"),
+                )
+            ],
+        )
+
+    def count(self) -> int:
+        return len(self.items())
+
+    def items(self):
+        if not self.cache_age_days:
+            return []
+        rows = self._connect().execute(
+            "SELECT key, value, cached_at, expires_at FROM cache"
+        )
+        with self.lock:
+            in_memory = dict(self.cache)
+        return [
+            (k, in_memory.get(k) or json.loads(v))
+            for k, v, cached_at, expires_at in rows
+            if not self._is_expired(cached_at, expires_at)
+        ]
+
+
+class CoverCache:
+    """
+    An on-disk cache for cover images, keyed by the cover url. Urls for a resized
+    cover already include the size, e.g. the Libby thumbnail service urls.
+    Least recently used covers are removed when the cache exceeds max_bytes.
+    """
+
+    def __init__(self, folder: Path, max_bytes: int = 50 * 1024 * 1024):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.lock = Lock()
+        self._total_bytes: Optional[int] = None  # calculated on first write
+
+    @staticmethod
+    def cache_key(url: str) -> str:
+        return hashlib.sha1(url.encode("utf-8")).hexdigest()
+
+    def _path(self, url: str) -> Path:
+        key = self.cache_key(url)
+        return self.folder.joinpath(key[:2], key)
+
+    def get(self, url: str) -> Optional[bytes]:
+        path = self._path(url)
+        try:
+            data = path.read_bytes()
+            os.utime(path)  # mark as recently used
+            return data
+        except OSError:
+            return None
+
+    def put(self, url: str, data: bytes) -> None:
+        if not data or len(data) > self.max_bytes:
+            return
+        path = self._path(url)
+        temp_name = None
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            # unique per write, the same cover can be fetched by more than one thread
+            fd, temp_name = tempfile.mkstemp(suffix=".tmp", dir=path.parent)
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            previous_size = path.stat().st_size if path.exists() else 0
+            Path(temp_name).replace(path)
+        except OSError as err:
+            CustomLogger.logger.warning("Unable to cache cover: %s", err)
+            if temp_name:
+                Path(temp_name).unlink(missing_ok=True)
+            return
+        with self.lock:
+            if self._total_bytes is None:
+                self._total_bytes = sum(f.stat().st_size for f, _ in self._files())
+            else:
+                self._total_bytes += len(data) - previous_size
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+
+    def _files(self) -> List[Tuple[Path, float]]:
+        files = []
+        for f in self.folder.glob("*/*"):
+            if f.suffix == ".tmp":
+                continue
+            try:
+                files.append((f, f.stat().st_mtime))
+            except OSError:
+                pass
+        return files
+
+    def _evict(self) -> None:
+        # oldest first
+        for f, _ in sorted(self._files(), key=lambda x: x[1]):
+            if self._total_bytes is None or self._total_bytes <= self.max_bytes * 0.9:
+                break
+            try:
+                file_size = f.stat().st_size
+                f.unlink()
+                self._total_bytes -= file_size
+            except OSError:
+                pass
+
+    def get_or_fetch(self, url: str, fetch: Callable[[str], bytes]) -> bytes:
+        """
+        Get the cached cover or download it with fetch.
+
+        :param url:
+        :param fetch: Called with url to download the cover
+        :return:
+        """
+        data = self.get(url)
+        if data:
+            return data
+        data = fetch(url)
+        self.put(url, data)
+        return data
+
+    def clear(self) -> None:
+        with self.lock:
+            for f, _ in self._files():
+                try:
+                    f.unlink()
+                except OSError:
+                    pass
+            self._total_bytes = 0
+
+
+# shared by the book preview and the downloads
+COVER_CACHE = CoverCache(Path(config_dir, PLUGINS_FOLDER_NAME, f"{PLUGIN_NAME}.covers"))
+
+# shared by the magazine downloads
+ASSET_STORE = AssetStore(Path(config_dir, PLUGINS_FOLDER_NAME, f"{PLUGIN_NAME}.assets"))
+
+
+class SyncSnapshot:
+    """
+    The last successful sync state, persisted so that the main dialog can show it
+    immediately when opened, while a fresh sync runs in the background.
+    """
+
+    # only the keys that the dialog uses
+    SYNC_KEYS = ("loans", "holds", "cards", "__libraries", "__subscriptions")
+
+    def __init__(self, persist_to_path: Path):
+        self.persist_to_path = persist_to_path
+        self.lock = Lock()
+
+    @staticmethod
+    def _token_hash(identity_token: str) -> str:
+        return hashlib.sha1(identity_token.encode("utf-8")).hexdigest()
+
+    def save(self, synced_state: Dict, identity_token: str) -> None:
+        """
+        Save a compact copy of the sync state.
+
+        :param synced_state:
+        :param identity_token: The Libby token the state was synced with
+        :return:
+        """
+        snapshot = {k: synced_state[k] for k in self.SYNC_KEYS if k in synced_state}
+        data = {
+            "token": self._token_hash(identity_token),
+            "synced_at": time.time(),
+            "state": snapshot,
+        }
+        try:
+            with self.lock:
+                self.persist_to_path.parent.mkdir(parents=True, exist_ok=True)
+                temp_path = self.persist_to_path.with_suffix(".tmp")
+                with gzip.open(temp_path, "wt", encoding="utf-8") as f:
+                    json.dump(data, f, separators=(",", ":"))
+                temp_path.replace(self.persist_to_path)
+        except (OSError, TypeError, ValueError) as err:
+            CustomLogger.logger.warning("Unable to save sync snapshot: %s", err)
+
+    def load(self, identity_token: str) -> Tuple[Dict, Optional[float]]:
+        """
+        Load the last saved sync state.
+
+        :param identity_token: Current Libby token. A snapshot from a different token is ignored.
+        :return: Tuple of the sync state and its timestamp, or ({}, None) if not available
+        """
+        try:
+            with self.lock, gzip.open(
+                self.persist_to_path, "rt", encoding="utf-8"
+            ) as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return {}, None
+        except (OSError, EOFError, ValueError) as err:
+            CustomLogger.logger.warning("Unable to load sync snapshot: %s", err)
+            return {}, None
+        if data.get("token") != self._token_hash(identity_token):
+            return {}, None
+        return data.get("state", {}), data.get("synced_at")
+
+    def clear(self) -> None:
+        with self.lock:
+            try:
+                self.persist_to_path.unlink()
+            except FileNotFoundError:
+                pass
+
+
 def obfuscate_date(dt: datetime, day=None, month=None, year=None):
     if not dt:
         return dt
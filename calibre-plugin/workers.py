@@ -10,19 +10,183 @@
 # Now being maintained at https://github.com/sgmoore/libby-calibre-plugin
 #
 
+import heapq
+import itertools
 import math
+from concurrent.futures import ThreadPoolExecutor
+from threading import Condition, Thread
 from timeit import default_timer as timer
-from typing import Dict, List, Tuple
+from typing import Callable, Dict, List, Optional, Tuple
 
 from calibre import browser
 from qt.core import QObject, pyqtSignal
 
 from .config import PREFS, PreferenceKeys
 from .libby import LibbyClient, LibbyFormats
-from .overdrive import OverDriveClient, LibraryMediaSearchParams
-from .utils import SimpleCache
+from .network import SHARED_POOL, CancelToken, cancellation_scope
+from .overdrive import (
+    AvailabilityRefresher,
+    LibraryMediaSearchParams,
+    LibrarySearchPlanner,
+    OverDriveClient,
+)
+from .utils import COVER_CACHE, SqliteCache, SyncSnapshot
 from .tools.CustomLogger import CustomLogger
 
+class WorkerPriority:
+    """
+    Lanes for the shared worker executor. Lower values run first.
+    """
+
+    Interactive = 0  # e.g. previews, card actions
+    Normal = 1  # e.g. sync, basic search
+    Bulk = 2  # e.g. advanced search pages across many libraries
+
+
+class WorkerTask:
+    """
+    Runs a worker on the shared executor. Has the same start/isRunning/quit methods
+    as the QThread it replaces, so that the dialogs can use it the same way.
+    """
+
+    def __init__(
+        self,
+        fn: Callable[[], None],
+        priority: int = WorkerPriority.Normal,
+        group: Optional[object] = None,
+        executor: Optional["WorkerExecutor"] = None,
+    ):
+        """
+
+        :param fn: Usually the worker's run method
+        :param priority: A WorkerPriority
+        :param group: Tasks started for the same request, so that they can be cancelled together
+        :param executor: Defaults to the shared executor
+        """
+        self.fn = fn
+        self.priority = priority
+        self.group = group
+        self.executor = executor or SHARED_EXECUTOR
+        self.started = False
+        self.finished = False
+        self.cancelled = False
+        # requests sent by the task are dropped when this is cancelled
+        self.cancel_token = CancelToken()
+        # set by the dialogs, to keep the worker alive while the task runs
+        self.worker: Optional[QObject] = None
+        self.library_key: Optional[str] = None
+
+    def start(self) -> None:
+        self.started = True
+        self.executor.submit(self)
+
+    def isRunning(self) -> bool:
+        # includes tasks still waiting in the queue
+        return self.started and not (self.finished or self.cancelled)
+
+    def quit(self) -> None:
+        # nothing to stop, the executor thread is reused
+        pass
+
+    def cancel(self) -> None:
+        self.cancelled = True
+        self.cancel_token.cancel()
+
+
+class WorkerExecutor:
+    """
+    A bounded thread pool shared by the workers, with priority lanes.
+    Bulk tasks are kept from using every thread so that interactive tasks
+    can always start without waiting.
+    """
+
+    def __init__(self, max_workers: int = 8, reserved_workers: int = 2):
+        """
+
+        :param max_workers: Maximum number of threads
+        :param reserved_workers: Threads that only take tasks with a higher priority than Bulk
+        """
+        self.max_workers = max_workers
+        self.reserved_workers = reserved_workers
+        self._queue: List[Tuple[int, int, WorkerTask]] = []
+        self._counter = itertools.count()
+        self._condition = Condition()
+        self._threads: List[Thread] = []
+        self._running: List[WorkerTask] = []
+        self._idle = 0
+        self._running_bulk = 0
+
+    def submit(self, task: WorkerTask) -> None:
+        with self._condition:
+            heapq.heappush(self._queue, (task.priority, next(self._counter), task))
+            if not self._idle and len(self._threads) < self.max_workers:
+                thread = Thread(
+                    target=self._work, name=f"{__name__}-{len(self._threads)}", daemon=True
+                )
+                self._threads.append(thread)
+                thread.start()
+            self._condition.notify_all()
+
+    def cancel_group(self, group: object) -> int:
+        """
+        Cancel the tasks of a group. Queued tasks will not run, and the requests
+        of running tasks are aborted. Their results should be ignored.
+
+        :param group:
+        :return: Number of tasks cancelled
+        """
+        cancelled = 0
+        with self._condition:
+            for task in [q[2] for q in self._queue] + self._running:
+                if task.group is group and not task.cancelled:
+                    task.cancel()
+                    cancelled += 1
+            self._queue = [q for q in self._queue if not q[2].cancelled]
+            heapq.heapify(self._queue)
+        return cancelled
+
+    def _next_task(self) -> WorkerTask:
+        with self._condition:
+            self._idle += 1
+            try:
+                while True:
+                    while self._queue and self._queue[0][2].cancelled:
+                        heapq.heappop(self._queue)
+                    if self._queue and (
+                        self._queue[0][0] < WorkerPriority.Bulk
+                        or self._running_bulk
+                        < max(1, self.max_workers - self.reserved_workers)
+                    ):
+                        _, _, task = heapq.heappop(self._queue)
+                        self._running.append(task)
+                        if task.priority >= WorkerPriority.Bulk:
+                            self._running_bulk += 1
+                        return task
+                    self._condition.wait()
+            finally:
+                self._idle -= 1
+
+    def _work(self) -> None:
+        while True:
+            task = self._next_task()
+            try:
+                with cancellation_scope(task.cancel_token):
+                    task.fn()
+            except Exception as err:
+                # workers are expected to emit their own errors
+                CustomLogger.logger.exception(err)
+            finally:
+                with self._condition:
+                    task.finished = True
+                    self._running.remove(task)
+                    if task.priority >= WorkerPriority.Bulk:
+                        self._running_bulk -= 1
+                    self._condition.notify_all()
+
+
+SHARED_EXECUTOR = WorkerExecutor()
+
+
 class OverDriveMediaSearchWorker(QObject):
     """
     Search media
@@ -77,15 +241,21 @@ class OverDriveLibraryMediaSearchWorker(QObject):
         overdrive_client: OverDriveClient,
         library_key: str,
         query: LibraryMediaSearchParams,
+        planner: Optional[LibrarySearchPlanner] = None,
     ):
         self.client = overdrive_client
         self.library_key = library_key
         self.query = query
+        # shared by the workers of a search so that libraries can be searched together
+        self.planner = planner
 
     def run(self):
         total_start = timer()
         try:
-            results = self.client.library_medias(self.library_key, self.query)
+            if self.planner:
+                results = self.planner.library_medias(self.library_key)
+            else:
+                results = self.client.library_medias(self.library_key, self.query)
             CustomLogger.logger.info(
                 "OverDrive Library Media Search (%s) took %f seconds",
                 self.library_key,
@@ -101,6 +271,39 @@ class OverDriveLibraryMediaSearchWorker(QObject):
             self.errored.emit(self.library_key, err)
 
 
+class AvailabilityRefreshWorker(QObject):
+    """
+    Fetches the availability of titles already shown, e.g. holds or search results
+    """
+
+    finished = pyqtSignal(dict)
+    errored = pyqtSignal(Exception)
+
+    def setup(
+        self,
+        overdrive_client: OverDriveClient,
+        title_ids_by_library: Dict[str, List[str]],
+    ):
+        self.refresher = AvailabilityRefresher(overdrive_client)
+        self.title_ids_by_library = title_ids_by_library
+
+    def run(self):
+        total_start = timer()
+        try:
+            availabilities = self.refresher.fetch(self.title_ids_by_library)
+            CustomLogger.logger.info(
+                "Availability refresh for %d libraries took %f seconds",
+                len(self.title_ids_by_library),
+                timer() - total_start,
+            )
+            self.finished.emit(availabilities)
+        except Exception as err:
+            CustomLogger.logger.info(
+                "Availability refresh failed after %f seconds", timer() - total_start
+            )
+            self.errored.emit(err)
+
+
 class OverDriveMediaWorker(QObject):
     """
     Fetches a media detail (for preview)
@@ -111,7 +314,7 @@ class OverDriveMediaWorker(QObject):
     cover_data_key = "_cover_data"
 
     def setup(
-        self, overdrive_client: OverDriveClient, title_id: str, media_cache: SimpleCache
+        self, overdrive_client: OverDriveClient, title_id: str, media_cache: SqliteCache
     ):
         self.client = overdrive_client
         self.title_id = title_id
@@ -129,12 +332,15 @@ class OverDriveMediaWorker(QObject):
                         media, rank=0 if PREFS[PreferenceKeys.USE_BEST_COVER] else -1
                     )
                     if cover_url:
-                        CustomLogger.logger.debug("Downloading cover: %s", cover_url)
-                        br = browser()
-                        cover_res = br.open_novisit(
-                            cover_url, timeout=self.client.timeout
+
+                        def download_cover(url: str) -> bytes:
+                            CustomLogger.logger.debug("Downloading cover: %s", url)
+                            br = browser()
+                            return br.open_novisit(url, timeout=self.client.timeout).read()
+
+                        media[self.cover_data_key] = COVER_CACHE.get_or_fetch(
+                            cover_url, download_cover
                         )
-                        media[self.cover_data_key] = cover_res.read()
                 except Exception as cover_err:
                     CustomLogger.logger.warning("Error loading cover: %s", cover_err)
             self.media_cache.put(self.title_id, media)
@@ -327,7 +533,7 @@ class LibbyFulfillLoanWorker(QObject):
 
 
 def extract_cached_items(
-    object_ids: List[str], cache: SimpleCache
+    object_ids: List[str], cache: SqliteCache
 ) -> Tuple[List[str], List[Dict]]:
     """
     Helper method to extract uncached IDs and cached objects
@@ -349,6 +555,23 @@ def extract_cached_items(
     return uncached_object_ids, cached_objects
 
 
+def fetch_pages(fn: Callable, pages: List, max_workers: int) -> List:
+    """
+    Run fn for each page concurrently and return the results in page order.
+
+    :param fn:
+    :param pages:
+    :param max_workers:
+    :return:
+    """
+    if not pages:
+        return []
+    if len(pages) == 1 or max_workers <= 1:
+        return [fn(p) for p in pages]
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(pages))) as executor:
+        return list(executor.map(fn, pages))
+
+
 class SyncDataWorker(QObject):
     """
     Main sync worker
@@ -360,9 +583,15 @@ class SyncDataWorker(QObject):
     def __int__(self):
         super().__init__()
 
-    def setup(self, libraries_cache: SimpleCache, media_cache: SimpleCache):
+    def setup(
+        self,
+        libraries_cache: SqliteCache,
+        media_cache: SqliteCache,
+        sync_snapshot: Optional[SyncSnapshot] = None,
+    ):
         self.libraries_cache = libraries_cache
         self.media_cache = media_cache
+        self.sync_snapshot = sync_snapshot
 
     def run(self):
         libby_token: str = PREFS[PreferenceKeys.LIBBY_TOKEN]
@@ -399,19 +628,29 @@ class SyncDataWorker(QObject):
                 timeout=PREFS[PreferenceKeys.NETWORK_TIMEOUT],
             )
             max_per_page = 24
+            max_workers = PREFS[PreferenceKeys.NETWORK_CONCURRENCY]
             total_pages = math.ceil(len(uncached_website_ids) / max_per_page)
-            for page in range(1, 1 + total_pages):
+
+            def fetch_libraries_page(page: int) -> List[Dict]:
                 website_ids = uncached_website_ids[
                     (page - 1) * max_per_page : page * max_per_page
                 ]
                 results = od_client.libraries(
                     website_ids=website_ids, per_page=max_per_page
                 )
-                found = results.get("items", [])
+                return results.get("items", [])
+
+            for found in fetch_pages(
+                fetch_libraries_page, list(range(1, 1 + total_pages)), max_workers
+            ):
                 for library in found:
                     self.libraries_cache.put(str(library["websiteId"]), library)
                 libraries.extend(found)
-            CustomLogger.logger.info("OverDrive Libraries requests took %f seconds", timer() - start)
+            CustomLogger.logger.info(
+                "OverDrive Libraries requests (%d pages) took %f seconds",
+                total_pages,
+                timer() - start,
+            )
             synced_state["__libraries"] = libraries
 
             subbed_magazines = []
@@ -425,7 +664,8 @@ class SyncDataWorker(QObject):
                 total_pages = math.ceil(
                     len(all_parent_magazine_ids) / OverDriveClient.MAX_PER_PAGE
                 )
-                for page in range(1, 1 + total_pages):
+
+                def fetch_magazines_page(page: int) -> List[Dict]:
                     # don't cache parent magazine IDs, only the latest issues
                     # to make sure that we'll always have the correct latest issue
                     parent_magazine_ids = all_parent_magazine_ids[
@@ -459,6 +699,11 @@ class SyncDataWorker(QObject):
                         for m in found:
                             self.media_cache.put(m["id"], m)
                         titles.extend(found)
+                    return titles
+
+                for titles in fetch_pages(
+                    fetch_magazines_page, list(range(1, 1 + total_pages)), max_workers
+                ):
                     for t in titles:
                         t["cardId"] = next(
                             iter(
@@ -473,10 +718,17 @@ class SyncDataWorker(QObject):
                         )
                     subbed_magazines.extend(titles)
                 CustomLogger.logger.info(
-                    "OverDrive Magazines requests took %f seconds", timer() - start
+                    "OverDrive Magazines requests (%d pages) took %f seconds",
+                    total_pages,
+                    timer() - start,
                 )
             synced_state["__subscriptions"] = subbed_magazines
             CustomLogger.logger.info("Total Sync Time took %f seconds", timer() - total_start)
+            CustomLogger.logger.debug("Connection pool: %s", SHARED_POOL.stats())
+            if self.sync_snapshot:
+                self.sync_snapshot.save(
+                    synced_state, synced_state.get("identity") or libby_token
+                )
 
             self.finished.emit(synced_state)
         except Exception as err:
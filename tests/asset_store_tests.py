@@ -0,0 +1,100 @@
+import os
+import tempfile
+import time
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING :
+    from asset_store import AssetStore
+else :
+    from calibre_plugins.overdrive_libby.asset_store import AssetStore
+
+from all import RunnableTests
+
+
+class AssetStoreTests(RunnableTests):
+
+    def _store(self, **kwargs) -> AssetStore:
+        return AssetStore(Path(tempfile.mkdtemp()), **kwargs)
+
+    def test_get_or_fetch(self):
+
+        store = self._store()
+        fetched = []
+
+        def fetch(data: bytes):
+            def _fetch():
+                fetched.append(data)
+                return data
+            return _fetch
+
+        css = b"#article-body { color: red; }"
+        self.assertEqual(store.get_or_fetch("123", "/a/style.css", "text/css", fetch(css)), css)
+        # another issue of the same magazine
+        self.assertEqual(store.get_or_fetch("123", "/a/style.css", "text/css", fetch(b"x")), css)
+        self.assertEqual(fetched, [css])
+        # another magazine
+        self.assertEqual(store.get_or_fetch("456", "/a/style.css", "text/css", fetch(b"x")), b"x")
+
+        # issue-specific assets are not stored
+        store.get_or_fetch("123", "/a/page.jpg", "image/jpeg", fetch(b"jpg"))
+        store.get_or_fetch("123", "/a/page.jpg", "image/jpeg", fetch(b"jpg"))
+        self.assertEqual(fetched.count(b"jpg"), 2)
+
+        # the same content is only saved once
+        store.put_asset("789", "/b/style.css", css)
+        self.assertEqual(len(list(store.folder.glob("blobs/*/*"))), 2)
+
+    def test_expired(self):
+
+        store = self._store(max_age_days=1)
+        store.put_asset("123", "/a/font.ttf", b"font")
+        self.assertEqual(store.get_asset("123", "/a/font.ttf"), b"font")
+        index_path = store._path("index", store._index_key("123", "/a/font.ttf"))
+        content_hash, _ = index_path.read_text().split()
+        index_path.write_text(f"{content_hash} {time.time() - 2 * 24 * 60 * 60}")
+        self.assertIsNone(store.get_asset("123", "/a/font.ttf"))
+
+        # a corrupted blob is not used
+        store.put_asset("123", "/a/font.ttf", b"font")
+        store._path("blobs", content_hash).write_bytes(b"fnot")
+        self.assertIsNone(store.get_asset("123", "/a/font.ttf"))
+
+    def test_patched(self):
+
+        store = self._store()
+        patches = []
+
+        def patch(data: bytes) -> bytes:
+            patches.append(data)
+            return data.upper()
+
+        self.assertEqual(store.patched(b"abc", "upper-1", patch), b"ABC")
+        self.assertEqual(store.patched(b"abc", "upper-1", patch), b"ABC")
+        self.assertEqual(patches, [b"abc"])
+        self.assertEqual(store.patched(b"abc", "upper-2", patch), b"ABC")
+        self.assertEqual(len(patches), 2)
+
+    def test_evict(self):
+
+        store = self._store(max_bytes=1000)
+        for i in range(5):
+            store.put_asset("123", f"/a/{i}.css", bytes([i]) * 300)
+            path = store._path("blobs", store.content_hash(bytes([i]) * 300))
+            os.utime(path, (i, i))
+        blobs = list(store.folder.glob("blobs/*/*"))
+        self.assertLessEqual(sum(f.stat().st_size for f in blobs), 1000)
+        # the most recently used are kept
+        self.assertEqual(store.get_asset("123", "/a/4.css"), bytes([4]) * 300)
+        self.assertIsNone(store.get_asset("123", "/a/0.css"))
+
+        store.clear()
+        self.assertEqual(list(store.folder.glob("*/*/*")), [])
+
+
+# Run with:
+# All tests    : calibre-customize -b calibre-plugin && calibre-debug -e tests/asset_store_tests.py
+# Specific test: calibre-customize -b calibre-plugin && calibre-debug -e tests/asset_store_tests.py -- --method test_patched
+
+if __name__ == "__main__":
+    AssetStoreTests.run_tests()
@@ -0,0 +1,117 @@
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING :
+    from overdrive import AvailabilityRefresher
+    from overdrive.errors import ClientConnectionError
+else :
+    from calibre_plugins.overdrive_libby.overdrive import AvailabilityRefresher
+    from calibre_plugins.overdrive_libby.overdrive.errors import ClientConnectionError
+
+from all import RunnableTests
+
+
+class _Client:
+    """Returns the same availability for every title, and records the batches requested."""
+
+    def __init__(self, failing_library_key: str = ""):
+        self.batches = []
+        self.failing_library_key = failing_library_key
+
+    def library_media_availability_bulk(self, library_key, title_ids):
+        if library_key == self.failing_library_key:
+            raise ClientConnectionError("down")
+        self.batches.append((library_key, list(title_ids)))
+        return {
+            "items": [
+                {"id": t, "isAvailable": True, "estimatedWaitDays": 0, "holdsCount": 1}
+                for t in title_ids
+            ]
+            + [None]
+        }
+
+
+class AvailabilityRefreshTests(RunnableTests):
+
+    def test_group_holds(self):
+
+        cards = {"c1": "lapl", "c2": "kcls"}
+        holds = [
+            {"id": "1", "cardId": "c1"},
+            {"id": "2", "cardId": "c2"},
+            {"id": "3", "cardId": "c1"},
+            {"id": "4", "cardId": "unknown"},
+        ]
+        self.assertEqual(
+            AvailabilityRefresher.group_holds(holds, lambda h: cards.get(h["cardId"])),
+            {"lapl": ["1", "3"], "kcls": ["2"]},
+        )
+
+    def test_group_search_results(self):
+
+        medias = [
+            {"id": "1", "siteAvailabilities": {"lapl": {}, "kcls": {}}},
+            {"id": "2", "siteAvailabilities": {"kcls": {}}},
+            {"id": "3"},
+        ]
+        self.assertEqual(
+            AvailabilityRefresher.group_search_results(medias),
+            {"lapl": ["1"], "kcls": ["1", "2"]},
+        )
+
+    def test_fetch_in_batches(self):
+
+        client = _Client(failing_library_key="kcls")
+        refresher = AvailabilityRefresher(client, batch_size=2)
+        availabilities = refresher.fetch({"lapl": ["3", "1", "2", "1"], "kcls": ["1"]})
+        self.assertEqual(client.batches, [("lapl", ["1", "2"]), ("lapl", ["3"])])
+        self.assertEqual(sorted(availabilities["lapl"].keys()), ["1", "2", "3"])
+        # failed libraries are left out
+        self.assertNotIn("kcls", availabilities)
+
+    def test_patch_hold(self):
+
+        hold = {"id": "1", "isAvailable": False, "estimatedWaitDays": 30, "holdsCount": 9}
+        self.assertTrue(
+            AvailabilityRefresher.patch_hold(
+                hold, {"id": "1", "isAvailable": True, "estimatedWaitDays": 0, "holdsCount": 1}
+            )
+        )
+        self.assertEqual(
+            hold, {"id": "1", "isAvailable": True, "estimatedWaitDays": 0, "holdsCount": 9}
+        )
+        self.assertFalse(
+            AvailabilityRefresher.patch_hold(hold, {"isAvailable": True, "estimatedWaitDays": 0})
+        )
+        self.assertFalse(AvailabilityRefresher.patch_hold(hold, None))
+
+    def test_patch_search_result(self):
+
+        media = {
+            "id": "1",
+            "siteAvailabilities": {
+                "lapl": {"isAvailable": False, "availableCopies": 0},
+                "kcls": {"isAvailable": True},
+            },
+        }
+        changed = AvailabilityRefresher.patch_search_result(
+            media,
+            {
+                "lapl": {"1": {"id": "1", "isAvailable": True, "availableCopies": 2}},
+                "kcls": {"1": {"id": "1", "isAvailable": True}},
+            },
+        )
+        self.assertTrue(changed)
+        self.assertEqual(
+            media["siteAvailabilities"]["lapl"], {"isAvailable": True, "availableCopies": 2}
+        )
+        self.assertFalse(
+            AvailabilityRefresher.patch_search_result(media, {"lapl": {}})
+        )
+
+
+# Run with:
+# All tests    : calibre-customize -b calibre-plugin && calibre-debug -e tests/availability_refresh_tests.py
+# Specific test: calibre-customize -b calibre-plugin && calibre-debug -e tests/availability_refresh_tests.py -- --method test_fetch_in_batches
+
+if __name__ == "__main__":
+    AvailabilityRefreshTests.run_tests()
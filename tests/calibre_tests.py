@@ -1,17 +1,21 @@
+import json
 import logging
 import sys
+import tempfile
+import time
+from pathlib import Path
 from typing import TYPE_CHECKING
 
 from calibre_plugins.overdrive_libby import PLUGIN_NAME , __version__   # pyright: ignore[reportMissingImports]   
 if TYPE_CHECKING :
     from tools.CustomLogger import CustomLogger 
     from tools.pretty_print import pp           
-    from utils import rating_to_stars ,  generate_od_identifier , SimpleCache
+    from utils import rating_to_stars ,  generate_od_identifier , SimpleCache , SqliteCache , CoverCache , SyncSnapshot
 
 else :
     from calibre_plugins.overdrive_libby.tools.CustomLogger import CustomLogger         
     from calibre_plugins.overdrive_libby.tools.pretty_print import pp                   
-    from calibre_plugins.overdrive_libby.utils import rating_to_stars ,  generate_od_identifier , SimpleCache 
+    from calibre_plugins.overdrive_libby.utils import rating_to_stars ,  generate_od_identifier , SimpleCache , SqliteCache , CoverCache , SyncSnapshot
 
 from all import RunnableTests
 
@@ -52,6 +56,79 @@ class _CalibreTests(RunnableTests):
         self.assertEqual(cache.count(), 0)
 
 
+    def test_sqlitecache(self):
+
+        folder = Path(tempfile.mkdtemp())
+        json_path = folder.joinpath("cache.json")
+        json_path.write_text(
+            json.dumps(
+                {
+                    "a": {"a": 1, "__cached_at": time.time()},
+                    "old": {"old": 1, "__cached_at": time.time() - 10 * 86400},
+                }
+            )
+        )
+        cache = SqliteCache(
+            persist_to_path=folder.joinpath("cache.sqlite"), migrate_from_path=json_path
+        )
+        # migrated from the json file, except expired items
+        self.assertEqual(cache.get("a")["a"], 1)
+        self.assertIsNone(cache.get("old"))
+        self.assertFalse(json_path.exists())
+
+        cache.put("b", {"b": 1, "cover": b"1234"})
+        self.assertEqual(cache.count(), 2)
+        cache.put("ttl", {"ttl": 1}, ttl=-1)
+        self.assertIsNone(cache.get("ttl"))
+
+        # a new instance reads from the database, without bytes
+        other_cache = SqliteCache(persist_to_path=folder.joinpath("cache.sqlite"))
+        self.assertEqual(other_cache.get("b")["b"], 1)
+        self.assertNotIn("cover", other_cache.get("b"))
+        other_cache.clear()
+        self.assertEqual(cache.count(), 0)
+
+    def test_covercache(self):
+
+        cache = CoverCache(Path(tempfile.mkdtemp()), max_bytes=1000)
+        fetched = []
+
+        def fetch(url):
+            fetched.append(url)
+            return b"x" * 400
+
+        cache.get_or_fetch("http://a", fetch)
+        cache.get_or_fetch("http://a", fetch)
+        self.assertEqual(fetched, ["http://a"])
+        self.assertIsNone(cache.get("http://a/510x510"))
+        self.assertEqual(list(cache.folder.glob("*/*.tmp")), [])
+
+        time.sleep(0.01)
+        cache.put("http://b", b"x" * 400)
+        time.sleep(0.01)
+        cache.get("http://a")  # a is now more recently used than b
+        time.sleep(0.01)
+        cache.put("http://c", b"x" * 400)
+        # over the limit, so the least recently used cover is removed
+        self.assertIsNone(cache.get("http://b"))
+        self.assertIsNotNone(cache.get("http://a"))
+        self.assertIsNotNone(cache.get("http://c"))
+        cache.clear()
+        self.assertIsNone(cache.get("http://a"))
+
+    def test_syncsnapshot(self):
+
+        snapshot = SyncSnapshot(Path(tempfile.mkdtemp()).joinpath("sync.json.gz"))
+        self.assertEqual(snapshot.load("token"), ({}, None))
+        snapshot.save({"loans": [{"id": "1"}], "identity": "token", "other": 1}, "token")
+        synced_state, synced_at = snapshot.load("token")
+        self.assertEqual(synced_state, {"loans": [{"id": "1"}]})
+        self.assertIsNotNone(synced_at)
+        # saved with a different account
+        self.assertEqual(snapshot.load("other-token"), ({}, None))
+        snapshot.clear()
+        self.assertEqual(snapshot.load("token"), ({}, None))
+
     def test__log_handler(self):    # FileName with two underscores means this may be run before other tests
 
         print("")   # This test outputs some details to stdout, so we add a few carriage returns 
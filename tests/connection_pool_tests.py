@@ -0,0 +1,109 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import TYPE_CHECKING
+from urllib.request import build_opener
+
+if TYPE_CHECKING :
+    from network import ConnectionPool, pooled_handlers
+else :
+    from calibre_plugins.overdrive_libby.network import ConnectionPool, pooled_handlers
+
+from all import RunnableTests
+
+
+class _KeepAliveHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        body = b"ok"
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self.do_GET()
+
+    def log_message(self, *args):
+        pass
+
+
+class _DroppingHandler(_KeepAliveHandler):
+    def do_GET(self):
+        super().do_GET()
+        # close the connection without telling the client
+        self.close_connection = True
+
+
+class ConnectionPoolTests(RunnableTests):
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), _KeepAliveHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f"http://127.0.0.1:{self.server.server_port}/"
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_connection_is_reused(self):
+
+        pool = ConnectionPool()
+        opener = build_opener(*pooled_handlers(pool))
+        for _ in range(5):
+            self.assertEqual(opener.open(self.url, timeout=5).read(), b"ok")
+        self.assertEqual(pool.stats()["new"], 1)
+        self.assertEqual(pool.stats()["reused"], 4)
+
+    def test_unread_response_is_not_reused(self):
+
+        pool = ConnectionPool()
+        opener = build_opener(*pooled_handlers(pool))
+        opener.open(self.url, timeout=5)  # body not read
+        self.assertEqual(opener.open(self.url, timeout=5).read(), b"ok")
+        self.assertEqual(pool.stats()["new"], 2)
+
+    def test_pool_size_is_bounded(self):
+
+        pool = ConnectionPool(max_per_host=2)
+        opener = build_opener(*pooled_handlers(pool))
+        responses = [opener.open(self.url, timeout=5) for _ in range(4)]
+        for res in responses:
+            res.read()
+        self.assertEqual(pool.stats()["pooled"], 2)
+
+    def test_idle_connections_expire(self):
+
+        pool = ConnectionPool(idle_timeout=0)
+        opener = build_opener(*pooled_handlers(pool))
+        opener.open(self.url, timeout=5).read()
+        time.sleep(0.01)
+        opener.open(self.url, timeout=5).read()
+        self.assertEqual(pool.stats()["reused"], 0)
+
+    def test_stale_connection_retried_for_idempotent_requests(self):
+
+        self.server.RequestHandlerClass = _DroppingHandler
+        pool = ConnectionPool()
+        opener = build_opener(*pooled_handlers(pool))
+        opener.open(self.url, timeout=5).read()
+        time.sleep(0.05)
+        # reuses the closed connection, then retries with a new one
+        self.assertEqual(opener.open(self.url, timeout=5).read(), b"ok")
+        self.assertEqual(pool.stats()["new"], 2)
+
+        time.sleep(0.05)
+        with self.assertRaises(OSError):
+            # the server may have received the POST, so it is not sent again
+            opener.open(self.url, data=b"x", timeout=5)
+        self.assertEqual(pool.stats()["new"], 2)
+
+
+# Run with:
+# All tests    : calibre-customize -b calibre-plugin && calibre-debug -e tests/connection_pool_tests.py
+# Specific test: calibre-customize -b calibre-plugin && calibre-debug -e tests/connection_pool_tests.py -- --method test_connection_is_reused
+
+if __name__ == "__main__":
+    ConnectionPoolTests.run_tests()
@@ -0,0 +1,89 @@
+import timeit
+from functools import wraps
+from inspect import signature
+from typing import Any, Dict, TYPE_CHECKING
+from unittest.mock import patch
+
+from all import RunnableTests
+
+if TYPE_CHECKING :
+    from tools import decorators
+    from tools.decorators   import enforce_types, check_type
+    from tools.guiMode      import GuiMode
+    from tools.CustomLogger import CustomLogger
+else :
+    from calibre_plugins.overdrive_libby.tools import decorators
+    from calibre_plugins.overdrive_libby.tools.decorators   import enforce_types, check_type
+    from calibre_plugins.overdrive_libby.tools.guiMode      import GuiMode
+    from calibre_plugins.overdrive_libby.tools.CustomLogger import CustomLogger
+
+
+def legacy_enforce_types(func):
+    # the previous implementation, which calls sig.bind() on every call
+    sig = signature(func)
+    return_type = func.__annotations__.get('return')
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        bound_args = sig.bind(*args, **kwargs)
+        for name, value in bound_args.arguments.items():
+            expected_type = func.__annotations__.get(name)
+            if expected_type and not expected_type == Any and not check_type(value, expected_type):
+                raise TypeError(name)
+        result = func(*args, **kwargs)
+        if return_type and not return_type == Any and return_type is not None and not check_type(result, return_type):
+            raise TypeError("return")
+        return result
+
+    return wrapper
+
+
+def get_waitdays(title: str, key: str, data: Dict) -> int:
+    return data.get(key, 0)
+
+
+class DecoratorBenchmarkTests(RunnableTests):
+
+    def _per_call(self, func, number=100000) -> float:
+        data = {"estimatedWaitDays": 7}
+        seconds = min(
+            timeit.repeat(
+                lambda: func("Title", "estimatedWaitDays", data), number=number, repeat=3
+            )
+        )
+        return seconds / number * 1e9
+
+    def test_per_call_overhead(self):
+
+        plain = self._per_call(get_waitdays)
+        legacy = self._per_call(legacy_enforce_types(get_waitdays))
+        validating = self._per_call(enforce_types(get_waitdays))
+
+        # timings vary too much between machines to assert on, so they are only logged
+        CustomLogger.logger.info("undecorated            : %8.0f ns/call", plain)
+        CustomLogger.logger.info("previous enforce_types : %8.0f ns/call (+%.0f)", legacy, legacy - plain)
+        CustomLogger.logger.info("enforce_types (tests)  : %8.0f ns/call (+%.0f)", validating, validating - plain)
+
+    def test_not_decorated_in_calibre(self):
+
+        # calibre-debug sets DEBUG, which keeps the validation
+        with patch.object(GuiMode, "IsAvailable", True), patch.object(decorators, "DEBUG", False):
+            production = enforce_types(get_waitdays)
+        self.assertIs(production, get_waitdays)
+
+        with patch.object(GuiMode, "IsAvailable", True), patch.object(decorators, "DEBUG", True):
+            debugging = enforce_types(get_waitdays)
+        self.assertIsNot(debugging, get_waitdays)
+
+        validating = enforce_types(get_waitdays)
+        self.assertIsNot(validating, get_waitdays)
+        with self.assertRaises(TypeError):
+            validating(1, "estimatedWaitDays", {})
+
+
+# Run with:
+# All tests    : calibre-customize -b calibre-plugin && calibre-debug -e tests/decorator_benchmark_tests.py
+# Specific test: calibre-customize -b calibre-plugin && calibre-debug -e tests/decorator_benchmark_tests.py -- --method test_per_call_overhead
+
+if __name__ == "__main__":
+    DecoratorBenchmarkTests.run_tests()
@@ -0,0 +1,110 @@
+import os
+import tempfile
+import time
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING :
+    from download_journal import DownloadJournal
+else :
+    from calibre_plugins.overdrive_libby.download_journal import DownloadJournal
+
+from all import RunnableTests
+
+ROSTER = [
+    "https://example.read.libbyapp.com/OEBPS/styles.css?cmpt=abc",
+    "https://example.read.libbyapp.com/OEBPS/page1.xhtml?cmpt=abc",
+    "https://example.read.libbyapp.com/OEBPS/page2.xhtml?cmpt=abc",
+]
+
+
+class DownloadJournalTests(RunnableTests):
+
+    def setUp(self):
+        self.root = Path(tempfile.mkdtemp())
+
+    def _save(self, journal: DownloadJournal, url: str, content: bytes) -> Path:
+        file_path = journal.folder.joinpath("OEBPS", Path(url.split("?")[0]).name)
+        file_path.parent.mkdir(parents=True, exist_ok=True)
+        file_path.write_bytes(content)
+        journal.record(url, file_path, manifest_entry={"id": file_path.name})
+        return file_path
+
+    def test_resume(self):
+
+        journal = DownloadJournal.for_loan("123", root=self.root)
+        self.assertEqual(journal.start(ROSTER), 0)
+        self._save(journal, ROSTER[0], b"css")
+        self._save(journal, ROSTER[1], b"page 1")
+
+        # the retried job gets new tokens in the urls
+        retry_roster = [url.replace("abc", "def") for url in ROSTER]
+        retried = DownloadJournal.for_loan("123", root=self.root)
+        self.assertEqual(retried.start(retry_roster), 2)
+        self.assertEqual(retried.completed(retry_roster[1])["manifest_entry"], {"id": "page1.xhtml"})
+        self.assertIsNone(retried.completed(retry_roster[2]))
+
+    def test_changed_asset_is_fetched_again(self):
+
+        journal = DownloadJournal.for_loan("123", root=self.root)
+        journal.start(ROSTER)
+        self._save(journal, ROSTER[0], b"css")
+        page_path = self._save(journal, ROSTER[1], b"page 1")
+        page_path.write_bytes(b"page")
+        # interrupted while writing the journal
+        with journal.path.open("a", encoding="utf-8") as f:
+            f.write('{"asset": "/OEBPS/pa')
+
+        retried = DownloadJournal.for_loan("123", root=self.root)
+        self.assertEqual(retried.start(ROSTER), 1)
+        self.assertIsNone(retried.completed(ROSTER[1]))
+
+    def test_different_roster_starts_over(self):
+
+        journal = DownloadJournal.for_loan("123", root=self.root)
+        journal.start(ROSTER)
+        css_path = self._save(journal, ROSTER[0], b"css")
+
+        retried = DownloadJournal.for_loan("123", root=self.root)
+        self.assertEqual(retried.start(ROSTER[:2]), 0)
+        self.assertFalse(css_path.exists())
+
+    def test_expire(self):
+
+        journal = DownloadJournal.for_loan("123", root=self.root)
+        journal.start(ROSTER)
+        self._save(journal, ROSTER[0], b"css")
+        journal.expire()
+        self.assertFalse(journal.folder.exists())
+        self.assertFalse(journal.path.exists())
+
+        old = DownloadJournal.for_loan("456", root=self.root)
+        old.start(ROSTER)
+        recent = DownloadJournal.for_loan("789", root=self.root)
+        recent.start(ROSTER)
+        stale = time.time() - 8 * 24 * 60 * 60
+        os.utime(old.path, (stale, stale))
+        DownloadJournal.remove_expired(root=self.root)
+        self.assertFalse(old.folder.exists())
+        self.assertTrue(recent.path.exists())
+
+    def test_expire_folder_without_journal(self):
+
+        old = DownloadJournal.for_loan("123-ebook-epub-open", root=self.root).folder
+        old.mkdir(parents=True)
+        old.joinpath("book.epub.part").write_bytes(b"partial")
+        recent = DownloadJournal.for_loan("456-ebook-epub-open", root=self.root).folder
+        recent.mkdir(parents=True)
+        stale = time.time() - 8 * 24 * 60 * 60
+        os.utime(old, (stale, stale))
+        DownloadJournal.remove_expired(root=self.root)
+        self.assertFalse(old.exists())
+        self.assertTrue(recent.exists())
+
+
+# Run with:
+# All tests    : calibre-customize -b calibre-plugin && calibre-debug -e tests/download_journal_tests.py
+# Specific test: calibre-customize -b calibre-plugin && calibre-debug -e tests/download_journal_tests.py -- --method test_resume
+
+if __name__ == "__main__":
+    DownloadJournalTests.run_tests()
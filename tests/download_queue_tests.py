@@ -0,0 +1,152 @@
+import tempfile
+import threading
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING :
+    from download_queue import DownloadQueue, PermanentDownloadError
+    from network import CircuitBreaker, RetryPolicy
+else :
+    from calibre_plugins.overdrive_libby.download_queue import DownloadQueue, PermanentDownloadError
+    from calibre_plugins.overdrive_libby.network import CircuitBreaker, RetryPolicy
+
+from all import RunnableTests
+
+
+def _loan(loan_id: str) -> dict:
+    return {"id": loan_id, "cardId": "1", "title": loan_id}
+
+
+class _Notifications:
+    def __init__(self):
+        self.items = []
+
+    def put(self, item):
+        self.items.append(item)
+
+
+class DownloadQueueTests(RunnableTests):
+
+    def _queue(self, **kwargs) -> DownloadQueue:
+        kwargs.setdefault(
+            "retry_policy",
+            RetryPolicy(backoff_base=0.01, max_delay=0.02, breaker=CircuitBreaker()),
+        )
+        return DownloadQueue(**kwargs)
+
+    def test_priority_and_limits(self):
+
+        queue = self._queue(max_concurrent=2, max_per_host=1)
+        queue.add(_loan("a"), "libbyapp.com", priority=30)
+        queue.add(_loan("b"), "libbyapp.com", priority=10)
+        queue.add(_loan("c"), "sentry.libbyapp.com", priority=20)
+        self.assertFalse(queue.add(_loan("b"), "libbyapp.com"))
+
+        self.assertEqual(queue.take()["key"], "1-b")
+        # a is next by priority but its host is busy
+        self.assertEqual(queue.take()["key"], "1-c")
+        # the concurrency limit is reached
+        self.assertIsNone(queue.take())
+        queue.complete("1-b")
+        self.assertEqual(queue.take()["key"], "1-a")
+        self.assertEqual(queue.unfinished_count(), 2)
+
+    def test_retry_with_backoff(self):
+
+        queue = self._queue(max_attempts=2)
+        queue.add(_loan("a"), "libbyapp.com")
+        entry = queue.take(now=0)
+        self.assertTrue(queue.fail(entry["key"], "timed out"))
+        self.assertIsNone(queue.take(now=0))
+        self.assertGreater(queue.next_wait(now=0), 0)
+        entry = queue.take(now=entry["not_before"])
+        self.assertEqual(entry["attempts"], 2)
+        self.assertFalse(queue.fail(entry["key"], "timed out"))
+        self.assertEqual(entry["state"], DownloadQueue.STATE_FAILED)
+
+        self.assertFalse(queue.is_retryable(PermanentDownloadError("cancelled")))
+        not_found = Exception("not found")
+        not_found.http_status = 404
+        self.assertFalse(queue.is_retryable(not_found))
+        self.assertTrue(queue.is_retryable(ConnectionResetError()))
+
+    def test_persisted(self):
+
+        path = Path(tempfile.mkdtemp()).joinpath("downloads.json")
+        queue = self._queue(persist_to_path=path)
+        queue.add(_loan("a"), "libbyapp.com", priority=2, format_id="ebook-epub-adobe")
+        queue.add(_loan("b"), "libbyapp.com", priority=1)
+        queue.add(_loan("c"), "libbyapp.com", priority=3)
+        queue.take()
+        queue.complete("1-b")
+        # a is running when the session ends
+        self.assertEqual(queue.take()["key"], "1-a")
+
+        restored = self._queue(persist_to_path=path)
+        self.assertEqual(sorted(e["key"] for e in restored.entries()), ["1-a", "1-c"])
+        entry = restored.take()
+        self.assertEqual(entry["key"], "1-a")
+        self.assertEqual(entry["details"], {"format_id": "ebook-epub-adobe"})
+
+        restored.retain(["1-a"])
+        self.assertEqual([e["key"] for e in restored.entries()], ["1-a"])
+
+    def test_run(self):
+
+        queue = self._queue(max_concurrent=3, max_per_host=2)
+        for i in range(6):
+            queue.add(_loan(str(i)), f"host{i % 2}", priority=i)
+        attempts = {}
+        running = []
+        max_running = [0]
+        lock = threading.Lock()
+
+        def download(entry, notifications, abort):
+            with lock:
+                running.append(entry["host"])
+                max_running[0] = max(max_running[0], len(running))
+                attempts[entry["key"]] = attempts.get(entry["key"], 0) + 1
+            try:
+                notifications.put((0.5, "half way"))
+                if entry["key"] == "1-1" and attempts["1-1"] == 1:
+                    raise ConnectionResetError("reset")
+                if entry["key"] == "1-5":
+                    raise PermanentDownloadError("cancelled")
+            finally:
+                with lock:
+                    running.remove(entry["host"])
+
+        notifications = _Notifications()
+        finished = queue.run(download, notifications=notifications)
+        self.assertEqual(
+            sorted((e["key"], e["state"]) for e in finished),
+            [("1-0", "done"), ("1-1", "done"), ("1-2", "done"), ("1-3", "done"),
+             ("1-4", "done"), ("1-5", "failed")],
+        )
+        self.assertEqual(attempts["1-1"], 2)
+        self.assertLessEqual(max_running[0], 3)
+        self.assertEqual(notifications.items[-1][0], 1.0)
+        self.assertEqual(queue.unfinished_count(), 0)
+
+    def test_abort_requeues(self):
+
+        queue = self._queue()
+        queue.add(_loan("a"), "libbyapp.com")
+        abort = threading.Event()
+
+        def download(entry, notifications, entry_abort):
+            abort.set()
+            raise ConnectionResetError("aborted")
+
+        queue.run(download, abort=abort)
+        entry = queue.entries()[0]
+        self.assertEqual(entry["state"], DownloadQueue.STATE_PENDING)
+        self.assertEqual(entry["attempts"], 0)
+
+
+# Run with:
+# All tests    : calibre-customize -b calibre-plugin && calibre-debug -e tests/download_queue_tests.py
+# Specific test: calibre-customize -b calibre-plugin && calibre-debug -e tests/download_queue_tests.py -- --method test_run
+
+if __name__ == "__main__":
+    DownloadQueueTests.run_tests()
@@ -0,0 +1,99 @@
+import tempfile
+import zipfile
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING :
+    from download_journal import DownloadJournal
+    from epub_writer import EpubWriter
+else :
+    from calibre_plugins.overdrive_libby.download_journal import DownloadJournal
+    from calibre_plugins.overdrive_libby.epub_writer import EpubWriter
+
+from all import RunnableTests
+
+ROSTER = [
+    "https://example.read.libbyapp.com/OEBPS/cover.jpg?cmpt=abc",
+    "https://example.read.libbyapp.com/OEBPS/page1.xhtml?cmpt=abc",
+    "https://example.read.libbyapp.com/OEBPS/page2.xhtml?cmpt=abc",
+]
+
+
+class EpubWriterTests(RunnableTests):
+
+    def setUp(self):
+        self.root = Path(tempfile.mkdtemp())
+
+    def test_write(self):
+
+        epub_path = self.root.joinpath("book.epub")
+        with EpubWriter(epub_path) as writer:
+            writer.write("OEBPS/cover.jpg", b"\xff\xd8" * 100, "image/jpeg")
+            writer.write("OEBPS/page1.xhtml", "<html>" * 100, "application/xhtml+xml")
+            self.assertTrue(writer.has("OEBPS/page1.xhtml"))
+            self.assertFalse(writer.has("OEBPS/page2.xhtml"))
+
+        with zipfile.ZipFile(epub_path) as epub_zip:
+            infos = epub_zip.infolist()
+            self.assertEqual(infos[0].filename, "mimetype")
+            self.assertEqual(infos[0].compress_type, zipfile.ZIP_STORED)
+            self.assertEqual(epub_zip.read("mimetype"), b"application/epub+zip")
+            self.assertEqual(epub_zip.getinfo("OEBPS/cover.jpg").compress_type, zipfile.ZIP_STORED)
+            self.assertEqual(
+                epub_zip.getinfo("OEBPS/page1.xhtml").compress_type, zipfile.ZIP_DEFLATED
+            )
+            self.assertEqual(epub_zip.read("OEBPS/page1.xhtml"), b"<html>" * 100)
+
+    def test_resume(self):
+
+        journal = DownloadJournal.for_loan("123", root=self.root)
+        epub_path = journal.folder.joinpath("123.epub")
+        journal.start(ROSTER, checksum=EpubWriter.read_checksums(epub_path).get)
+        try:
+            with EpubWriter(epub_path).open(journal.completed_files()) as writer:
+                for url, content in zip(ROSTER[:2], (b"jpg", b"page 1")):
+                    name = "OEBPS/" + Path(url.split("?")[0]).name
+                    checksum = writer.write(name, content)
+                    journal.record(url, journal.folder.joinpath(name), checksum)
+                raise RuntimeError("Abort signal received.")
+        except RuntimeError:
+            pass
+
+        retried = DownloadJournal.for_loan("123", root=self.root)
+        self.assertEqual(
+            retried.start(ROSTER, checksum=EpubWriter.read_checksums(epub_path).get), 2
+        )
+        self.assertIsNone(retried.completed(ROSTER[2]))
+        with EpubWriter(epub_path).open(retried.completed_files()) as writer:
+            self.assertTrue(writer.has("OEBPS/page1.xhtml"))
+            writer.write("OEBPS/page2.xhtml", b"page 2")
+
+        with zipfile.ZipFile(epub_path) as epub_zip:
+            self.assertEqual(
+                epub_zip.namelist(),
+                ["mimetype", "OEBPS/cover.jpg", "OEBPS/page1.xhtml", "OEBPS/page2.xhtml"],
+            )
+            self.assertEqual(epub_zip.read("OEBPS/page1.xhtml"), b"page 1")
+        self.assertFalse(writer.previous_path.exists())
+
+    def test_unreadable_archive_starts_over(self):
+
+        journal = DownloadJournal.for_loan("123", root=self.root)
+        epub_path = journal.folder.joinpath("123.epub")
+        journal.start(ROSTER)
+        # interrupted before the archive was closed
+        epub_path.write_bytes(b"PK\x03\x04partial")
+        journal.record(ROSTER[0], journal.folder.joinpath("OEBPS/cover.jpg"), "abc")
+
+        retried = DownloadJournal.for_loan("123", root=self.root)
+        self.assertEqual(
+            retried.start(ROSTER, checksum=EpubWriter.read_checksums(epub_path).get), 0
+        )
+
+
+# Run with:
+# All tests    : calibre-customize -b calibre-plugin && calibre-debug -e tests/epub_writer_tests.py
+# Specific test: calibre-customize -b calibre-plugin && calibre-debug -e tests/epub_writer_tests.py -- --method test_resume
+
+if __name__ == "__main__":
+    EpubWriterTests.run_tests()
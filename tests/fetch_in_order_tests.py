@@ -0,0 +1,78 @@
+import threading
+import time
+from typing import TYPE_CHECKING, Dict, List
+
+if TYPE_CHECKING :
+    from magazine_download_utils import fetch_in_order
+else :
+    from calibre_plugins.overdrive_libby.magazine_download_utils import fetch_in_order
+
+from all import RunnableTests
+
+
+class FetchInOrderTests(RunnableTests):
+
+    def test_order(self):
+
+        entries = [{"url": f"https://example.com/{i}", "delay": (10 - i) * 0.01} for i in range(10)]
+        finished: List[int] = []
+        lock = threading.Lock()
+
+        def fetch(entry: Dict) -> str:
+            # later entries finish first
+            time.sleep(entry["delay"])
+            with lock:
+                finished.append(entries.index(entry))
+            return entry["url"]
+
+        results = list(fetch_in_order(fetch, entries, max_workers=4))
+        self.assertEqual([entry for entry, _ in results], entries)
+        self.assertEqual([res for _, res in results], [entry["url"] for entry in entries])
+        self.assertNotEqual(finished, sorted(finished))
+
+    def test_close_early(self):
+
+        entries = [{"url": f"https://example.com/{i}"} for i in range(50)]
+        started: List[str] = []
+        finished: List[str] = []
+        release = threading.Event()
+
+        def fetch(entry: Dict) -> str:
+            started.append(entry["url"])
+            if entry is not entries[0]:
+                release.wait(5)
+            finished.append(entry["url"])
+            return entry["url"]
+
+        fetched_entries = fetch_in_order(fetch, entries, max_workers=2)
+        entry, res = next(fetched_entries)
+        self.assertEqual(res, entries[0]["url"])
+        threading.Timer(0.1, release.set).start()
+        fetched_entries.close()
+        # the running fetches are done by the time close() returns
+        self.assertEqual(sorted(finished), sorted(started))
+        # only the window ahead of the consumer was ever submitted
+        self.assertLessEqual(len(started), 5)
+
+    def test_fetch_error(self):
+
+        entries = [{"url": f"https://example.com/{i}"} for i in range(5)]
+
+        def fetch(entry: Dict) -> str:
+            if entry is entries[2]:
+                raise ValueError(entry["url"])
+            return entry["url"]
+
+        fetched = []
+        with self.assertRaises(ValueError):
+            for entry, _ in fetch_in_order(fetch, entries, max_workers=2):
+                fetched.append(entry)
+        self.assertEqual(fetched, entries[:2])
+
+
+# Run with:
+# All tests    : calibre-customize -b calibre-plugin && calibre-debug -e tests/fetch_in_order_tests.py
+# Specific test: calibre-customize -b calibre-plugin && calibre-debug -e tests/fetch_in_order_tests.py -- --method test_order
+
+if __name__ == "__main__":
+    FetchInOrderTests.run_tests()
@@ -0,0 +1,86 @@
+from enum import Enum
+from types import SimpleNamespace
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING :
+    from models import LibraryMatchIndex
+else :
+    from calibre_plugins.overdrive_libby.models import LibraryMatchIndex
+
+from all import RunnableTests
+
+
+class _EventType(Enum):
+    # same names as calibre.db.listeners.EventType
+    book_created = 1
+    books_removed = 2
+    metadata_changed = 3
+    formats_removed = 4
+
+
+class _FakeDb:
+    def __init__(self):
+        self.fields = {
+            name: SimpleNamespace(table=SimpleNamespace(book_col_map={}))
+            for name in ("title", "identifiers", "formats")
+        }
+
+    def add_book(self, book_id, title, identifiers=None, formats=None):
+        self.fields["title"].table.book_col_map[book_id] = title
+        self.fields["identifiers"].table.book_col_map[book_id] = identifiers or {}
+        if formats:
+            self.fields["formats"].table.book_col_map[book_id] = formats
+
+    def remove_book(self, book_id):
+        for field in self.fields.values():
+            field.table.book_col_map.pop(book_id, None)
+
+
+class LibraryMatchIndexTests(RunnableTests):
+
+    def setUp(self):
+        self.db = _FakeDb()
+        self.db.add_book(1, "The Hobbit", {"isbn": "9780000000001"}, ("EPUB",))
+        self.db.add_book(2, "Dune", {"amazon": "B000000002"})
+        self.index = LibraryMatchIndex(self.db)
+
+    def test_find_book(self):
+
+        self.assertEqual(self.index.find_book(["the hobbit"]), 1)
+        self.assertEqual(self.index.find_book(["x"], isbn="9780000000001"), 1)
+        self.assertEqual(self.index.find_book(["x"], asin="B000000002"), 2)
+        self.assertIsNone(self.index.find_book(["x"], isbn="1", asin="2"))
+        self.assertTrue(self.index.has_formats(1))
+        self.assertFalse(self.index.has_formats(2))
+
+    def test_db_events(self):
+
+        self.db.add_book(3, "Emma")
+        self.assertTrue(
+            self.index.handle_db_event(_EventType.book_created, (3,))
+        )
+        self.assertEqual(self.index.find_book(["emma"]), 3)
+
+        self.db.fields["title"].table.book_col_map[3] = "Persuasion"
+        self.index.handle_db_event(_EventType.metadata_changed, ("title", {3}))
+        self.assertIsNone(self.index.find_book(["emma"]))
+        self.assertEqual(self.index.find_book(["persuasion"]), 3)
+        self.assertFalse(
+            self.index.handle_db_event(_EventType.metadata_changed, ("rating", {3}))
+        )
+
+        self.db.fields["formats"].table.book_col_map.pop(1)
+        self.index.handle_db_event(_EventType.formats_removed, ({1: ("EPUB",)},))
+        self.assertFalse(self.index.has_formats(1))
+
+        self.db.remove_book(1)
+        self.index.handle_db_event(_EventType.books_removed, ({1},))
+        self.assertIsNone(self.index.find_book(["the hobbit"], isbn="9780000000001"))
+
+
+# Run with:
+# All tests    : calibre-customize -b calibre-plugin && calibre-debug -e tests/library_index_tests.py
+# Specific test: calibre-customize -b calibre-plugin && calibre-debug -e tests/library_index_tests.py -- --method test_db_events
+
+if __name__ == "__main__":
+    LibraryMatchIndexTests.run_tests()
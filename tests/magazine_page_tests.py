@@ -0,0 +1,152 @@
+import base64
+from typing import TYPE_CHECKING
+
+from bs4 import BeautifulSoup
+
+if TYPE_CHECKING :
+    from magazine_page import PAGE_PARSER, PageTransformPool, cleanup_soup, transform_page
+else :
+    from calibre_plugins.overdrive_libby.magazine_page import (
+        PAGE_PARSER,
+        PageTransformPool,
+        cleanup_soup,
+        transform_page,
+    )
+
+from all import RunnableTests
+
+PAGE_TEMPLATE = """<!DOCTYPE html>
+<html><head><title>Page</title>
+<script type="text/javascript">parent.__bif_cfc0(self,'{payload}')</script>
+</head><body><p>Loading</p></body></html>"""
+
+
+def _page(content: str) -> bytes:
+    payload = base64.b64encode(content.encode("utf-8")).decode("ascii")
+    return PAGE_TEMPLATE.format(payload=payload).encode("utf-8")
+
+
+class MagazinePageTests(RunnableTests):
+
+    def test_transform_page(self):
+
+        data = _page(
+            '<html><body><nav epub:type="toc"><ol><li><a href="p1.xhtml">One</a></li></ol></nav>'
+            '<img src="images/p1.jpg"/></body></html>'
+        )
+        for parser in ("html.parser", "lxml"):
+            with self.subTest(parser=parser):
+                page = transform_page(data, "/OEBPS/toc.xhtml", "3.0", parser=parser)
+                self.assertTrue(page.is_toc)
+                self.assertFalse(page.has_svg)
+                self.assertEqual(page.img_src, "images/p1.jpg")
+                self.assertIn('xmlns="http://www.w3.org/1999/xhtml"', page.content)
+                self.assertNotIn("Loading", page.content)
+
+    def test_transform_cover_page(self):
+
+        data = _page(
+            '<html><body><div><svg viewBox="0 0 10 10"><image href="cover.jpg"/></svg></div>'
+            "</body></html>"
+        )
+        for parser in ("html.parser", "lxml"):
+            with self.subTest(parser=parser):
+                page = transform_page(data, "/OEBPS/pages/cover.xhtml", "3.0", parser=parser)
+                self.assertTrue(page.has_svg)
+
+                page = transform_page(
+                    data, "/OEBPS/pages/cover.xhtml", "3.0", "../images/cover.jpg", parser
+                )
+                self.assertFalse(page.has_svg)
+                self.assertFalse(page.is_toc)
+                self.assertEqual(page.img_src, "../images/cover.jpg")
+
+    def test_cleanup_soup(self):
+
+        markup = (
+            '<html><head><base href="https://example.com/"/></head><body>'
+            '<section epub:type="toc" role="doc-toc"><figcaption>Caption</figcaption>'
+            '<img src="a.jpg"/><svg><image href="b.jpg"/></svg><img src="c.jpg"/></section>'
+            "</body></html>"
+        )
+        soup = BeautifulSoup(markup, features="html.parser")
+        scan = cleanup_soup(soup, version="3.0")
+        self.assertTrue(scan.is_toc)
+        self.assertEqual(scan.first_img_src, "a.jpg")
+        self.assertEqual(scan.first_svg["xmlns"], "http://www.w3.org/2000/svg")
+        self.assertEqual(soup.find("html")["xmlns"], "http://www.w3.org/1999/xhtml")
+        self.assertIsNone(soup.find("base"))
+        self.assertIsNone(soup.find("figcaption"))
+        self.assertIsNotNone(soup.find("section"))
+
+        soup = BeautifulSoup(markup, features="html.parser")
+        scan = cleanup_soup(soup, version="2.0")
+        # epub:type is not valid in epub 2
+        self.assertFalse(scan.is_toc)
+        self.assertIsNone(soup.find("section"))
+        self.assertIsNone(soup.find(attrs={"role": True}))
+
+    def test_page_transform_pool(self):
+
+        pages = [
+            _page(f'<html><body><p>Page {i}</p><img src="images/p{i}.jpg"/></body></html>')
+            for i in range(6)
+        ]
+        # calibre bundles lxml
+        self.assertEqual(PAGE_PARSER, "lxml")
+        for parser in ("html.parser", "lxml"):
+            with self.subTest(parser=parser), PageTransformPool(2, parser) as pool:
+                for i, data in enumerate(pages):
+                    page = pool.transform(data, f"/OEBPS/p{i}.xhtml", "3.0")
+                    self.assertEqual(
+                        page, transform_page(data, f"/OEBPS/p{i}.xhtml", "3.0", parser=parser)
+                    )
+                self.assertLessEqual(len(pool._workers), 2)
+
+    def test_page_transform_pool_fallback(self):
+
+        data = _page('<html><body><img src="images/p1.jpg"/></body></html>')
+        pool = PageTransformPool(max_workers=2)
+
+        def fail():
+            raise OSError("no workers")
+
+        pool._start_worker = fail
+        page = pool.transform(data, "/OEBPS/p1.xhtml", "3.0")
+        self.assertEqual(page.img_src, "images/p1.jpg")
+        self.assertEqual(pool._workers, [])
+        pool.close()
+
+    def test_page_transform_pool_closed(self):
+
+        data = _page('<html><body><img src="images/p1.jpg"/></body></html>')
+        pool = PageTransformPool(max_workers=2)
+        stopped = []
+
+        class _Worker:
+            def __call__(self, module, func, *args):
+                # the pool is closed while the worker is in use
+                pool.close()
+                return {"result": transform_page(*args), "tb": None}
+
+            def shutdown(self):
+                stopped.append(self)
+
+        pool._start_worker = _Worker
+        page = pool.transform(data, "/OEBPS/p1.xhtml", "3.0")
+        self.assertEqual(page.img_src, "images/p1.jpg")
+        self.assertEqual(len(stopped), 1)
+        self.assertEqual(pool._idle, [])
+
+        # no new workers after close
+        pool._start_worker = lambda: self.fail("worker started after close")
+        page = pool.transform(data, "/OEBPS/p1.xhtml", "3.0")
+        self.assertEqual(page.img_src, "images/p1.jpg")
+
+
+# Run with:
+# All tests    : calibre-customize -b calibre-plugin && calibre-debug -e tests/magazine_page_tests.py
+# Specific test: calibre-customize -b calibre-plugin && calibre-debug -e tests/magazine_page_tests.py -- --method test_transform_page
+
+if __name__ == "__main__":
+    MagazinePageTests.run_tests()
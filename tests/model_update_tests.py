@@ -0,0 +1,78 @@
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING :
+    from models import LibbyModel
+else :
+    from calibre_plugins.overdrive_libby.models import LibbyModel
+
+from all import RunnableTests
+
+
+class _TestModel(LibbyModel):
+    column_headers = ["Title"]
+
+    def __init__(self):
+        super().__init__(None)
+        self.events = []
+        self.rowsInserted.connect(lambda _, first, last: self.events.append(("insert", first, last)))
+        self.rowsRemoved.connect(lambda _, first, last: self.events.append(("remove", first, last)))
+        self.dataChanged.connect(lambda first, last, *_: self.events.append(("change", first.row())))
+        self.modelReset.connect(lambda: self.events.append(("reset",)))
+        self.layoutChanged.connect(lambda *_: self.events.append(("layout",)))
+
+
+def _row(title_id, card_id="1", **kwargs):
+    return dict(id=title_id, cardId=card_id, **kwargs)
+
+
+class ModelUpdateTests(RunnableTests):
+
+    def setUp(self):
+        self.model = _TestModel()
+        self.model.update_rows([_row("a"), _row("b"), _row("c"), _row("d")])
+        self.model.events = []
+
+    def _ids(self):
+        return [r["id"] for r in self.model._rows]
+
+    def test_insert_and_remove(self):
+
+        self.model.update_rows([_row("a"), _row("x"), _row("c"), _row("d"), _row("y")])
+        self.assertEqual(self._ids(), ["a", "x", "c", "d", "y"])
+        self.assertEqual(
+            self.model.events, [("remove", 1, 1), ("insert", 1, 1), ("insert", 4, 4)]
+        )
+
+    def test_changed_rows(self):
+
+        self.model.update_rows(
+            [_row("a"), _row("b", isAvailable=True), _row("c"), _row("d")]
+        )
+        self.assertEqual(self.model.events, [("change", 1)])
+        self.assertTrue(self.model._rows[1]["isAvailable"])
+
+    def test_same_title_on_different_cards(self):
+
+        self.model.update_rows(
+            [_row("a"), _row("a", card_id="2"), _row("b"), _row("c"), _row("d")]
+        )
+        self.assertEqual(self.model.events, [("insert", 1, 1)])
+
+    def test_reordered_rows(self):
+
+        self.model.update_rows([_row("d"), _row("c"), _row("b"), _row("a")])
+        self.assertEqual(self._ids(), ["d", "c", "b", "a"])
+        self.assertEqual(self.model.events, [("layout",)])
+
+    def test_duplicate_keys_reset(self):
+
+        self.model.update_rows([_row("a"), _row("a")])
+        self.assertEqual(self.model.events, [("reset",)])
+
+
+# Run with:
+# All tests    : calibre-customize -b calibre-plugin && calibre-debug -e tests/model_update_tests.py
+# Specific test: calibre-customize -b calibre-plugin && calibre-debug -e tests/model_update_tests.py -- --method test_insert_and_remove
+
+if __name__ == "__main__":
+    ModelUpdateTests.run_tests()
@@ -0,0 +1,143 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING :
+    from network import CancelToken, CircuitBreaker, RequestCancelledError, RetryPolicy, cancellation_scope
+    from overdrive import OverDriveClient
+else :
+    from calibre_plugins.overdrive_libby.network import CancelToken, CircuitBreaker, RequestCancelledError, RetryPolicy, cancellation_scope
+    from calibre_plugins.overdrive_libby.overdrive import OverDriveClient
+
+from all import RunnableTests
+
+
+class _SlowHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    delay = 0.0
+    status = 200
+
+    def do_GET(self):
+        body = b'{"items": []}'
+        if self.path.startswith("/stall"):
+            # send the headers, then stall in the middle of the body
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body) * 2))
+            self.end_headers()
+            self.wfile.write(body)
+            self.wfile.flush()
+            time.sleep(self.delay)
+            return
+        time.sleep(self.delay)
+        self.send_response(self.status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class RequestCancelTests(RunnableTests):
+
+    def setUp(self):
+        _SlowHandler.delay = 0.0
+        _SlowHandler.status = 200
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), _SlowHandler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.breaker = CircuitBreaker(failure_threshold=1)
+        self.client = OverDriveClient(
+            max_retries=2,
+            timeout=10,
+            retry_policy=RetryPolicy(backoff_base=5.0, breaker=self.breaker),
+        )
+        self.client.api_base = f"http://127.0.0.1:{self.server.server_port}/"
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _send_and_cancel(self, endpoint: str, cancel_after: float):
+        token = CancelToken()
+        timer = threading.Timer(cancel_after, token.cancel)
+        timer.start()
+        start = time.monotonic()
+        try:
+            with cancellation_scope(token):
+                with self.assertRaises(RequestCancelledError):
+                    self.client.send_request(endpoint)
+        finally:
+            timer.cancel()
+        return time.monotonic() - start
+
+    def test_not_cancelled(self):
+
+        with cancellation_scope(CancelToken()):
+            self.assertEqual(self.client.send_request("media"), {"items": []})
+
+    def test_already_cancelled(self):
+
+        token = CancelToken()
+        token.cancel()
+        with cancellation_scope(token):
+            with self.assertRaises(RequestCancelledError):
+                self.client.send_request("media")
+
+    def test_cancel_waiting_for_response(self):
+
+        _SlowHandler.delay = 3
+        elapsed = self._send_and_cancel("media", 0.2)
+        self.assertLess(elapsed, 2)
+        # the host did not fail, so the breaker stays closed
+        self.assertEqual(self.breaker.blocked_for(f"127.0.0.1:{self.server.server_port}"), 0)
+
+    def test_cancel_trial_request(self):
+
+        host = f"127.0.0.1:{self.server.server_port}"
+        self.breaker.record_failure(host)
+        # the cooldown is over
+        self.breaker._opened_at[host] -= self.breaker.cooldown
+        _SlowHandler.delay = 3
+        # the cancelled request was the trial request
+        self._send_and_cancel("media", 0.2)
+        # so the next request can be the trial
+        self.assertEqual(self.breaker.blocked_for(host), 0)
+
+    def test_cancel_reading_body(self):
+
+        _SlowHandler.delay = 3
+        elapsed = self._send_and_cancel("stall", 0.2)
+        self.assertLess(elapsed, 2)
+
+    def test_cancel_retry_wait(self):
+
+        _SlowHandler.status = 503
+        # the first retry would wait for at least 2.5 seconds
+        elapsed = self._send_and_cancel("media", 0.3)
+        self.assertLess(elapsed, 2)
+
+    def test_cancel_callbacks(self):
+
+        token = CancelToken()
+        calls = []
+        token.on_cancel(lambda: calls.append("a"))
+        remove = token.on_cancel(lambda: calls.append("b"))
+        remove()
+        token.cancel()
+        token.cancel()
+        self.assertEqual(calls, ["a"])
+        # registered after cancelling, so it is called straight away
+        token.on_cancel(lambda: calls.append("c"))
+        self.assertEqual(calls, ["a", "c"])
+
+
+# Run with:
+# All tests    : calibre-customize -b calibre-plugin && calibre-debug -e tests/request_cancel_tests.py
+# Specific test: calibre-customize -b calibre-plugin && calibre-debug -e tests/request_cancel_tests.py -- --method test_cancel_reading_body
+
+if __name__ == "__main__":
+    RequestCancelTests.run_tests()
@@ -0,0 +1,107 @@
+import threading
+import time
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING :
+    from network import CircuitBreaker, RetryPolicy
+else :
+    from calibre_plugins.overdrive_libby.network import CircuitBreaker, RetryPolicy
+
+from all import RunnableTests
+
+
+class RetryPolicyTests(RunnableTests):
+
+    def test_retryable_status(self):
+
+        policy = RetryPolicy(breaker=CircuitBreaker())
+        self.assertTrue(policy.is_retryable_status(500))
+        self.assertTrue(policy.is_retryable_status(503))
+        self.assertTrue(policy.is_retryable_status(429))
+        self.assertFalse(policy.is_retryable_status(404))
+        self.assertFalse(policy.is_retryable_status(403))
+
+    def test_backoff_with_jitter(self):
+
+        policy = RetryPolicy(backoff_base=1.0, max_delay=5.0, breaker=CircuitBreaker())
+        for attempt, expected in ((0, 1.0), (1, 2.0), (2, 4.0), (5, 5.0)):
+            delay = policy.get_delay(attempt)
+            self.assertGreaterEqual(delay, expected / 2)
+            self.assertLessEqual(delay, expected)
+
+    def test_retry_after(self):
+
+        policy = RetryPolicy(max_delay=30.0, breaker=CircuitBreaker())
+        self.assertEqual(policy.get_delay(0, "7"), 7.0)
+        # server wants us to wait too long, so don't retry
+        self.assertIsNone(policy.get_delay(0, "120"))
+        # dates in the past mean retry now
+        self.assertEqual(policy.get_delay(0, "Wed, 21 Oct 2015 07:28:00 GMT"), 0.0)
+        self.assertIsNone(RetryPolicy.parse_retry_after("soon"))
+
+    def test_circuit_breaker(self):
+
+        breaker = CircuitBreaker(failure_threshold=2, cooldown=60)
+        self.assertEqual(breaker.blocked_for("a"), 0)
+        breaker.record_failure("a")
+        self.assertEqual(breaker.blocked_for("a"), 0)
+        breaker.record_failure("a")
+        self.assertGreater(breaker.blocked_for("a"), 0)
+        self.assertEqual(breaker.blocked_for("b"), 0)
+        breaker.record_success("a")
+        self.assertEqual(breaker.blocked_for("a"), 0)
+
+    def test_circuit_breaker_trial_request(self):
+
+        breaker = CircuitBreaker(failure_threshold=1, cooldown=0.05)
+        breaker.record_failure("a")
+        self.assertGreater(breaker.blocked_for("a"), 0)
+        time.sleep(0.06)
+        # cooldown is over, only one trial request is let through
+        self.assertEqual(breaker.blocked_for("a"), 0)
+        self.assertGreater(breaker.blocked_for("a"), 0)
+        # trial request failed, so the breaker opens again
+        breaker.record_failure("a")
+        self.assertGreater(breaker.blocked_for("a"), 0)
+
+    def test_circuit_breaker_lost_trial_request(self):
+
+        breaker = CircuitBreaker(failure_threshold=1, cooldown=0.05)
+        breaker.record_failure("a")
+        time.sleep(0.06)
+        self.assertEqual(breaker.blocked_for("a"), 0)
+        # the trial request never reports back
+        self.assertGreater(breaker.blocked_for("a"), 0)
+        time.sleep(0.06)
+        # so another trial is let through after the cooldown
+        self.assertEqual(breaker.blocked_for("a"), 0)
+        self.assertGreater(breaker.blocked_for("a"), 0)
+        breaker.record_success("a")
+        self.assertEqual(breaker.blocked_for("a"), 0)
+
+    def test_circuit_breaker_release_trial(self):
+
+        breaker = CircuitBreaker(failure_threshold=1, cooldown=0.05)
+        breaker.record_failure("a")
+        time.sleep(0.06)
+        trial_thread = threading.Thread(target=breaker.blocked_for, args=("a",))
+        trial_thread.start()
+        trial_thread.join()
+        # only the thread with the trial request can release it
+        breaker.release_trial("a")
+        self.assertGreater(breaker.blocked_for("a"), 0)
+
+        breaker = CircuitBreaker(failure_threshold=1, cooldown=0.05)
+        breaker.record_failure("a")
+        time.sleep(0.06)
+        self.assertEqual(breaker.blocked_for("a"), 0)
+        breaker.release_trial("a")
+        self.assertEqual(breaker.blocked_for("a"), 0)
+
+
+# Run with:
+# All tests    : calibre-customize -b calibre-plugin && calibre-debug -e tests/retry_policy_tests.py
+# Specific test: calibre-customize -b calibre-plugin && calibre-debug -e tests/retry_policy_tests.py -- --method test_retry_after
+
+if __name__ == "__main__":
+    RetryPolicyTests.run_tests()
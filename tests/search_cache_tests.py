@@ -0,0 +1,147 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING :
+    from overdrive import LibraryMediaSearchParams, LibrarySearchCache, OverDriveClient
+else :
+    from calibre_plugins.overdrive_libby.overdrive import LibraryMediaSearchParams, LibrarySearchCache, OverDriveClient
+
+from all import RunnableTests
+
+
+class _LibraryHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    requests = []
+
+    def _send_json(self, res):
+        body = json.dumps(res).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        _LibraryHandler.requests.append(("GET", self.path.split("?")[0]))
+        self._send_json(
+            {"items": [{"id": "1", "title": "A", "isAvailable": True, "availableCopies": 1}]}
+        )
+
+    def do_POST(self):
+        _LibraryHandler.requests.append(("POST", self.path.split("?")[0]))
+        self.rfile.read(int(self.headers["Content-Length"]))
+        self._send_json({"items": [{"id": "1", "isAvailable": False, "availableCopies": 0}]})
+
+    def log_message(self, *args):
+        pass
+
+
+class SearchCacheTests(RunnableTests):
+
+    def test_cache_key_is_normalised(self):
+
+        a = LibraryMediaSearchParams(query=" tolkien ", formats=["ebook-epub-adobe"])
+        b = LibraryMediaSearchParams(formats=["ebook-epub-adobe"], query="tolkien")
+        self.assertEqual(
+            LibrarySearchCache.cache_key("LAPL", a), LibrarySearchCache.cache_key("lapl", b)
+        )
+        c = LibraryMediaSearchParams(query="tolkien", page=2)
+        self.assertNotEqual(
+            LibrarySearchCache.cache_key("lapl", a), LibrarySearchCache.cache_key("lapl", c)
+        )
+
+    def test_get_returns_copy(self):
+
+        cache = LibrarySearchCache()
+        query = LibraryMediaSearchParams(query="x")
+        cache.put("lapl", query, {"items": [{"id": "1", "isAvailable": True}]})
+        results, availability_expired = cache.get("lapl", query)
+        self.assertFalse(availability_expired)
+        results["items"][0].pop("isAvailable")
+        results, _ = cache.get("lapl", query)
+        self.assertTrue(results["items"][0]["isAvailable"])
+        self.assertIsNone(cache.get("kcls", query))
+
+    def test_ttl(self):
+
+        cache = LibrarySearchCache(ttl=0.1, availability_ttl=0.05)
+        query = LibraryMediaSearchParams(query="x")
+        cache.put("lapl", query, {"items": []})
+        time.sleep(0.06)
+        _, availability_expired = cache.get("lapl", query)
+        self.assertTrue(availability_expired)
+        time.sleep(0.05)
+        self.assertIsNone(cache.get("lapl", query))
+
+        cache = LibrarySearchCache(ttl=0)
+        cache.put("lapl", query, {"items": []})
+        self.assertIsNone(cache.get("lapl", query))
+
+    def test_expire_availability(self):
+
+        cache = LibrarySearchCache()
+        query1 = LibraryMediaSearchParams(query="x")
+        query2 = LibraryMediaSearchParams(query="y")
+        cache.put("lapl", query1, {"items": [{"id": "1"}]})
+        cache.put("lapl", query2, {"items": [{"id": "2"}]})
+        cache.expire_availability(["1"])
+        self.assertTrue(cache.get("lapl", query1)[1])
+        self.assertFalse(cache.get("lapl", query2)[1])
+
+    def test_capacity(self):
+
+        cache = LibrarySearchCache(capacity=2)
+        queries = [LibraryMediaSearchParams(query=q) for q in ("a", "b", "c")]
+        for query in queries:
+            cache.put("lapl", query, {"items": []})
+        self.assertIsNone(cache.get("lapl", queries[0]))
+        self.assertIsNotNone(cache.get("lapl", queries[2]))
+
+    def test_patch_availability(self):
+
+        response = {"items": [{"id": "1", "title": "A", "isAvailable": True}, {"id": "2"}]}
+        updated = LibrarySearchCache.patch_availability(
+            response, {"items": [{"id": "1", "isAvailable": False, "formats": []}, None]}
+        )
+        self.assertEqual(updated, 1)
+        self.assertEqual(response["items"][0], {"id": "1", "title": "A", "isAvailable": False})
+
+    def test_client_library_medias(self):
+
+        server = ThreadingHTTPServer(("127.0.0.1", 0), _LibraryHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            _LibraryHandler.requests = []
+            cache = LibrarySearchCache(availability_ttl=60)
+            client = OverDriveClient(search_cache=cache)
+            client.api_base = f"http://127.0.0.1:{server.server_port}/"
+            query = LibraryMediaSearchParams(query="x")
+
+            self.assertTrue(client.library_medias("lapl", query)["items"][0]["isAvailable"])
+            self.assertTrue(client.library_medias("lapl", query)["items"][0]["isAvailable"])
+            self.assertEqual(_LibraryHandler.requests, [("GET", "/libraries/lapl/media/")])
+
+            # only the availability is fetched again
+            cache.expire_availability(["1"])
+            results = client.library_medias("lapl", query)
+            self.assertFalse(results["items"][0]["isAvailable"])
+            self.assertEqual(results["items"][0]["title"], "A")
+            self.assertEqual(
+                _LibraryHandler.requests[1:], [("POST", "/libraries/lapl/media/availability")]
+            )
+            self.assertFalse(client.library_medias("lapl", query)["items"][0]["isAvailable"])
+            self.assertEqual(len(_LibraryHandler.requests), 2)
+        finally:
+            server.shutdown()
+            server.server_close()
+
+
+# Run with:
+# All tests    : calibre-customize -b calibre-plugin && calibre-debug -e tests/search_cache_tests.py
+# Specific test: calibre-customize -b calibre-plugin && calibre-debug -e tests/search_cache_tests.py -- --method test_client_library_medias
+
+if __name__ == "__main__":
+    SearchCacheTests.run_tests()
@@ -0,0 +1,77 @@
+from typing import TYPE_CHECKING
+
+from qt.core import Qt
+
+if TYPE_CHECKING :
+    from models import LibbyModel, LibbySearchModel
+else :
+    from calibre_plugins.overdrive_libby.models import LibbyModel, LibbySearchModel
+
+from all import RunnableTests
+
+
+def _media(title_id, **kwargs):
+    media = dict(
+        id=title_id,
+        title=f"Title {title_id}",
+        firstCreatorName="Author",
+        type={"id": "ebook"},
+        formats=[{"id": "ebook-epub-adobe"}],
+        siteAvailabilities={"lib1": {"isAvailable": True, "formats": []}},
+    )
+    media.update(kwargs)
+    return media
+
+
+class SearchDisplayTests(RunnableTests):
+
+    def setUp(self):
+        self.model = LibbySearchModel(None)
+
+    def _data(self, row, col, role=Qt.DisplayRole):
+        return self.model.data(self.model.index(row, col), role)
+
+    def test_publish_date(self):
+
+        self.model._rows = [
+            _media("1", publishDate="2020-05-01T00:00:00Z"),
+            _media("2", estimatedReleaseDate="2024-01-02T00:00:00Z"),
+        ]
+        self.assertEqual(self._data(0, 2), 2020)
+        self.assertTrue(self._data(0, 2, LibbyModel.DisplaySortRole).startswith("2020-05-01"))
+        self.assertEqual(self._data(1, 2), 2024)
+
+    def test_malformed_publish_date(self):
+
+        self.model._rows = [_media("1", publishDate="sometime soon")]
+        self.assertEqual(self._data(0, 2), "")
+        self.assertEqual(self._data(0, 2, LibbyModel.DisplaySortRole), "")
+        # the other columns are still shown
+        self.assertEqual(self._data(0, 5), "lib1")
+
+    def test_values_are_cached(self):
+
+        media = _media("1", publishDate="2020-05-01T00:00:00Z")
+        self.model._rows = [media]
+        self.assertEqual(self._data(0, 2), 2020)
+        # not recomputed until the title is invalidated
+        media["publishDate"] = "2021-05-01T00:00:00Z"
+        self.assertEqual(self._data(0, 2), 2020)
+        self.model.invalidate_media("1")
+        self.assertEqual(self._data(0, 2), 2021)
+
+    def test_rows_replaced(self):
+
+        self.model._rows = [_media("1", publishDate="2020-05-01T00:00:00Z")]
+        self.assertEqual(self._data(0, 2), 2020)
+        # a different media dict is computed on first access
+        self.model._rows = [_media("1", publishDate="2021-05-01T00:00:00Z")]
+        self.assertEqual(self._data(0, 2), 2021)
+
+
+# Run with:
+# All tests    : calibre-customize -b calibre-plugin && calibre-debug -e tests/search_display_tests.py
+# Specific test: calibre-customize -b calibre-plugin && calibre-debug -e tests/search_display_tests.py -- --method test_malformed_publish_date
+
+if __name__ == "__main__":
+    SearchDisplayTests.run_tests()
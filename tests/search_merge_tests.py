@@ -0,0 +1,55 @@
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING :
+    from models import SearchResultsMerger
+else :
+    from calibre_plugins.overdrive_libby.models import SearchResultsMerger
+
+from all import RunnableTests
+
+
+def _item(title_id, *format_ids, **kwargs):
+    return dict(id=title_id, formats=[{"id": f} for f in format_ids], **kwargs)
+
+
+class SearchMergeTests(RunnableTests):
+
+    def test_merge_as_libraries_respond(self):
+
+        merger = SearchResultsMerger()
+        changed = merger.add_library_results(
+            "lib1", [_item("a", "ebook-epub-adobe", isAvailable=True), _item("b")]
+        )
+        self.assertEqual([r["id"] for r in changed], ["a", "b"])
+        self.assertEqual([r["id"] for r in merger.ordered_items()], ["a", "b"])
+        # availability keys are moved into siteAvailabilities
+        a = merger.ordered_items()[0]
+        self.assertNotIn("isAvailable", a)
+        self.assertTrue(a["siteAvailabilities"]["lib1"]["isAvailable"])
+
+        changed = merger.add_library_results(
+            "lib2", [_item("b"), _item("c"), _item("a", "ebook-kindle", "ebook-epub-adobe")]
+        )
+        self.assertEqual([r["id"] for r in changed], ["b", "c", "a"])
+        # b: ranks 2, 1; a: ranks 1, 3; c: rank 2 in one library only
+        self.assertEqual([r["id"] for r in merger.ordered_items()], ["b", "a", "c"])
+        a = [r for r in merger.ordered_items() if r["id"] == "a"][0]
+        self.assertEqual(sorted(a["siteAvailabilities"].keys()), ["lib1", "lib2"])
+        self.assertEqual(
+            [f["id"] for f in a["formats"]], ["ebook-epub-adobe", "ebook-kindle"]
+        )
+
+    def test_ties_keep_first_seen_order(self):
+
+        merger = SearchResultsMerger()
+        merger.add_library_results("lib1", [_item("a")])
+        merger.add_library_results("lib2", [_item("b")])
+        self.assertEqual([r["id"] for r in merger.ordered_items()], ["a", "b"])
+
+
+# Run with:
+# All tests    : calibre-customize -b calibre-plugin && calibre-debug -e tests/search_merge_tests.py
+# Specific test: calibre-customize -b calibre-plugin && calibre-debug -e tests/search_merge_tests.py -- --method test_merge_as_libraries_respond
+
+if __name__ == "__main__":
+    SearchMergeTests.run_tests()
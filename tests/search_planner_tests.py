@@ -0,0 +1,122 @@
+import threading
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING :
+    from overdrive import LibraryMediaSearchParams, LibrarySearchPlanner
+else :
+    from calibre_plugins.overdrive_libby.overdrive import LibraryMediaSearchParams, LibrarySearchPlanner
+
+from all import RunnableTests
+
+MEDIAS = [
+    {
+        "id": "1",
+        "title": "A",
+        "siteAvailabilities": {
+            "lapl": {"isAvailable": True, "formats": [{"id": "ebook-epub-adobe"}]},
+            "kcls": {"isAvailable": False},
+        },
+    },
+    {"id": "2", "title": "B", "siteAvailabilities": {"kcls": {"isAvailable": True}}},
+    {"id": "3", "title": "C", "siteAvailabilities": {"other": {"isAvailable": True}}},
+]
+
+
+class _Client:
+    """Counts the requests that the planner makes."""
+
+    search_cache = None
+
+    def __init__(self):
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def media_search(self, library_keys, query, **kwargs):
+        with self.lock:
+            self.calls.append(("media_search", tuple(library_keys), kwargs["maxItems"]))
+        return MEDIAS
+
+    def library_medias(self, library_key, query):
+        with self.lock:
+            self.calls.append(("library_medias", library_key))
+        return {"items": []}
+
+
+class SearchPlannerTests(RunnableTests):
+
+    def test_can_search_together(self):
+
+        libraries = ["lapl", "kcls"]
+        query = LibraryMediaSearchParams(query="tolkien", formats=["ebook-epub-adobe"])
+        self.assertTrue(LibrarySearchPlanner.can_search_together(libraries, query))
+        self.assertFalse(LibrarySearchPlanner.can_search_together(["lapl"], query))
+        for params in (
+            {"query": "tolkien", "creator": "tolkien"},
+            {"query": "tolkien", "subject_id": "26"},
+            {"query": "tolkien", "media_type": "ebook"},
+            {"query": "tolkien", "sort_by": "newlyadded"},
+            {"query": "tolkien", "page": 100},
+            {"title": "hobbit"},
+        ):
+            with self.subTest(params=params):
+                self.assertFalse(
+                    LibrarySearchPlanner.can_search_together(
+                        libraries, LibraryMediaSearchParams(**params)
+                    )
+                )
+
+    def test_split_results(self):
+
+        results = LibrarySearchPlanner.split_results(MEDIAS, ["LAPL", "kcls"], has_more=True)
+        self.assertEqual([i["id"] for i in results["lapl"]["items"]], ["1"])
+        self.assertEqual([i["id"] for i in results["kcls"]["items"]], ["1", "2"])
+        lapl_item = results["lapl"]["items"][0]
+        self.assertTrue(lapl_item["isAvailable"])
+        self.assertEqual(lapl_item["formats"], [{"id": "ebook-epub-adobe"}])
+        self.assertNotIn("siteAvailabilities", lapl_item)
+        self.assertFalse(results["kcls"]["items"][0]["isAvailable"])
+        self.assertEqual(results["kcls"]["links"]["last"]["page"], 2)
+        # the endpoint does not say how many results there are
+        self.assertIsNone(results["kcls"]["totalItems"])
+
+        # items from the earlier pages are skipped
+        results = LibrarySearchPlanner.split_results(MEDIAS, ["kcls"], skip=1, page=2)
+        self.assertEqual([i["id"] for i in results["kcls"]["items"]], ["2"])
+        self.assertEqual(results["kcls"]["links"]["last"]["page"], 2)
+
+    def test_one_request_for_all_libraries(self):
+
+        client = _Client()
+        libraries = ["lapl", "kcls", "sno-isle"]
+        planner = LibrarySearchPlanner(
+            client, libraries, LibraryMediaSearchParams(query="tolkien", per_page=20)
+        )
+        threads = [
+            threading.Thread(target=planner.library_medias, args=(k,)) for k in libraries
+        ]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(client.calls, [("media_search", tuple(libraries), 20)])
+        self.assertEqual(planner.library_medias("sno-isle")["items"], [])
+
+    def test_fallback_per_library(self):
+
+        client = _Client()
+        planner = LibrarySearchPlanner(
+            client, ["lapl", "kcls"], LibraryMediaSearchParams(creator="tolkien")
+        )
+        planner.library_medias("lapl")
+        planner.library_medias("kcls")
+        self.assertEqual(
+            client.calls, [("library_medias", "lapl"), ("library_medias", "kcls")]
+        )
+
+
+# Run with:
+# All tests    : calibre-customize -b calibre-plugin && calibre-debug -e tests/search_planner_tests.py
+# Specific test: calibre-customize -b calibre-plugin && calibre-debug -e tests/search_planner_tests.py -- --method test_split_results
+
+if __name__ == "__main__":
+    SearchPlannerTests.run_tests()
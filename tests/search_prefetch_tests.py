@@ -0,0 +1,80 @@
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING :
+    from overdrive import LibraryMediaSearchParams, SearchPagePrefetches
+else :
+    from calibre_plugins.overdrive_libby.overdrive import LibraryMediaSearchParams, SearchPagePrefetches
+
+from all import RunnableTests
+
+
+class _Task:
+    def __init__(self):
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+def _results(count: int) -> dict:
+    return {"items": [{"id": str(i)} for i in range(count)]}
+
+
+class SearchPrefetchTests(RunnableTests):
+
+    def setUp(self):
+        self.query = LibraryMediaSearchParams(query="tolkien", page=2)
+        self.prefetches = SearchPagePrefetches(max_items=10)
+        self.tasks = {"lapl": _Task(), "kcls": _Task(), "nypl": _Task()}
+        self.prefetches.start(self.query, self.tasks)
+
+    def test_claim(self):
+
+        self.assertTrue(self.prefetches.store("lapl", self.tasks["lapl"], _results(4)))
+        self.prefetches.drop("nypl", self.tasks["nypl"])
+        # not the prefetch task for the library
+        self.assertFalse(self.prefetches.store("kcls", _Task(), _results(1)))
+
+        running, results = self.prefetches.claim(
+            LibraryMediaSearchParams(query="tolkien", page=2)
+        )
+        # still running, so its results will be processed as a normal search
+        self.assertEqual(running, {"kcls": self.tasks["kcls"]})
+        self.assertEqual(results, {"lapl": _results(4)})
+        self.assertFalse(self.prefetches.is_prefetch("kcls", self.tasks["kcls"]))
+        self.assertFalse(any(t.cancelled for t in self.tasks.values()))
+        # can only be claimed once
+        self.assertEqual(self.prefetches.claim(self.query), ({}, {}))
+
+    def test_budget(self):
+
+        self.assertTrue(self.prefetches.store("lapl", self.tasks["lapl"], _results(6)))
+        # over budget, so the page is fetched again when asked for
+        self.assertFalse(self.prefetches.store("kcls", self.tasks["kcls"], _results(6)))
+        self.assertTrue(self.prefetches.store("nypl", self.tasks["nypl"], _results(4)))
+        running, results = self.prefetches.claim(self.query)
+        self.assertEqual(running, {})
+        self.assertEqual(sorted(results), ["lapl", "nypl"])
+
+    def test_different_query_discards(self):
+
+        self.prefetches.store("lapl", self.tasks["lapl"], _results(1))
+        running, results = self.prefetches.claim(LibraryMediaSearchParams(query="pratchett", page=2))
+        self.assertEqual((running, results), ({}, {}))
+        self.assertTrue(self.tasks["kcls"].cancelled)
+        self.assertTrue(self.tasks["nypl"].cancelled)
+
+        # a new prefetch replaces the earlier one
+        self.prefetches.start(self.query, self.tasks)
+        new_tasks = {"lapl": _Task()}
+        self.prefetches.start(self.query, new_tasks)
+        self.assertTrue(self.tasks["lapl"].cancelled)
+        self.assertTrue(self.prefetches.is_prefetch("lapl", new_tasks["lapl"]))
+
+
+# Run with:
+# All tests    : calibre-customize -b calibre-plugin && calibre-debug -e tests/search_prefetch_tests.py
+# Specific test: calibre-customize -b calibre-plugin && calibre-debug -e tests/search_prefetch_tests.py -- --method test_claim
+
+if __name__ == "__main__":
+    SearchPrefetchTests.run_tests()
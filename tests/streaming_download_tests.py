@@ -0,0 +1,149 @@
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING :
+    from libby import LibbyClient
+    from network import CircuitBreaker, RetryPolicy
+else :
+    from calibre_plugins.overdrive_libby.libby import LibbyClient
+    from calibre_plugins.overdrive_libby.network import CircuitBreaker, RetryPolicy
+
+from all import RunnableTests
+
+CONTENT = bytes(range(256)) * 1024
+
+
+class _RangeHandler(BaseHTTPRequestHandler):
+    supports_range = True
+    # the first byte sent for a range request, if not the one asked for
+    range_start = None
+    # number of requests to drop before responding
+    drop_requests = 0
+    requests = 0
+
+    def do_GET(self):
+        _RangeHandler.requests += 1
+        if _RangeHandler.drop_requests:
+            _RangeHandler.drop_requests -= 1
+            self.close_connection = True
+            return
+        range_header = self.headers.get("Range")
+        if range_header and self.supports_range:
+            start = int(range_header.split("=")[1].split("-")[0])
+            if start >= len(CONTENT):
+                self.send_response(416)
+                self.send_header("Content-Range", f"bytes */{len(CONTENT)}")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            if self.range_start is not None:
+                start = self.range_start
+            body = CONTENT[start:]
+            self.send_response(206)
+            self.send_header(
+                "Content-Range", f"bytes {start}-{len(CONTENT) - 1}/{len(CONTENT)}"
+            )
+        else:
+            body = CONTENT
+            self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class StreamingDownloadTests(RunnableTests):
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), _RangeHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f"http://127.0.0.1:{self.server.server_port}/book.epub"
+        self.folder = Path(tempfile.mkdtemp())
+        self.client = LibbyClient(max_retries=0, timeout=5)
+
+    def tearDown(self):
+        _RangeHandler.supports_range = True
+        _RangeHandler.range_start = None
+        _RangeHandler.drop_requests = 0
+        _RangeHandler.requests = 0
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_download_to_path(self):
+
+        progress = []
+        destination = self.folder.joinpath("book.epub")
+        self.client._urlretrieve_to_path(
+            self.url, destination, progress=lambda done, total: progress.append((done, total))
+        )
+        self.assertEqual(destination.read_bytes(), CONTENT)
+        self.assertEqual(progress[-1], (len(CONTENT), len(CONTENT)))
+        self.assertFalse(self.folder.joinpath("book.epub.part").exists())
+
+    def test_resume_partial_download(self):
+
+        destination = self.folder.joinpath("book.epub")
+        self.folder.joinpath("book.epub.part").write_bytes(CONTENT[:1000])
+        progress = []
+        self.client._urlretrieve_to_path(
+            self.url, destination, progress=lambda done, total: progress.append((done, total))
+        )
+        self.assertEqual(destination.read_bytes(), CONTENT)
+        # first progress update continues from the partial file
+        self.assertGreater(progress[0][0], 1000)
+
+    def test_restart_if_range_not_supported(self):
+
+        _RangeHandler.supports_range = False
+        destination = self.folder.joinpath("book.epub")
+        self.folder.joinpath("book.epub.part").write_bytes(b"garbage")
+        self.client._urlretrieve_to_path(self.url, destination)
+        self.assertEqual(destination.read_bytes(), CONTENT)
+
+    def test_already_complete(self):
+
+        destination = self.folder.joinpath("book.epub")
+        self.folder.joinpath("book.epub.part").write_bytes(CONTENT)
+        self.client._urlretrieve_to_path(self.url, destination)
+        self.assertEqual(destination.read_bytes(), CONTENT)
+
+    def test_restart_if_partial_file_is_too_long(self):
+
+        destination = self.folder.joinpath("book.epub")
+        self.folder.joinpath("book.epub.part").write_bytes(CONTENT + b"garbage")
+        self.client._urlretrieve_to_path(self.url, destination)
+        self.assertEqual(destination.read_bytes(), CONTENT)
+
+    def test_restart_if_range_does_not_match(self):
+
+        _RangeHandler.range_start = 0
+        destination = self.folder.joinpath("book.epub")
+        self.folder.joinpath("book.epub.part").write_bytes(CONTENT[:1000])
+        self.client._urlretrieve_to_path(self.url, destination)
+        self.assertEqual(destination.read_bytes(), CONTENT)
+
+    def test_retry_with_delay(self):
+
+        _RangeHandler.drop_requests = 2
+        client = LibbyClient(
+            max_retries=2,
+            timeout=5,
+            retry_policy=RetryPolicy(backoff_base=0.01, max_delay=0.02, breaker=CircuitBreaker()),
+        )
+        destination = self.folder.joinpath("book.epub")
+        client._urlretrieve_to_path(self.url, destination)
+        self.assertEqual(destination.read_bytes(), CONTENT)
+        self.assertEqual(_RangeHandler.requests, 3)
+
+
+# Run with:
+# All tests    : calibre-customize -b calibre-plugin && calibre-debug -e tests/streaming_download_tests.py
+# Specific test: calibre-customize -b calibre-plugin && calibre-debug -e tests/streaming_download_tests.py -- --method test_resume_partial_download
+
+if __name__ == "__main__":
+    StreamingDownloadTests.run_tests()
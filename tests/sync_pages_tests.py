@@ -0,0 +1,67 @@
+import threading
+import time
+from typing import TYPE_CHECKING, List
+
+if TYPE_CHECKING :
+    from workers import fetch_pages
+else :
+    from calibre_plugins.overdrive_libby.workers import fetch_pages
+
+from all import RunnableTests
+
+
+class SyncPagesTests(RunnableTests):
+
+    def test_page_order(self):
+
+        def fetch(page: int) -> List[int]:
+            # later pages finish first
+            time.sleep((10 - page) * 0.01)
+            return [page * 10, page * 10 + 1]
+
+        results = fetch_pages(fetch, list(range(1, 10)), max_workers=4)
+        self.assertEqual(results, [[page * 10, page * 10 + 1] for page in range(1, 10)])
+
+    def test_max_workers(self):
+
+        running = []
+        max_running = []
+        lock = threading.Lock()
+
+        def fetch(page: int) -> int:
+            with lock:
+                running.append(page)
+                max_running.append(len(running))
+            time.sleep(0.02)
+            with lock:
+                running.remove(page)
+            return page
+
+        self.assertEqual(fetch_pages(fetch, list(range(8)), max_workers=3), list(range(8)))
+        self.assertLessEqual(max(max_running), 3)
+        self.assertGreater(max(max_running), 1)
+
+        max_running.clear()
+        self.assertEqual(fetch_pages(fetch, list(range(4)), max_workers=1), list(range(4)))
+        self.assertEqual(max(max_running), 1)
+
+    def test_no_pages(self):
+        self.assertEqual(fetch_pages(lambda p: p, [], max_workers=4), [])
+
+    def test_fetch_error(self):
+
+        def fetch(page: int) -> int:
+            if page == 2:
+                raise ValueError(page)
+            return page
+
+        with self.assertRaises(ValueError):
+            fetch_pages(fetch, [1, 2, 3], max_workers=2)
+
+
+# Run with:
+# All tests    : calibre-customize -b calibre-plugin && calibre-debug -e tests/sync_pages_tests.py
+# Specific test: calibre-customize -b calibre-plugin && calibre-debug -e tests/sync_pages_tests.py -- --method test_page_order
+
+if __name__ == "__main__":
+    SyncPagesTests.run_tests()
@@ -0,0 +1,85 @@
+import time
+from threading import Event
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING :
+    from workers import WorkerExecutor, WorkerPriority, WorkerTask
+else :
+    from calibre_plugins.overdrive_libby.workers import WorkerExecutor, WorkerPriority, WorkerTask
+
+from all import RunnableTests
+
+
+class WorkerExecutorTests(RunnableTests):
+
+    def _wait(self, tasks, timeout=5):
+        end = time.monotonic() + timeout
+        while any(t.isRunning() for t in tasks) and time.monotonic() < end:
+            time.sleep(0.01)
+
+    def test_interactive_runs_before_bulk(self):
+
+        executor = WorkerExecutor(max_workers=1, reserved_workers=0)
+        release = Event()
+        order = []
+        blocker = WorkerTask(release.wait, executor=executor)
+        blocker.start()
+        time.sleep(0.05)
+        tasks = [
+            WorkerTask(lambda: order.append("bulk"), WorkerPriority.Bulk, executor=executor),
+            WorkerTask(lambda: order.append("interactive"), WorkerPriority.Interactive, executor=executor),
+        ]
+        for t in tasks:
+            t.start()
+        self.assertTrue(all(t.isRunning() for t in tasks))
+        release.set()
+        self._wait(tasks)
+        self.assertEqual(order, ["interactive", "bulk"])
+
+    def test_bulk_tasks_leave_reserved_workers(self):
+
+        executor = WorkerExecutor(max_workers=3, reserved_workers=1)
+        release = Event()
+        bulk = [
+            WorkerTask(release.wait, WorkerPriority.Bulk, executor=executor)
+            for _ in range(4)
+        ]
+        for t in bulk:
+            t.start()
+        done = Event()
+        preview = WorkerTask(done.set, WorkerPriority.Interactive, executor=executor)
+        preview.start()
+        # runs even though there are bulk tasks waiting
+        self.assertTrue(done.wait(2))
+        release.set()
+        self._wait(bulk)
+        self.assertFalse(any(t.isRunning() for t in bulk))
+
+    def test_cancel_group(self):
+
+        executor = WorkerExecutor(max_workers=1, reserved_workers=0)
+        release = Event()
+        ran = []
+        search = object()
+        running = WorkerTask(release.wait, WorkerPriority.Bulk, group=search, executor=executor)
+        running.start()
+        time.sleep(0.05)
+        queued = [
+            WorkerTask(lambda: ran.append(1), WorkerPriority.Bulk, group=search, executor=executor)
+            for _ in range(3)
+        ]
+        for t in queued:
+            t.start()
+        self.assertEqual(executor.cancel_group(search), 4)
+        self.assertTrue(running.cancelled)
+        release.set()
+        time.sleep(0.1)
+        self.assertEqual(ran, [])
+
+
+# Run with:
+# All tests    : calibre-customize -b calibre-plugin && calibre-debug -e tests/worker_executor_tests.py
+# Specific test: calibre-customize -b calibre-plugin && calibre-debug -e tests/worker_executor_tests.py -- --method test_cancel_group
+
+if __name__ == "__main__":
+    WorkerExecutorTests.run_tests()